@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time : 2025/9/9 10:40
+# @Author : 桐
+# @QQ:1041264242
+# 注意事项：仅压缩能获取到全文的论文，压缩结果按论文ID与实际作答的模型缓存，任何任务再次遇到同一论文时直接复用
+import asyncio
+import logging
+from typing import Any, Callable, Dict, List, Optional
+
+from app.core.config import settings
+from app.core.router import acall_routed_with_model, get_router
+from app.core.tpl import render_template_async, template_registry
+from app.utils.compression_cache import get_compression_cache
+from app.utils.llm_client import run_sync
+from app.utils.prompt_packer import context_window, count_tokens, truncate_to_tokens
+
+logger = logging.getLogger(__name__)
+
+COMPRESSION_TEMPLATE = "prompt/paper_compression_prompt.tpl"
+
+
+def template_digest(template_name: str = COMPRESSION_TEMPLATE) -> str:
+    """获取模板源码摘要（服务启动预编译模板时已计算），模板修改后缓存自动失效"""
+    return template_registry.digest(template_name)
+
+
+async def acompress_papers(papers: List[Dict[str, Any]],
+                           load_full_text: Optional[Callable[[Dict[str, Any]], Optional[str]]] = None
+                           ) -> Dict[str, Any]:
+    """
+    并发压缩论文全文（异步），请求经模型路由器发出，压缩结果按实际作答的模型缓存
+
+    Args:
+        papers: 论文列表
+        load_full_text: 获取论文全文的函数（在线程池中调用），为空时只使用论文中已有的full_text字段
+
+    Returns:
+        Dict[str, Any]: compressed(论文ID -> 压缩结果)、models(论文ID -> 作答模型)及缓存命中、失败等统计
+    """
+    digest = template_digest()
+    cache = get_compression_cache()
+    paper_ids = [paper["id"] for paper in papers if paper.get("id")]
+
+    # 按路由顺序读取各候选模型的缓存，同一论文优先使用排序靠前的模型的结果
+    router = get_router()
+    candidates = list(dict.fromkeys(router.routes[name]["model_name"] for name in router.stage_routes("compression")))
+    compressed: Dict[str, str] = {}
+    models: Dict[str, str] = {}
+    for model in candidates:
+        missing = [paper_id for paper_id in paper_ids if paper_id not in compressed]
+        if not missing:
+            break
+        for paper_id, summary in (await cache.aget_many(missing, model, digest)).items():
+            compressed[paper_id] = summary
+            models[paper_id] = model
+    cache_hits = len(compressed)
+
+    # 全文按上下文窗口最小的候选模型截断，保证路由到任一模型都装得下
+    system_prompt = await render_template_async(COMPRESSION_TEMPLATE)
+    budget_model = min(candidates, key=context_window)
+    text_budget = (context_window(budget_model) - settings.PROMPT_OUTPUT_RESERVE
+                   - count_tokens(system_prompt, budget_model))
+    semaphore = asyncio.Semaphore(settings.COMPRESSION_CONCURRENCY)
+    loop = asyncio.get_running_loop()
+    failed: List[str] = []
+    missing_text: List[str] = []
+
+    async def compress(paper: Dict[str, Any]):
+        paper_id = paper["id"]
+        # 全文加载由加载函数自身限制并发，信号量只限制LLM请求
+        full_text = paper.get("full_text")
+        if not full_text and load_full_text is not None:
+            full_text = await loop.run_in_executor(None, load_full_text, paper)
+        if not full_text:
+            missing_text.append(paper_id)
+            return
+        try:
+            # 对整篇全文分词截断耗时较长，在线程池中执行，不阻塞事件循环
+            question = await loop.run_in_executor(None, truncate_to_tokens, full_text, text_budget, budget_model)
+            async with semaphore:
+                summary, model = await acall_routed_with_model(system_prompt, question, stage="compression")
+        except Exception as e:
+            logger.warning(f"论文 {paper_id} 压缩失败: {e!r}")
+            failed.append(paper_id)
+            return
+        if summary:
+            compressed[paper_id] = summary
+            models[paper_id] = model
+            await cache.aset(paper_id, model, digest, summary)
+
+    pending = [paper for paper in papers if paper.get("id") and paper["id"] not in compressed]
+    await asyncio.gather(*(compress(paper) for paper in pending))
+    logger.info(f"论文压缩完成: 共 {len(paper_ids)} 篇，缓存命中 {cache_hits} 篇，"
+                f"新压缩 {len(compressed) - cache_hits} 篇，无全文 {len(missing_text)} 篇，失败 {len(failed)} 篇")
+
+    return {
+        "compressed": compressed,
+        "models": models,
+        "template_digest": digest,
+        "cache_hits": cache_hits,
+        "missing_full_text": missing_text,
+        "failed": failed,
+    }
+
+
+def compress_papers(papers: List[Dict[str, Any]],
+                    load_full_text: Optional[Callable[[Dict[str, Any]], Optional[str]]] = None) -> Dict[str, Any]:
+    """并发压缩论文全文（同步包装）"""
+    return run_sync(acompress_papers(papers, load_full_text))
+
+
+def apply_compression(papers: List[Dict[str, Any]], compressed: Dict[str, str]) -> List[Dict[str, Any]]:
+    """为论文附加压缩后的全文要点，返回新的论文列表"""
+    return [
+        dict(paper, compressed=compressed[paper["id"]]) if paper.get("id") in compressed else paper
+        for paper in papers
+    ]
@@ -5,7 +5,12 @@
 # @QQ:1041264242
 # 注意事项：
 import os
-from pydantic import BaseSettings
+
+try:
+    from pydantic_settings import BaseSettings
+except ImportError:
+    # pydantic 1.x
+    from pydantic import BaseSettings
 
 class Settings(BaseSettings):
     """
@@ -27,9 +32,158 @@ class Settings(BaseSettings):
     OPENAI_API_KEY: str = ""
     OPENAI_BASE_URL: str = "https://api.openai.com/v1"
     
+    # 模型服务配置
+    DEEPSEEK_API_TOKEN: str = ""
+    DEEPSEEK_BASE_URL: str = "https://api.deepseek.com"
+    QWEN_API_TOKEN: str = ""
+    QWEN_BASE_URL: str = "https://dashscope.aliyuncs.com/compatible-mode/v1"
+    LLM_TIMEOUT: float = 120.0
+    LLM_MAX_CONNECTIONS: int = 32
+    LLM_MAX_KEEPALIVE_CONNECTIONS: int = 16
+    LLM_KEEPALIVE_EXPIRY: float = 60.0
+    # LLM调用单价（元/百万token），用于估算费用，未配置单价的模型不计费用
+    LLM_PRICES: dict = {
+        "deepseek-chat": {"input": 2.0, "output": 8.0},
+        "qwen-max": {"input": 2.4, "output": 9.6},
+        "qwen-plus": {"input": 0.8, "output": 2.0},
+    }
+    
+    # 模型路由配置：按滚动延迟与错误率在候选模型间选择，名称为deepseek/qwen或MoA配置中的config_name
+    ROUTER_MODELS: list = ["deepseek", "qwen"]
+    ROUTER_WINDOW: int = 100
+    ROUTER_WINDOW_SECONDS: float = 600.0
+    ROUTER_MIN_SAMPLES: int = 5
+    ROUTER_MAX_ERROR_RATE: float = 0.5
+    ROUTER_MAX_ATTEMPTS: int = 2
+    # 对冲请求：主路由超过其p95（不低于下限）未返回时向次优路由发出相同请求，先返回者胜出
+    ROUTER_HEDGE_ENABLED: bool = False
+    ROUTER_HEDGE_MIN_DELAY: float = 2.0
+    ROUTER_EXPLORE_RATE: float = 0.05
+    
+    # LLM请求限流：按服务提供方（deepseek/qwen或MoA配置的config_name）限制每分钟请求数(rpm)、
+    # 每分钟token数(tpm)与并发数(max_in_flight)，0表示不限制；未单独配置的提供方使用default项，按账户限额调整
+    LLM_RATE_LIMIT_ENABLED: bool = True
+    LLM_RATE_LIMITS: dict = {
+        "default": {"rpm": 0, "tpm": 0, "max_in_flight": 16},
+        "deepseek": {"rpm": 0, "tpm": 0, "max_in_flight": 32},
+        "qwen": {"rpm": 1200, "tpm": 1000000, "max_in_flight": 16},
+    }
+    LLM_RATE_BURST_SECONDS: float = 1.0
+    # SDK自身重试后仍返回429时，经限流器重新排队的次数
+    LLM_RATE_LIMIT_RETRIES: int = 2
+    # 收到429后速率乘以DECREASE，冷却期过后每秒恢复INCREASE（相对配置速率）
+    LLM_RATE_DECREASE: float = 0.8
+    LLM_RATE_INCREASE: float = 0.05
+    LLM_RATE_MIN_SCALE: float = 0.1
+    LLM_RATE_COOLDOWN: float = 5.0
+    
+    # 熔断：同一服务地址连续失败（连接错误、超时、5xx）达到阈值后熔断，期间请求立即失败；
+    # 熔断时间过后放行探测请求，探测成功则恢复，失败则熔断时间加倍（不超过上限）
+    CIRCUIT_BREAKER_ENABLED: bool = True
+    CIRCUIT_FAILURE_THRESHOLD: int = 5
+    CIRCUIT_RESET_TIMEOUT: float = 30.0
+    CIRCUIT_MAX_RESET_TIMEOUT: float = 300.0
+    CIRCUIT_HALF_OPEN_PROBES: int = 1
+    # 各阶段的模型回退链（facts / compression / hypothesis / optimization），按顺序尝试并跳过已熔断的模型，
+    # 名称同ROUTER_MODELS；未配置的阶段按路由器的延迟排序选择模型
+    LLM_STAGE_FALLBACKS: dict = {}
+    
+    # 流式请求：事实提取（单次）、假设生成、优化阶段的回复边生成边写入任务的partial字段
+    LLM_STREAM_ENABLED: bool = True
+    # 部分结果写入任务状态的最小间隔（秒）
+    LLM_STREAM_PARTIAL_INTERVAL: float = 0.5
+    # 流式请求附带stream_options.include_usage以获取token用量，服务不支持该参数时关闭
+    LLM_STREAM_INCLUDE_USAGE: bool = True
+    
+    # 提示词token预算配置
+    LLM_CONTEXT_WINDOWS: dict = {
+        "deepseek-chat": 65536,
+        "qwen-max-2025-01-25": 32768,
+        "gemini-2.5-flash": 1048576,
+    }
+    LLM_DEFAULT_CONTEXT_WINDOW: int = 32768
+    PROMPT_OUTPUT_RESERVE: int = 4096
+    PROMPT_PAPERS_MAX_TOKENS: int = 16000
+    PROMPT_MIN_ABSTRACT_TOKENS: int = 64
+    
+    # 事实提取map-reduce配置：论文数超过阈值或超出单次提示词预算时分块并发提取
+    FACTS_MAP_REDUCE_THRESHOLD: int = 20
+    FACTS_CHUNK_TOKENS: int = 6000
+    FACTS_CHUNK_MAX_PAPERS: int = 10
+    FACTS_MAP_CONCURRENCY: int = 4
+    FACTS_REDUCE_FAN_IN: int = 4
+    
+    # 论文全文压缩配置（可选阶段，默认关闭）
+    COMPRESSION_ENABLED: bool = False
+    COMPRESSION_CONCURRENCY: int = 4
+    COMPRESSION_CACHE_ENABLED: bool = True
+    COMPRESSION_CACHE_PATH: str = "temp/cache/compression_cache.sqlite3"
+    
+    # 论文PDF下载与文本提取配置
+    PDF_CACHE_DIR: str = "temp/pdf_cache"
+    PDF_DOWNLOAD_CONCURRENCY: int = 4
+    PDF_DOWNLOAD_TIMEOUT: float = 60.0
+    PDF_MAX_BYTES: int = 50 * 1024 * 1024
+    PDF_EXTRACT_WORKERS: int = 2
+    PDF_MAX_PAGES: int = 40
+    
+    # LLM响应缓存配置
+    LLM_CACHE_ENABLED: bool = True
+    LLM_CACHE_PATH: str = "temp/cache/llm_cache.sqlite3"
+    LLM_CACHE_TTL: int = 7 * 24 * 3600
+    LLM_CACHE_MEMORY_SIZE: int = 256
+    LLM_CACHE_MAX_ENTRIES: int = 20000
+    LLM_CACHE_MAX_BYTES: int = 512 * 1024 * 1024
+    
+    # 任务执行配置
+    TASK_WORKERS: int = 4
+    TASK_MAX_SEARCH_PAPERS: int = 100
+    TASK_QUEUE_SIZE: int = 64
+    TASK_ESTIMATED_DURATION: float = 180.0
+    TASK_STORE_BACKEND: str = "sqlite"
+    TASK_STORE_PATH: str = "temp/tasks.sqlite3"
+    # 流式部分结果递增的任务版本号批量落盘的间隔（秒）
+    TASK_VERSION_FLUSH_INTERVAL: float = 1.0
+    TASK_RESULT_DIR: str = "temp/results"
+    TASK_MEMORY_MAX_FINISHED: int = 100
+    TASK_MEMORY_TTL: float = 1800.0
+    TASK_COALESCE_ENABLED: bool = True
+    TASK_COALESCE_WINDOW: float = 300.0
+    TASK_CHECKPOINT_DIR: str = "temp/checkpoints"
+    TASK_CHECKPOINT_TTL: float = 7 * 24 * 3600
+    
+    # 批量任务配置：多个关键词共享检索与事实提取，假设生成与优化按关键词并发执行
+    BATCH_MAX_KEYWORDS: int = 10
+    BATCH_SEARCH_CONCURRENCY: int = 4
+    BATCH_KEYWORD_CONCURRENCY: int = 4
+    
+    # MoA(Mixture of Agents)配置
+    MOA_PROPOSERS: list = ["qwen-max-2025-01-25", "deepseek-chat", "gemini-2.5-flash"]
+    MOA_AGGREGATOR: str = "deepseek-chat"
+    MOA_QUORUM: int = 2
+    MOA_MODEL_TIMEOUT: float = 90.0
+    
     # ArXiv API配置
     ARXIV_MAX_RESULTS: int = 10
     ARXIV_TIMEOUT: int = 30
+    ARXIV_API_URL: str = "http://export.arxiv.org/api/query"
+    ARXIV_PAGE_SIZE: int = 100
+    ARXIV_PAGE_INTERVAL: float = 3.0
+    ARXIV_CACHE_ENABLED: bool = True
+    ARXIV_CACHE_PATH: str = "temp/cache/arxiv_cache.sqlite3"
+    ARXIV_CACHE_TTL: int = 24 * 3600
+    
+    # 本地论文检索配置
+    # remote: 优先ArXiv，远程失败时回退本地索引; local_first: 本地索引结果不足时再请求ArXiv; offline: 仅本地索引
+    PAPER_SEARCH_MODE: str = "remote"
+    PAPER_INDEX_PATH: str = "temp/cache/paper_index.bin"
+    PAPER_INDEX_FLUSH_DOCS: int = 200
+    
+    # 提示词模板字节码缓存目录，相对路径按项目根目录解析，服务启动预编译模板时创建
+    TEMPLATE_CACHE_DIR: str = "temp/jinja_cache"
+    
+    # 输出目录
+    OUTPUT_PATH: str = "temp"
     
     # 日志配置
     LOG_LEVEL: str = "INFO"
@@ -42,4 +196,8 @@ def get_config():
     """获取配置实例"""
     return Settings()
 
-settings = Settings()
\ No newline at end of file
+settings = Settings()
+
+DEEPSEEK_API_KEY = settings.DEEPSEEK_API_TOKEN
+QWEN_API_KEY = settings.QWEN_API_TOKEN
+OUTPUT_PATH = settings.OUTPUT_PATH
@@ -0,0 +1,427 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time : 2025/9/8 11:20
+# @Author : 桐
+# @QQ:1041264242
+# 注意事项：论文按token预算分块后并发提取事实(map)，再逐层合并各块的事实列表(reduce)，直到只剩一份；
+#          StreamingFactMapper在检索分页返回时即提交已凑满的块；
+#          批量任务中去重后的论文只提取一次，各关键词只合并自己论文所在的分块（装得下时直接拼接）
+import asyncio
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.core.config import settings
+from app.core.router import acall_routed
+from app.core.tpl import render_template_async
+from app.utils.llm_api import DEEPSEEK_MODEL
+from app.utils.llm_client import get_provider_loop, run_sync
+from app.utils.prompt_packer import count_tokens, count_tokens_batch, pack_papers, paper_tokens
+
+logger = logging.getLogger(__name__)
+
+FACT_MERGE_TEMPLATE = "prompt/fact_merge_prompt.tpl"
+
+
+def chunk_papers(papers: List[Dict[str, Any]], chunk_tokens: int, model_name: str = DEEPSEEK_MODEL,
+                 max_papers: int = 0) -> List[List[Dict[str, Any]]]:
+    """
+    按token预算将论文顺序切分为若干块
+
+    Args:
+        papers: 论文列表
+        chunk_tokens: 每块论文部分的token上限
+        model_name: 模型名称
+        max_papers: 每块最多论文数，0表示不限
+
+    Returns:
+        List[List[Dict]]: 论文块列表，单篇超出上限的论文独占一块（装块时再截断摘要）
+    """
+    chunks: List[List[Dict[str, Any]]] = []
+    current: List[Dict[str, Any]] = []
+    current_tokens = 0
+    for paper, tokens in zip(papers, paper_tokens(papers, model_name)):
+        full = current and (current_tokens + tokens > chunk_tokens or (max_papers and len(current) >= max_papers))
+        if full:
+            chunks.append(current)
+            current, current_tokens = [], 0
+        current.append(paper)
+        current_tokens += tokens
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def group_texts(texts: List[str], tokens: List[int], budget: int, fan_in: int) -> List[List[str]]:
+    """按token预算和最大合并数将事实列表分组，每组至少包含一项"""
+    groups: List[List[str]] = []
+    current: List[str] = []
+    current_tokens = 0
+    for text, count in zip(texts, tokens):
+        if current and (current_tokens + count > budget or len(current) >= fan_in):
+            groups.append(current)
+            current, current_tokens = [], 0
+        current.append(text)
+        current_tokens += count
+    if current:
+        groups.append(current)
+    return groups
+
+
+async def _bounded(semaphore: asyncio.Semaphore, coro):
+    async with semaphore:
+        return await coro
+
+
+async def areduce_facts(partials: List[str], question_prefix: str, semaphore: asyncio.Semaphore,
+                        model_name: str = DEEPSEEK_MODEL) -> Tuple[str, Dict[str, int]]:
+    """
+    逐层合并多份事实列表，直到只剩一份（异步）
+
+    Args:
+        partials: 各块提取出的事实列表，至少一份
+        question_prefix: 合并请求的问题前缀（关键词）
+        semaphore: 限制合并请求并发数的信号量
+        model_name: 模型名称，用于token计数
+
+    Returns:
+        Tuple[str, Dict[str, int]]: (合并后的事实列表, {levels, calls, input_tokens})
+    """
+    merge_prompt = await render_template_async(FACT_MERGE_TEMPLATE)
+    merge_prompt_tokens = count_tokens(merge_prompt, model_name)
+    reduce_tokens = 0
+    levels = 0
+    calls = 0
+    while len(partials) > 1:
+        levels += 1
+        groups = group_texts(partials, count_tokens_batch(partials, model_name),
+                             settings.FACTS_CHUNK_TOKENS, max(settings.FACTS_REDUCE_FAN_IN, 2))
+        if len(groups) == len(partials):
+            # 单份事实列表已超出预算，强制两两合并以保证逐层收敛
+            groups = [partials[i:i + 2] for i in range(0, len(partials), 2)]
+        # 只有一份的分组无需合并，直接进入下一层
+        merge_questions = [
+            question_prefix + "\n\n".join(f"## Fact List {i}\n{text}" for i, text in enumerate(group, 1))
+            for group in groups if len(group) > 1
+        ]
+        reduce_tokens += merge_prompt_tokens * len(merge_questions) + sum(count_tokens_batch(merge_questions, model_name))
+        calls += len(merge_questions)
+        logger.info(f"第 {levels} 层合并: {len(partials)} 份事实列表 -> {len(groups)} 份")
+
+        merged = iter(await asyncio.gather(
+            *(_bounded(semaphore, acall_routed(merge_prompt, question, stage="facts")) for question in merge_questions),
+            return_exceptions=True,
+        ))
+        next_partials = []
+        for group in groups:
+            if len(group) == 1:
+                next_partials.append(group[0])
+                continue
+            result = next(merged)
+            if isinstance(result, BaseException) or not result:
+                # 合并失败时保留原始事实列表拼接结果，不丢失信息
+                logger.warning(f"事实列表合并失败，保留未合并内容: {result!r}")
+                next_partials.append("\n".join(group))
+            else:
+                next_partials.append(result)
+        partials = next_partials
+    return partials[0], {"levels": levels, "calls": calls, "input_tokens": reduce_tokens}
+
+
+async def _areduce_map_results(chunks: List[List[Dict[str, Any]]], questions: List[str], chunk_texts: List[str],
+                               results: List[Any], system_prompt: str, question_prefix: str,
+                               semaphore: asyncio.Semaphore, model_name: str) -> Tuple[str, Dict[str, Any]]:
+    """汇总各块的map结果并逐层合并，返回值同amap_reduce_facts"""
+    partials = []
+    failed_chunks = []
+    used_chunks = []
+    for i, result in enumerate(results):
+        if isinstance(result, BaseException):
+            logger.warning(f"第 {i + 1} 块事实提取失败: {result!r}")
+            failed_chunks.append(i + 1)
+        elif result:
+            partials.append(result)
+            used_chunks.append(i)
+    if not partials:
+        raise RuntimeError(f"全部 {len(chunks)} 块事实提取均失败")
+
+    system_tokens = count_tokens(system_prompt, model_name)
+    map_tokens = system_tokens * len(questions) + sum(count_tokens_batch(questions, model_name))
+
+    # reduce: 逐层合并，直到只剩一份事实列表
+    facts, reduce_stats = await areduce_facts(partials, question_prefix, semaphore, model_name)
+
+    stats = {
+        "chunks": len(chunks),
+        "chunk_sizes": [len(chunk) for chunk in chunks],
+        "failed_chunks": failed_chunks,
+        "papers_used": sum(len(chunks[i]) for i in used_chunks),
+        "papers_text": "\n\n".join(chunk_texts[i] for i in used_chunks),
+        "reduce_levels": reduce_stats["levels"],
+        "map_input_tokens": map_tokens,
+        "reduce_input_tokens": reduce_stats["input_tokens"],
+    }
+    return facts, stats
+
+
+async def amap_reduce_facts(papers: List[Dict[str, Any]], keyword: str, system_prompt: str,
+                            model_name: str = DEEPSEEK_MODEL) -> Tuple[str, Dict[str, Any]]:
+    """
+    分块并发提取事实并逐层合并（异步）
+
+    Args:
+        papers: 按相关度排序的论文列表
+        keyword: 研究关键词
+        system_prompt: 事实提取系统提示词
+        model_name: 模型名称，用于token计数
+
+    Returns:
+        Tuple[str, Dict[str, Any]]: (合并后的事实列表, 分块与token统计)，统计中的papers_used与papers_text
+        只计入提取成功的分块
+
+    Raises:
+        RuntimeError: 所有分块的事实提取均失败
+    """
+    semaphore = asyncio.Semaphore(settings.FACTS_MAP_CONCURRENCY)
+    chunks = chunk_papers(papers, settings.FACTS_CHUNK_TOKENS, model_name, settings.FACTS_CHUNK_MAX_PAPERS)
+    question_prefix = f"关键词: {keyword}\n"
+
+    # map: 各块独立提取事实，论文编号在各块之间连续
+    questions = []
+    chunk_texts = []
+    start_index = 1
+    for chunk in chunks:
+        papers_text, _ = pack_papers(chunk, model_name, budget=settings.FACTS_CHUNK_TOKENS, start_index=start_index)
+        questions.append(question_prefix + papers_text)
+        chunk_texts.append(papers_text)
+        start_index += len(chunk)
+    logger.info(f"事实提取分为 {len(chunks)} 块，并发数 {settings.FACTS_MAP_CONCURRENCY}")
+
+    results = await asyncio.gather(
+        *(_bounded(semaphore, acall_routed(system_prompt, question, stage="facts")) for question in questions),
+        return_exceptions=True,
+    )
+    return await _areduce_map_results(chunks, questions, chunk_texts, results, system_prompt, question_prefix,
+                                      semaphore, model_name)
+
+
+class StreamingFactMapper:
+    """
+    检索过程中逐页接收论文，凑满一块（规则同chunk_papers）即在后台事件循环中提交该块的事实提取(map)，
+    检索结束后提交剩余论文并逐层合并(reduce)，使事实提取与ArXiv分页检索重叠
+    """
+
+    def __init__(self, keyword: str, system_prompt: str, model_name: str = DEEPSEEK_MODEL):
+        """
+        Args:
+            keyword: 研究关键词
+            system_prompt: 事实提取系统提示词
+            model_name: 模型名称，用于token计数
+        """
+        self.system_prompt = system_prompt
+        self.model_name = model_name
+        self.question_prefix = f"关键词: {keyword}\n"
+        self._lock = threading.Lock()
+        self._papers: List[Dict[str, Any]] = []
+        self._current: List[Dict[str, Any]] = []
+        self._current_tokens = 0
+        self._chunks: List[List[Dict[str, Any]]] = []
+        self._questions: List[str] = []
+        self._chunk_texts: List[str] = []
+        self._futures: List[Future] = []
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    def feed(self, papers: List[Dict[str, Any]]):
+        """
+        接收一页检索结果（检索线程中调用），凑满的块立即提交提取
+
+        Args:
+            papers: 本页论文（按相关度排序，与检索结果顺序一致）
+        """
+        if not papers:
+            return
+        tokens = paper_tokens(papers, self.model_name)
+        with self._lock:
+            for paper, count in zip(papers, tokens):
+                full = self._current and (self._current_tokens + count > settings.FACTS_CHUNK_TOKENS
+                                          or len(self._current) >= settings.FACTS_CHUNK_MAX_PAPERS)
+                if full:
+                    self._submit()
+                self._current.append(paper)
+                self._current_tokens += count
+                self._papers.append(paper)
+
+    def _submit(self):
+        """提交当前块（持有self._lock时调用），论文编号在各块之间连续"""
+        chunk, self._current, self._current_tokens = self._current, [], 0
+        start_index = sum(len(done) for done in self._chunks) + 1
+        papers_text, _ = pack_papers(chunk, self.model_name, budget=settings.FACTS_CHUNK_TOKENS,
+                                     start_index=start_index)
+        question = self.question_prefix + papers_text
+        self._chunks.append(chunk)
+        self._questions.append(question)
+        self._chunk_texts.append(papers_text)
+        self._futures.append(asyncio.run_coroutine_threadsafe(self._amap(question), get_provider_loop()))
+        logger.info(f"检索中提交第 {len(self._chunks)} 块事实提取（{len(chunk)} 篇论文）")
+
+    async def _amap(self, question: str) -> str:
+        # 信号量在后台事件循环中创建，map与reduce共用
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(settings.FACTS_MAP_CONCURRENCY)
+        return await _bounded(self._semaphore, acall_routed(self.system_prompt, question, stage="facts"))
+
+    def matches(self, papers: List[Dict[str, Any]]) -> bool:
+        """已接收的论文是否与待提取的论文一致（顺序相同的同一批论文）"""
+        with self._lock:
+            fed = [paper_key(paper) for paper in self._papers]
+        return bool(papers) and [paper_key(paper) for paper in papers] == fed
+
+    def cancel(self):
+        """放弃已提交的提取（如待提取的论文与检索结果不一致时）"""
+        with self._lock:
+            for future in self._futures:
+                future.cancel()
+
+    async def _afinish(self) -> Tuple[str, Dict[str, Any]]:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(settings.FACTS_MAP_CONCURRENCY)
+        results = await asyncio.gather(*(asyncio.wrap_future(future) for future in self._futures),
+                                       return_exceptions=True)
+        return await _areduce_map_results(self._chunks, self._questions, self._chunk_texts, list(results),
+                                          self.system_prompt, self.question_prefix, self._semaphore, self.model_name)
+
+    def finish(self) -> Tuple[str, Dict[str, Any]]:
+        """
+        提交剩余论文，等待全部分块提取完成后逐层合并
+
+        Returns:
+            Tuple[str, Dict[str, Any]]: 同amap_reduce_facts，统计中附带streamed_chunks（检索结束前已提交的块数）
+
+        Raises:
+            RuntimeError: 所有分块的事实提取均失败
+        """
+        with self._lock:
+            streamed = len(self._chunks)
+            if self._current:
+                self._submit()
+        logger.info(f"事实提取共 {len(self._chunks)} 块，其中 {streamed} 块在检索结束前已提交")
+        facts, stats = run_sync(self._afinish())
+        stats["streamed_chunks"] = streamed
+        return facts, stats
+
+
+def paper_key(paper: Dict[str, Any]) -> str:
+    """论文去重键：ArXiv条目ID，缺失时退回归一化标题"""
+    return paper.get("id") or " ".join(str(paper.get("title", "")).split()).casefold()
+
+
+def group_shared_papers(papers_by_keyword: Dict[str, List[Dict[str, Any]]]
+                        ) -> List[Tuple[Tuple[str, ...], List[Dict[str, Any]]]]:
+    """
+    跨关键词去重论文，并按"检索到该论文的关键词集合"分组
+
+    同一组内的论文只属于同一批关键词，分块提取出的事实因此可以原样归属到这些关键词
+
+    Args:
+        papers_by_keyword: 关键词到检索结果的映射（保持关键词顺序）
+
+    Returns:
+        List[Tuple[Tuple[str, ...], List[Dict]]]: [(关键词元组, 论文列表)]，按论文首次出现的顺序排列
+    """
+    owners: Dict[str, List[str]] = {}
+    unique: Dict[str, Dict[str, Any]] = {}
+    for keyword, papers in papers_by_keyword.items():
+        for paper in papers:
+            key = paper_key(paper)
+            unique.setdefault(key, paper)
+            if keyword not in owners.setdefault(key, []):
+                owners[key].append(keyword)
+
+    groups: Dict[Tuple[str, ...], List[Dict[str, Any]]] = {}
+    for key, paper in unique.items():
+        groups.setdefault(tuple(owners[key]), []).append(paper)
+    return list(groups.items())
+
+
+async def aextract_shared_facts(papers_by_keyword: Dict[str, List[Dict[str, Any]]], system_prompt: str,
+                                model_name: str = DEEPSEEK_MODEL
+                                ) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """
+    为多个关键词共享提取事实（异步）：每篇去重后的论文只参与一次提取，
+    各关键词再合并其论文所在分块的事实列表
+
+    Args:
+        papers_by_keyword: 关键词到检索结果的映射
+        system_prompt: 事实提取系统提示词
+        model_name: 模型名称，用于token计数
+
+    Returns:
+        Tuple[Dict[str, Any], Dict[str, Any]]: (关键词到 (事实列表, 统计) 或异常的映射, 整批的分块与token统计)
+    """
+    semaphore = asyncio.Semaphore(settings.FACTS_MAP_CONCURRENCY)
+    groups = group_shared_papers(papers_by_keyword)
+
+    # map: 分组内按token预算分块，论文编号在全部分块之间连续
+    chunk_owners: List[Tuple[str, ...]] = []
+    chunk_sizes: List[int] = []
+    questions = []
+    start_index = 1
+    for keywords, papers in groups:
+        for chunk in chunk_papers(papers, settings.FACTS_CHUNK_TOKENS, model_name, settings.FACTS_CHUNK_MAX_PAPERS):
+            papers_text, _ = pack_papers(chunk, model_name, budget=settings.FACTS_CHUNK_TOKENS,
+                                         start_index=start_index)
+            questions.append(f"关键词: {'; '.join(keywords)}\n" + papers_text)
+            chunk_owners.append(keywords)
+            chunk_sizes.append(len(chunk))
+            start_index += len(chunk)
+    logger.info(f"{len(papers_by_keyword)} 个关键词共 {start_index - 1} 篇去重论文，事实提取分为 {len(questions)} 块")
+
+    results = await asyncio.gather(
+        *(_bounded(semaphore, acall_routed(system_prompt, question, stage="facts")) for question in questions),
+        return_exceptions=True,
+    )
+    failed_chunks = []
+    for i, result in enumerate(results):
+        if isinstance(result, BaseException):
+            logger.warning(f"第 {i + 1} 块事实提取失败: {result!r}")
+            failed_chunks.append(i + 1)
+
+    async def reduce_keyword(keyword: str) -> Tuple[str, Dict[str, Any]]:
+        owned = [i for i, owners in enumerate(chunk_owners) if keyword in owners]
+        partials = [results[i] for i in owned if not isinstance(results[i], BaseException) and results[i]]
+        if not partials:
+            raise RuntimeError(f"关键词 {keyword} 的 {len(owned)} 块事实提取均失败" if owned
+                               else f"关键词 {keyword} 没有可提取事实的论文")
+        if sum(count_tokens_batch(partials, model_name)) <= settings.FACTS_CHUNK_TOKENS:
+            # 各分块的论文互不重复，装得下时直接拼接，不再额外调用模型合并
+            facts, reduce_stats = "\n".join(partials), {"levels": 0, "calls": 0, "input_tokens": 0}
+        else:
+            facts, reduce_stats = await areduce_facts(partials, f"关键词: {keyword}\n", semaphore, model_name)
+        return facts, {
+            "chunks": [i + 1 for i in owned],
+            "failed_chunks": [i + 1 for i in owned if i + 1 in failed_chunks],
+            "reduce_levels": reduce_stats["levels"],
+            "reduce_calls": reduce_stats["calls"],
+            "reduce_input_tokens": reduce_stats["input_tokens"],
+        }
+
+    keywords = list(papers_by_keyword)
+    reduced = await asyncio.gather(*(reduce_keyword(keyword) for keyword in keywords), return_exceptions=True)
+    per_keyword = dict(zip(keywords, reduced))
+
+    system_tokens = count_tokens(system_prompt, model_name)
+    reduce_stats = [value[1] for value in reduced if not isinstance(value, BaseException)]
+    stats = {
+        "papers_total": sum(len(papers) for papers in papers_by_keyword.values()),
+        "papers_unique": start_index - 1,
+        "paper_groups": len(groups),
+        "chunks": len(questions),
+        "chunk_sizes": chunk_sizes,
+        "failed_chunks": failed_chunks,
+        "map_calls": len(questions),
+        "reduce_calls": sum(item["reduce_calls"] for item in reduce_stats),
+        "map_input_tokens": system_tokens * len(questions) + sum(count_tokens_batch(questions, model_name)),
+        "reduce_input_tokens": sum(item["reduce_input_tokens"] for item in reduce_stats),
+    }
+    return per_keyword, stats
@@ -4,18 +4,17 @@
 # @Author : 桐
 # @QQ:1041264242
 # 注意事项：
-import warnings
-import agentscope
-from agentscope import msghub
-from agentscope.agents import DialogAgent, UserAgent
-from agentscope.message import Msg
-from app.core.config import OUTPUT_PATH
+import asyncio
+import logging
+from app.core.config import OUTPUT_PATH, settings
 import os
-from app.core.tpl import tpl_env
+from app.core.tpl import template_registry
+from app.utils.circuit_breaker import endpoint_available, get_circuit_breaker
+from app.utils.llm_api import acall_with_model_config, model_config_connection
+from app.utils.llm_client import run_sync
+from app.utils.streaming import partial_writer
 
-# 抑制SQLAlchemy相关警告
-warnings.filterwarnings("ignore", category=DeprecationWarning, module="sqlalchemy")
-warnings.filterwarnings("ignore", message=".*SQLAlchemy.*")
+logger = logging.getLogger(__name__)
 
 model_configs = [
     {
@@ -75,6 +74,199 @@ model_configs = [
 ]
 
 
+# 聚合模板中的专家槽位，按模型家族优先匹配，剩余槽位按响应先后顺序填充
+AGGREGATION_SLOTS = {
+    "Qwen_message": "qwen",
+    "DeepSeek_message": "deepseek",
+    "Gemini_message": "gemini",
+}
+
+IDEA_ITERATION_SYSTEM_PROMPT = (
+    "You are a research expert with a keen eye for novelty and impact in research. "
+    "Refine the given research idea into a feasible, innovative and technically detailed draft."
+)
+
+
+def get_model_config(config_name, configs=None):
+    """
+    按config_name查找模型配置
+    
+    Args:
+        config_name: 配置名称
+        configs: 模型配置列表，默认使用model_configs
+    
+    Returns:
+        dict: 模型配置
+    """
+    for config in configs or model_configs:
+        if config["config_name"] == config_name:
+            return config
+    raise KeyError(f"未找到模型配置: {config_name}")
+
+
+def config_available(model_config):
+    """
+    模型配置所在的服务地址是否未熔断
+    
+    Args:
+        model_config: 模型配置
+    
+    Returns:
+        bool: 是否可用，无法确定服务地址时视为可用（由请求本身报错）
+    """
+    try:
+        return endpoint_available(model_config_connection(model_config)["base_url"])
+    except ValueError:
+        return True
+
+
+async def gather_quorum(proposals, quorum, timeout, on_failure=None):
+    """
+    并发执行多个模型请求，收到quorum个成功响应后取消其余请求
+    
+    Args:
+        proposals: {config_name: 协程} 字典
+        quorum: 需要的成功响应数量
+        timeout: 单个模型的超时时间（秒）
+        on_failure: 单个模型失败时的回调 on_failure(config_name, 异常)
+    
+    Returns:
+        list: 按到达顺序排列的 (config_name, 回复) 列表
+    """
+    tasks = {
+        asyncio.ensure_future(asyncio.wait_for(coro, timeout)): name
+        for name, coro in proposals.items()
+    }
+    pending = set(tasks)
+    answers = []
+    try:
+        while pending and len(answers) < quorum:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                name = tasks[task]
+                if task.exception() is not None:
+                    logger.warning(f"MoA模型 {name} 调用失败: {task.exception()!r}")
+                    if on_failure is not None:
+                        on_failure(name, task.exception())
+                    continue
+                answers.append((name, task.result()))
+    finally:
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+            logger.info(f"已达到法定响应数，取消 {len(pending)} 个未完成的MoA请求: "
+                        f"{[tasks[task] for task in pending]}")
+
+    if len(answers) < quorum:
+        logger.warning(f"MoA仅收到 {len(answers)}/{quorum} 个有效响应")
+    return answers
+
+
+def build_aggregation_data(answers):
+    """
+    将各模型回复填入聚合模板的专家槽位
+    
+    Args:
+        answers: (config_name, 回复) 列表
+    
+    Returns:
+        dict: 模板变量data
+    """
+    data = {slot: "" for slot in AGGREGATION_SLOTS}
+    remaining = list(answers)
+    for slot, family in AGGREGATION_SLOTS.items():
+        for answer in remaining:
+            if family in answer[0].lower():
+                data[slot] = answer[1]
+                remaining.remove(answer)
+                break
+    for slot in data:
+        if not data[slot] and remaining:
+            data[slot] = remaining.pop(0)[1]
+    return data
+
+
+async def render_aggregation_prompt(ac_prompt, answers):
+    """
+    渲染聚合提示词
+    
+    Args:
+        ac_prompt: 聚合模板路径（相对于app/templates）
+        answers: (config_name, 回复) 列表
+    
+    Returns:
+        str: 聚合提示词
+    """
+    template_name = ac_prompt or "prompt/moa/default_aggregator_prompt.tpl"
+    rendered = await template_registry.render_async(template_name, data=build_aggregation_data(answers))
+
+    if "data" not in template_registry.variables(template_name):
+        # 模板本身不引用各专家回复时，将回复附加在模板之后
+        ideas = "\n\n".join(f"## Input Idea {i}\n{content}" for i, (_, content) in enumerate(answers, 1))
+        rendered = f"{rendered}\n\n# Input Ideas:\n{ideas}"
+    return rendered
+
+
+async def amoa_model(model_configs, agent_list, topic, user_prompt, systeam_prompt, ac_prompt="", ac_systeam="",
+                     stage="", quorum=None, timeout=None):
+    """
+    MOA模型函数（异步）：并发请求各提议模型，达到法定响应数后立即聚合
+    
+    Args:
+        model_configs: 模型配置列表
+        agent_list: 参与提议的config_name列表
+        topic: 主题
+        user_prompt: 用户提示
+        systeam_prompt: 系统提示
+        ac_prompt: 聚合模板路径
+        ac_systeam: 聚合系统提示
+        stage: 阶段
+        quorum: 聚合所需的最少响应数，默认settings.MOA_QUORUM
+        timeout: 单个模型超时时间（秒），默认settings.MOA_MODEL_TIMEOUT
+    
+    Returns:
+        str: 处理结果
+    """
+    # 跳过已熔断的模型，全部熔断时立即失败，交给调用方的回退方案
+    available = [name for name in agent_list if config_available(get_model_config(name, model_configs))]
+    if not available:
+        raise RuntimeError(f"MoA[{stage}] 所有提议模型均已熔断")
+    if len(available) < len(agent_list):
+        logger.warning(f"MoA[{stage}] 跳过已熔断的模型: {sorted(set(agent_list) - set(available))}")
+    quorum = min(quorum or settings.MOA_QUORUM, len(available))
+    timeout = timeout or settings.MOA_MODEL_TIMEOUT
+    logger.info(f"MoA[{stage}] 主题: {topic}, 提议模型: {available}, 法定响应数: {quorum}")
+
+    def on_failure(name, error):
+        # 超时被取消的请求在请求内部不计为失败，在这里计入该模型所在服务的熔断器
+        if isinstance(error, asyncio.TimeoutError):
+            breaker = get_circuit_breaker(model_config_connection(get_model_config(name, model_configs))["base_url"])
+            if breaker is not None:
+                breaker.record_failure()
+
+    proposals = {
+        name: acall_with_model_config(get_model_config(name, model_configs), systeam_prompt, user_prompt)
+        for name in available
+    }
+    answers = await gather_quorum(proposals, quorum, timeout, on_failure=on_failure)
+    if not answers:
+        raise RuntimeError(f"MoA[{stage}] 所有提议模型均调用失败")
+
+    aggregation_prompt = await render_aggregation_prompt(ac_prompt, answers)
+    aggregator = get_model_config(settings.MOA_AGGREGATOR, model_configs)
+    if not config_available(aggregator):
+        # 聚合模型已熔断时改用最先响应且未熔断的提议模型聚合
+        fallback = next((name for name, _ in answers if config_available(get_model_config(name, model_configs))),
+                        None)
+        if fallback is not None:
+            logger.warning(f"MoA[{stage}] 聚合模型 {settings.MOA_AGGREGATOR} 已熔断，改用 {fallback}")
+            aggregator = get_model_config(fallback, model_configs)
+    # 聚合结果即最终输出，流式写入当前阶段的部分结果
+    return await acall_with_model_config(aggregator, ac_systeam or systeam_prompt, aggregation_prompt,
+                                         sink=partial_writer())
+
+
 def moa_idea_iteration(topic="", user_prompt="", user_id="", task=None):
     """
     MOA思想迭代函数
@@ -88,8 +280,15 @@ def moa_idea_iteration(topic="", user_prompt="", user_id="", task=None):
     Returns:
         str: 聚合后的内容
     """
-    # MOA实现逻辑
-    pass
+    return run_sync(amoa_model(
+        model_configs,
+        settings.MOA_PROPOSERS,
+        topic,
+        user_prompt,
+        IDEA_ITERATION_SYSTEM_PROMPT,
+        ac_prompt="prompt/moa/moa_idea_iteration_aggregation.tpl",
+        stage="idea_iteration",
+    ))
 
 
 def moa_model(model_configs, agent_list, topic, user_prompt, systeam_prompt, ac_prompt="", ac_systeam="", stage=""):
@@ -109,8 +308,8 @@ def moa_model(model_configs, agent_list, topic, user_prompt, systeam_prompt, ac_
     Returns:
         str: 处理结果
     """
-    # MOA模型实现逻辑
-    pass
+    return run_sync(amoa_model(model_configs, agent_list, topic, user_prompt, systeam_prompt,
+                               ac_prompt=ac_prompt, ac_systeam=ac_systeam, stage=stage))
 
 
 def moa_table(model_configs=model_configs, topic='', draft='', user_id='', task=None):
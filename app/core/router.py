@@ -0,0 +1,374 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time : 2025/9/17 15:30
+# @Author : 桐
+# @QQ:1041264242
+# 注意事项：路由统计只在LLM后台事件循环中更新；被取消的请求（对冲中输掉的一方）与熔断拒绝的请求不计入统计
+import time
+import random
+import asyncio
+import logging
+import threading
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from app.core.config import settings
+from app.utils.circuit_breaker import CircuitOpenError, endpoint_available
+from app.utils.llm_api import (PROVIDERS, acall_with_model_config, acached_answer, model_config_connection,
+                               provider_model_config)
+from app.utils.llm_client import run_in_provider_loop, run_sync
+from app.utils.metrics import metrics_registry
+from app.utils.streaming import PartialWriter, partial_writer
+
+logger = logging.getLogger(__name__)
+
+ROUTER_REQUESTS = metrics_registry.counter("llm_router_requests_total", "路由请求的最终结果",
+                                           ("route", "outcome"))
+ROUTER_HEDGES = metrics_registry.counter("llm_router_hedges_total", "主路由超过其p95后发出的对冲请求次数",
+                                         ("primary", "backup"))
+
+
+def _percentile(ordered: List[float], q: float) -> float:
+    return ordered[min(int(len(ordered) * q), len(ordered) - 1)]
+
+
+class RouteStats:
+    """单个路由的滚动窗口统计：最近N次且不早于窗口时长的请求结果"""
+
+    def __init__(self, window: int, window_seconds: float):
+        self.window_seconds = window_seconds
+        # (完成时间, 耗时)，失败时耗时为None
+        self._outcomes: Deque[Tuple[float, Optional[float]]] = deque(maxlen=window)
+
+    def record(self, latency: Optional[float]):
+        self._outcomes.append((time.monotonic(), latency))
+
+    def _recent(self) -> List[Tuple[float, Optional[float]]]:
+        horizon = time.monotonic() - self.window_seconds
+        while self._outcomes and self._outcomes[0][0] < horizon:
+            self._outcomes.popleft()
+        return list(self._outcomes)
+
+    def summary(self) -> Dict[str, Any]:
+        outcomes = self._recent()
+        latencies = sorted(latency for _, latency in outcomes if latency is not None)
+        return {
+            "samples": len(outcomes),
+            "successes": len(latencies),
+            "error_rate": round(1 - len(latencies) / len(outcomes), 3) if outcomes else 0.0,
+            "p50": round(_percentile(latencies, 0.5), 3) if latencies else None,
+            "p95": round(_percentile(latencies, 0.95), 3) if latencies else None,
+        }
+
+
+class ProviderRouter:
+    """按滚动p50/p95延迟和错误率选择模型，可选对冲请求"""
+
+    def __init__(self, routes: Dict[str, Dict[str, Any]], window: int = 100, window_seconds: float = 600.0,
+                 min_samples: int = 5, max_error_rate: float = 0.5, max_attempts: int = 2,
+                 hedge_enabled: bool = False, hedge_min_delay: float = 2.0, explore_rate: float = 0.0):
+        """
+        Args:
+            routes: 路由名到模型配置的映射，顺序即无统计数据时的优先顺序
+            window: 每个路由保留的最近请求数
+            window_seconds: 统计窗口时长（秒），过期的结果不再参与统计，不健康的路由因此可以恢复
+            min_samples: 延迟与错误率统计生效所需的最少样本数
+            max_error_rate: 错误率超过该值的路由视为不健康，只在其他路由都不可用时使用
+            max_attempts: 单次请求最多尝试的路由数（含对冲请求与失败后的切换）
+            hedge_enabled: 是否启用对冲
+            hedge_min_delay: 对冲等待时间下限（秒）
+            explore_rate: 将请求发给样本最少的健康路由的概率，用于持续更新各路由的统计
+        """
+        if not routes:
+            raise ValueError("至少需要一个可用的模型路由")
+        self.routes = routes
+        self.min_samples = min_samples
+        self.max_error_rate = max_error_rate
+        self.max_attempts = max(max_attempts, 1)
+        self.hedge_enabled = hedge_enabled
+        self.hedge_min_delay = hedge_min_delay
+        self.explore_rate = explore_rate
+        self._lock = threading.Lock()
+        self._stats_window = window
+        self._stats_seconds = window_seconds
+        self._stats = {name: RouteStats(window, window_seconds) for name in routes}
+        self._order = {name: i for i, name in enumerate(routes)}
+
+    def _record(self, name: str, latency: Optional[float]):
+        with self._lock:
+            self._stats[name].record(latency)
+
+    def route_stats(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {name: stats.summary() for name, stats in self._stats.items()}
+
+    def _healthy(self, summary: Dict[str, Any]) -> bool:
+        return summary["samples"] < self.min_samples or summary["error_rate"] <= self.max_error_rate
+
+    def available(self, name: str) -> bool:
+        """路由所在的服务地址是否未熔断"""
+        return endpoint_available(model_config_connection(self.routes[name])["base_url"])
+
+    def _add_route(self, name: str) -> bool:
+        """把回退链中未在ROUTER_MODELS里的模型加入路由，未配置API密钥时返回False"""
+        if name in self.routes:
+            return True
+        config = resolve_route(name)
+        if config is None:
+            return False
+        with self._lock:
+            if name not in self.routes:
+                self._stats[name] = RouteStats(self._stats_window, self._stats_seconds)
+                self._order[name] = len(self._order)
+                self.routes[name] = config
+        return True
+
+    def rank(self, explore: bool = True, chain: Optional[List[str]] = None) -> List[str]:
+        """
+        按当前统计对路由排序：未熔断的健康路由在前；样本不足的路由按配置顺序优先，以便各路由在窗口内都有统计，
+        其余按p95（再按p50）升序；没有任何统计时即为配置顺序。给定回退链时按链中顺序排列，只把已熔断的移到末尾
+
+        Args:
+            explore: 是否按explore_rate概率把样本最少的健康路由提到首位
+            chain: 阶段的模型回退链
+
+        Returns:
+            List[str]: 路由名列表
+        """
+        if chain:
+            names = [name for name in chain if self._add_route(name)]
+            return sorted(names, key=lambda name: (not self.available(name), names.index(name)))
+
+        with self._lock:
+            names = list(self.routes)
+        summaries = self.route_stats()
+        available = {name: self.available(name) for name in names}
+
+        def key(name: str):
+            summary = summaries[name]
+            known = summary["successes"] >= self.min_samples
+            return (not available[name], not self._healthy(summary), known,
+                    summary["p95"] if known else 0.0, summary["p50"] if known else 0.0, self._order[name])
+
+        ranked = sorted(names, key=key)
+        if explore and self.explore_rate and len(ranked) > 1 and random.random() < self.explore_rate:
+            healthy = [name for name in ranked if available[name] and self._healthy(summaries[name])]
+            if healthy:
+                explore = min(healthy, key=lambda name: (summaries[name]["samples"], self._order[name]))
+                ranked.remove(explore)
+                ranked.insert(0, explore)
+        return ranked
+
+    def hedge_delay(self, name: str) -> Optional[float]:
+        """路由的对冲等待时间：其p95（不低于下限），样本不足时不对冲"""
+        summary = self.route_stats()[name]
+        if summary["successes"] < self.min_samples:
+            return None
+        return max(summary["p95"], self.hedge_min_delay)
+
+    async def _attempt(self, name: str, system_prompt: str, question: str, use_cache: bool,
+                       sink: Optional[PartialWriter] = None) -> str:
+        started = time.perf_counter()
+        try:
+            answer = await acall_with_model_config(self.routes[name], system_prompt, question, use_cache=use_cache,
+                                                   sink=sink)
+        except (asyncio.CancelledError, CircuitOpenError):
+            raise
+        except Exception:
+            self._record(name, None)
+            raise
+        self._record(name, time.perf_counter() - started)
+        return answer
+
+    def stage_routes(self, stage: Optional[str] = None) -> List[str]:
+        """阶段可能使用的路由，按当前排序（不含随机探索），配置了回退链时只含链中路由"""
+        chain = settings.LLM_STAGE_FALLBACKS.get(stage) if stage else None
+        return self.rank(explore=False, chain=chain)
+
+    async def acall(self, system_prompt: str, question: str, use_cache: bool = True,
+                    hedge: Optional[bool] = None, stage: Optional[str] = None, stream: bool = False) -> str:
+        """将请求发给当前最优的路由（异步，参数同aroute），只返回模型回复"""
+        answer, _ = await self.aroute(system_prompt, question, use_cache=use_cache, hedge=hedge, stage=stage,
+                                      stream=stream)
+        return answer
+
+    async def aroute(self, system_prompt: str, question: str, use_cache: bool = True,
+                     hedge: Optional[bool] = None, stage: Optional[str] = None,
+                     stream: bool = False) -> Tuple[str, str]:
+        """
+        将请求发给当前最优的路由（异步，在LLM后台事件循环中执行）
+
+        启用对冲时，主路由在其p95时间内未返回则向次优路由发出相同请求，先成功的结果胜出，另一方被取消；
+        请求失败时切换到下一个路由，总尝试路由数不超过max_attempts。已熔断的路由直接跳过；
+        阶段配置了回退链(LLM_STAGE_FALLBACKS)时按链中顺序依次尝试链中全部路由。
+        流式请求时只有主路由（及失败后切换到的路由）写入部分结果，已开始输出的主路由不再对冲
+
+        Args:
+            system_prompt: 系统提示词
+            question: 用户问题
+            use_cache: 是否使用LLM缓存（任一路由的缓存命中即直接返回）
+            hedge: 是否对冲，为空时使用路由器配置
+            stage: 流程阶段，用于查找回退链
+            stream: 是否流式请求并把部分结果写入当前阶段的回调（见app.utils.streaming）
+
+        Returns:
+            Tuple[str, str]: (模型回复, 实际作答的模型名称)
+
+        Raises:
+            RuntimeError: 所有尝试的路由均失败
+        """
+        chain = settings.LLM_STAGE_FALLBACKS.get(stage) if stage else None
+        ranked = self.rank(chain=chain)
+        if not ranked:
+            raise RuntimeError(f"阶段 {stage} 的回退链中没有已配置API密钥的模型: {chain}")
+        if use_cache:
+            for name in ranked:
+                cached = await acached_answer(self.routes[name], system_prompt, question)
+                if cached is not None:
+                    return cached, self.routes[name]["model_name"]
+
+        hedge = self.hedge_enabled if hedge is None else hedge
+        sink = partial_writer() if stream else None
+        candidates = ranked if chain else ranked[:self.max_attempts]
+        # 全部熔断时仍保留首个路由，由其立即抛出CircuitOpenError
+        candidates = [name for name in candidates if self.available(name)] or candidates[:1]
+        last_error: Optional[BaseException] = None
+        while candidates:
+            primary = candidates.pop(0)
+            tasks = {asyncio.ensure_future(self._attempt(primary, system_prompt, question, use_cache, sink)): primary}
+            delay = self.hedge_delay(primary) if hedge and candidates else None
+            try:
+                while tasks:
+                    done, _ = await asyncio.wait(tasks, timeout=delay, return_when=asyncio.FIRST_COMPLETED)
+                    if not done:
+                        if sink is not None and sink.receiving:
+                            delay = None
+                            continue
+                        backup = candidates.pop(0)
+                        logger.info(f"路由 {primary} 超过p95({delay:.2f}秒)未返回，对冲请求发往 {backup}")
+                        ROUTER_HEDGES.inc(primary=primary, backup=backup)
+                        tasks[asyncio.ensure_future(self._attempt(backup, system_prompt, question, use_cache))] = backup
+                        delay = None
+                        continue
+                    for task in done:
+                        name = tasks.pop(task)
+                        if task.exception() is None:
+                            ROUTER_REQUESTS.inc(route=name, outcome="hedge_won" if name != primary else "ok")
+                            if sink is not None and name != primary:
+                                # 对冲请求胜出时用其完整回复覆盖主路由写入的部分结果
+                                sink.begin(self.routes[name]["model_name"])
+                                sink.append(task.result())
+                                sink.end()
+                            return task.result(), self.routes[name]["model_name"]
+                        last_error = task.exception()
+                        logger.warning(f"路由 {name} 请求失败: {last_error!r}")
+                    # 已有对冲请求在执行时不再计时，等待其结果
+                    delay = None
+            finally:
+                for task in tasks:
+                    task.cancel()
+                if tasks:
+                    await asyncio.gather(*tasks, return_exceptions=True)
+        ROUTER_REQUESTS.inc(route=ranked[0], outcome="failed")
+        raise RuntimeError(f"所有模型路由均请求失败: {last_error!r}") from last_error
+
+    def stats(self) -> Dict[str, Any]:
+        """获取路由顺序与各路由的滚动统计"""
+        return {
+            "hedge_enabled": self.hedge_enabled,
+            "ranking": self.rank(explore=False),
+            "routes": self.route_stats(),
+        }
+
+
+def resolve_route(name: str) -> Optional[Dict[str, Any]]:
+    """
+    将路由名解析为模型配置：PROVIDERS中的服务提供方（deepseek/qwen）使用配置中的密钥，
+    其他名称在MoA的model_configs中按config_name查找
+
+    Args:
+        name: 路由名
+
+    Returns:
+        Optional[Dict]: 模型配置，未配置API密钥时返回None
+    """
+    if name in PROVIDERS:
+        config = provider_model_config(name)
+    else:
+        from app.core.moa import get_model_config
+        config = get_model_config(name)
+    return config if config.get("api_key") else None
+
+
+_router: Optional[ProviderRouter] = None
+_router_lock = threading.Lock()
+
+
+def get_router() -> ProviderRouter:
+    """获取进程内共享的模型路由器，路由列表来自ROUTER_MODELS，跳过未配置API密钥的路由"""
+    global _router
+    if _router is None:
+        with _router_lock:
+            if _router is None:
+                routes = {}
+                for name in settings.ROUTER_MODELS:
+                    config = resolve_route(name)
+                    if config is None:
+                        logger.info(f"路由 {name} 未配置API密钥，已跳过")
+                        continue
+                    routes[name] = config
+                if not routes:
+                    # 全部未配置API密钥时保留DeepSeek，请求按原有方式报错
+                    routes["deepseek"] = provider_model_config("deepseek")
+                _router = ProviderRouter(
+                    routes,
+                    window=settings.ROUTER_WINDOW,
+                    window_seconds=settings.ROUTER_WINDOW_SECONDS,
+                    min_samples=settings.ROUTER_MIN_SAMPLES,
+                    max_error_rate=settings.ROUTER_MAX_ERROR_RATE,
+                    max_attempts=settings.ROUTER_MAX_ATTEMPTS,
+                    hedge_enabled=settings.ROUTER_HEDGE_ENABLED,
+                    hedge_min_delay=settings.ROUTER_HEDGE_MIN_DELAY,
+                    explore_rate=settings.ROUTER_EXPLORE_RATE,
+                )
+                logger.info(f"模型路由已初始化: {list(routes)}, 对冲: {settings.ROUTER_HEDGE_ENABLED}")
+    return _router
+
+
+async def acall_routed(system_prompt: str, question: str, use_cache: bool = True,
+                       stage: Optional[str] = None, stream: bool = False) -> str:
+    """
+    通过模型路由器对话（异步）
+
+    Args:
+        system_prompt: 系统提示词
+        question: 用户问题
+        use_cache: 是否使用LLM缓存
+        stage: 流程阶段，配置了回退链时按链中顺序选择模型
+        stream: 是否流式请求并把部分结果写入当前阶段的回调
+
+    Returns:
+        str: 模型回复
+    """
+    return await run_in_provider_loop(
+        get_router().acall(system_prompt, question, use_cache=use_cache, stage=stage, stream=stream)
+    )
+
+
+async def acall_routed_with_model(system_prompt: str, question: str, use_cache: bool = True,
+                                  stage: Optional[str] = None) -> Tuple[str, str]:
+    """
+    通过模型路由器对话（异步），同时返回实际作答的模型，用于按模型区分的结果缓存
+
+    Returns:
+        Tuple[str, str]: (模型回复, 模型名称)
+    """
+    return await run_in_provider_loop(
+        get_router().aroute(system_prompt, question, use_cache=use_cache, stage=stage)
+    )
+
+
+def call_routed(system_prompt: str, question: str, use_cache: bool = True, stage: Optional[str] = None,
+                stream: bool = False) -> str:
+    """通过模型路由器对话（同步）"""
+    return run_sync(get_router().acall(system_prompt, question, use_cache=use_cache, stage=stage, stream=stream))
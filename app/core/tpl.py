@@ -1,10 +1,195 @@
-from jinja2 import Environment, FileSystemLoader
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader, meta
 import os
+import hashlib
+import time
+import threading
+from pathlib import Path
+from typing import Any, Dict, Optional, Set
+
+from app.core.config import settings
 
 # 使用绝对路径确保模板加载不受工作目录影响
 current_dir = os.path.dirname(os.path.abspath(__file__))
 project_root = os.path.dirname(os.path.dirname(current_dir))
 templates_dir = os.path.join(project_root, "app", "templates")
 
+# 只写模板名时依次在这些目录中查找
+TEMPLATE_SEARCH_DIRS = ("prompt", "prompt/moa")
+
+
+def _bytecode_cache(kind: str) -> FileSystemBytecodeCache:
+    # 相对路径按项目根目录解析，不受工作目录影响；同步与异步环境编译出的代码不同，字节码缓存需分目录存放
+    cache_dir = Path(project_root) / settings.TEMPLATE_CACHE_DIR / kind
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    return FileSystemBytecodeCache(str(cache_dir))
+
+
 file_loader = FileSystemLoader(templates_dir)
-tpl_env = Environment(loader=file_loader, enable_async=True)
\ No newline at end of file
+tpl_env = Environment(loader=file_loader, enable_async=True)
+tpl_sync_env = Environment(loader=file_loader)
+
+
+class TemplateRegistry:
+    """提示词模板注册表：模板名解析、预编译、同步/异步渲染、静态模板渲染结果缓存与耗时统计"""
+
+    def __init__(self, sync_env: Environment, async_env: Environment):
+        self.sync_env = sync_env
+        self.async_env = async_env
+        self._lock = threading.Lock()
+        self._names: Dict[str, str] = {}
+        self._variables: Dict[str, Set[str]] = {}
+        self._static_renders: Dict[str, str] = {}
+        self._digests: Dict[str, str] = {}
+        self._stats: Dict[str, Dict[str, float]] = {}
+
+    def resolve(self, name: str) -> str:
+        """
+        解析模板名：带目录的名称原样使用，只写文件名时在prompt/与prompt/moa/中查找
+
+        Args:
+            name: 模板名，如"fact_extraction_prompt.tpl"或"prompt/moa/reviewer_prompt.tpl"
+
+        Returns:
+            str: 相对于app/templates的模板路径
+        """
+        resolved = self._names.get(name)
+        if resolved is not None:
+            return resolved
+        candidates = [name] if "/" in name else [f"{folder}/{name}" for folder in TEMPLATE_SEARCH_DIRS]
+        available = set(self.sync_env.list_templates())
+        for candidate in candidates:
+            if candidate in available:
+                self._names[name] = candidate
+                return candidate
+        raise FileNotFoundError(f"模板不存在: {name}")
+
+    def source(self, name: str) -> str:
+        """获取模板源码"""
+        return self.sync_env.loader.get_source(self.sync_env, self.resolve(name))[0]
+
+    def digest(self, name: str) -> str:
+        """获取模板源码摘要（预编译时计算，之后直接返回），模板修改并重新加载后缓存随之失效"""
+        resolved = self.resolve(name)
+        digest = self._digests.get(resolved)
+        if digest is None:
+            digest = hashlib.sha256(self.source(resolved).encode("utf-8")).hexdigest()[:16]
+            self._digests[resolved] = digest
+        return digest
+
+    def variables(self, name: str) -> Set[str]:
+        """获取模板引用的变量名"""
+        resolved = self.resolve(name)
+        variables = self._variables.get(resolved)
+        if variables is None:
+            variables = meta.find_undeclared_variables(self.sync_env.parse(self.source(resolved)))
+            self._variables[resolved] = variables
+        return variables
+
+    def is_static(self, name: str) -> bool:
+        """模板是否不引用任何变量"""
+        return not self.variables(name)
+
+    def get_template(self, name: str):
+        """获取同步模板"""
+        return self.sync_env.get_template(self.resolve(name))
+
+    def get_async_template(self, name: str):
+        """获取异步模板"""
+        return self.async_env.get_template(self.resolve(name))
+
+    def precompile(self) -> Dict[str, Any]:
+        """
+        预编译全部提示词模板（同步与异步两套），首次调用时启用字节码缓存并写入编译结果
+
+        Returns:
+            Dict[str, Any]: 模板数量与耗时（毫秒）
+        """
+        started = time.perf_counter()
+        if self.sync_env.bytecode_cache is None:
+            self.sync_env.bytecode_cache = _bytecode_cache("sync")
+        if self.async_env.bytecode_cache is None:
+            self.async_env.bytecode_cache = _bytecode_cache("async")
+        names = [name for name in self.sync_env.list_templates()
+                 if any(name.startswith(f"{folder}/") for folder in TEMPLATE_SEARCH_DIRS)]
+        for name in names:
+            self.sync_env.get_template(name)
+            self.async_env.get_template(name)
+            self.variables(name)
+            self.digest(name)
+        return {"templates": len(names), "elapsed_ms": round((time.perf_counter() - started) * 1000, 3)}
+
+    def _record(self, name: str, elapsed: float, memoized: bool):
+        with self._lock:
+            stats = self._stats.setdefault(name, {"renders": 0, "memoized": 0, "total_ms": 0.0})
+            stats["renders"] += 1
+            stats["memoized"] += int(memoized)
+            stats["total_ms"] += elapsed * 1000
+
+    def render(self, name: str, **kwargs) -> str:
+        """
+        同步渲染模板，完全不引用变量的模板只渲染一次（引用变量的模板每次完整渲染）
+
+        Args:
+            name: 模板名
+            **kwargs: 模板变量
+
+        Returns:
+            str: 渲染结果
+        """
+        started = time.perf_counter()
+        resolved = self.resolve(name)
+        rendered = self._static_renders.get(resolved)
+        memoized = rendered is not None
+        if not memoized:
+            rendered = self.get_template(resolved).render(**kwargs)
+            if self.is_static(resolved):
+                self._static_renders[resolved] = rendered
+        self._record(resolved, time.perf_counter() - started, memoized)
+        return rendered
+
+    async def render_async(self, name: str, **kwargs) -> str:
+        """
+        异步渲染模板，不引用变量的模板只渲染一次
+
+        Args:
+            name: 模板名
+            **kwargs: 模板变量
+
+        Returns:
+            str: 渲染结果
+        """
+        started = time.perf_counter()
+        resolved = self.resolve(name)
+        rendered = self._static_renders.get(resolved)
+        memoized = rendered is not None
+        if not memoized:
+            rendered = await self.get_async_template(resolved).render_async(**kwargs)
+            if self.is_static(resolved):
+                self._static_renders[resolved] = rendered
+        self._record(resolved, time.perf_counter() - started, memoized)
+        return rendered
+
+    def stats(self, name: Optional[str] = None) -> Dict[str, Any]:
+        """获取渲染次数与累计耗时，name为空时返回全部模板"""
+        with self._lock:
+            if name is not None:
+                return dict(self._stats.get(self.resolve(name), {}))
+            return {key: dict(value) for key, value in self._stats.items()}
+
+
+template_registry = TemplateRegistry(tpl_sync_env, tpl_env)
+
+
+def get_template(name: str):
+    """获取同步模板，支持只写文件名"""
+    return template_registry.get_template(name)
+
+
+def render_template(name: str, **kwargs) -> str:
+    """同步渲染模板"""
+    return template_registry.render(name, **kwargs)
+
+
+async def render_template_async(name: str, **kwargs) -> str:
+    """异步渲染模板"""
+    return await template_registry.render_async(name, **kwargs)
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time : 2025/9/5 10:10
+# @Author : 桐
+# @QQ:1041264242
+# 注意事项：每个阶段的输出保存为 {root}/{task_id}/{stage}.json，写入采用临时文件+替换保证原子性
+import os
+import json
+import time
+import shutil
+import logging
+import threading
+from pathlib import Path
+from typing import Any, List, Optional
+
+from app.core.config import settings
+from app.utils.tool import load_from_file
+
+logger = logging.getLogger(__name__)
+
+
+class CheckpointStore:
+    """任务阶段检查点存储"""
+
+    def __init__(self, root: str):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, task_id: str, stage: str) -> Path:
+        return self.root / task_id / f"{stage}.json"
+
+    def save(self, task_id: str, stage: str, data: Any):
+        """
+        保存阶段输出
+
+        Args:
+            task_id: 任务ID
+            stage: 阶段名
+            data: 阶段输出（需可JSON序列化）
+        """
+        path = self._path(task_id, stage)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(f".json.{threading.get_ident()}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def load(self, task_id: str, stage: str) -> Optional[Any]:
+        """
+        读取阶段输出
+
+        Args:
+            task_id: 任务ID
+            stage: 阶段名
+
+        Returns:
+            Optional[Any]: 阶段输出，不存在或已损坏时返回None
+        """
+        path = self._path(task_id, stage)
+        if not path.exists():
+            return None
+        try:
+            return load_from_file(str(path))
+        except Exception as e:
+            logger.warning(f"读取任务 {task_id} 阶段 {stage} 检查点失败: {e}")
+            return None
+
+    def stages(self, task_id: str) -> List[str]:
+        """获取任务已保存检查点的阶段列表"""
+        task_dir = self.root / task_id
+        if not task_dir.is_dir():
+            return []
+        return sorted(path.stem for path in task_dir.glob("*.json"))
+
+    def discard(self, task_id: str, stages: List[str]):
+        """删除指定阶段的检查点"""
+        for stage in stages:
+            self._path(task_id, stage).unlink(missing_ok=True)
+
+    def clear(self, task_id: str):
+        """删除任务的全部检查点"""
+        shutil.rmtree(self.root / task_id, ignore_errors=True)
+
+    def prune(self, max_age: float) -> int:
+        """
+        清理长时间未更新的任务检查点
+
+        Args:
+            max_age: 最长保留时间（秒）
+
+        Returns:
+            int: 清理的任务数量
+        """
+        deadline = time.time() - max_age
+        removed = 0
+        for task_dir in self.root.iterdir():
+            if task_dir.is_dir() and task_dir.stat().st_mtime < deadline:
+                shutil.rmtree(task_dir, ignore_errors=True)
+                removed += 1
+        if removed:
+            logger.info(f"已清理 {removed} 个过期任务检查点")
+        return removed
+
+
+_checkpoint_store: Optional[CheckpointStore] = None
+_checkpoint_store_lock = threading.Lock()
+
+
+def get_checkpoint_store() -> CheckpointStore:
+    """获取进程内共享的检查点存储实例"""
+    global _checkpoint_store
+    if _checkpoint_store is None:
+        with _checkpoint_store_lock:
+            if _checkpoint_store is None:
+                _checkpoint_store = CheckpointStore(settings.TASK_CHECKPOINT_DIR)
+    return _checkpoint_store
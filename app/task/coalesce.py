@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time : 2025/9/4 16:30
+# @Author : 桐
+# @QQ:1041264242
+# 注意事项：相同请求只执行一次，重复提交的任务作为跟随者镜像执行中任务的状态和结果
+import time
+import logging
+import threading
+from typing import Dict, Hashable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+LEADER = "leader"
+FOLLOWER = "follower"
+COMPLETED = "completed"
+
+
+def research_task_key(keyword: str, search_paper_num: int) -> Tuple[str, int]:
+    """
+    生成研究任务的合并键：关键词归一化（合并空白、忽略大小写）+ 论文数量
+
+    Args:
+        keyword: 研究关键词
+        search_paper_num: 搜索论文数量
+
+    Returns:
+        Tuple[str, int]: 合并键
+    """
+    return " ".join(keyword.split()).casefold(), search_paper_num
+
+
+class SingleFlight:
+    """进行中请求合并，并在短时间窗口内复用已完成的结果"""
+
+    def __init__(self, completed_window: float = 300.0):
+        """
+        Args:
+            completed_window: 已完成结果的复用窗口（秒），为0时不复用
+        """
+        self.completed_window = completed_window
+        self._lock = threading.RLock()
+        self._inflight: Dict[Hashable, str] = {}
+        self._leader_keys: Dict[str, Hashable] = {}
+        self._followers: Dict[str, List[str]] = {}
+        self._completed: Dict[Hashable, Tuple[str, float]] = {}
+
+    @property
+    def lock(self) -> threading.RLock:
+        """加入与镜像状态时需持有的锁，保证跟随者不会漏掉执行中任务的更新"""
+        return self._lock
+
+    def join(self, key: Hashable, task_id: str) -> Tuple[str, str]:
+        """
+        登记任务
+
+        Args:
+            key: 合并键
+            task_id: 新任务ID
+
+        Returns:
+            Tuple[str, str]: (角色, 执行任务ID)，角色为leader/follower/completed
+        """
+        with self._lock:
+            leader_id = self._inflight.get(key)
+            if leader_id is not None:
+                self._followers[leader_id].append(task_id)
+                return FOLLOWER, leader_id
+
+            completed = self._completed.get(key)
+            if completed is not None:
+                if completed[1] > time.time() - self.completed_window:
+                    return COMPLETED, completed[0]
+                del self._completed[key]
+
+            self._inflight[key] = task_id
+            self._leader_keys[task_id] = key
+            self._followers[task_id] = []
+            return LEADER, task_id
+
+    def followers(self, leader_id: str) -> List[str]:
+        """获取执行任务的跟随者列表"""
+        with self._lock:
+            return list(self._followers.get(leader_id, ()))
+
+    def leader_of(self, task_id: str) -> Optional[str]:
+        """获取跟随者所合并到的执行任务ID，不是跟随者时返回None"""
+        with self._lock:
+            for leader_id, followers in self._followers.items():
+                if task_id in followers:
+                    return leader_id
+            return None
+
+    def finish(self, leader_id: str, success: bool) -> List[str]:
+        """
+        执行任务结束，释放合并键；成功的结果在复用窗口内可供后续重复请求使用
+
+        Args:
+            leader_id: 执行任务ID
+            success: 是否成功完成
+
+        Returns:
+            List[str]: 该任务的跟随者列表
+        """
+        with self._lock:
+            key = self._leader_keys.pop(leader_id, None)
+            followers = self._followers.pop(leader_id, [])
+            if key is None:
+                return followers
+            if self._inflight.get(key) == leader_id:
+                del self._inflight[key]
+            if success and self.completed_window > 0:
+                self._completed[key] = (leader_id, time.time())
+            self._purge_completed()
+            return followers
+
+    def forget(self, leader_id: str):
+        """使已完成任务的结果不再被复用（例如结果已被删除）"""
+        with self._lock:
+            for key, (completed_id, _) in list(self._completed.items()):
+                if completed_id == leader_id:
+                    del self._completed[key]
+
+    def _purge_completed(self):
+        deadline = time.time() - self.completed_window
+        for key, (_, finished_at) in list(self._completed.items()):
+            if finished_at <= deadline:
+                del self._completed[key]
+
+    def stats(self) -> Dict[str, int]:
+        """获取合并状态统计"""
+        with self._lock:
+            return {
+                "inflight": len(self._inflight),
+                "followers": sum(len(followers) for followers in self._followers.values()),
+                "reusable_results": len(self._completed),
+            }
@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time : 2025/9/1 14:20
+# @Author : 桐
+# @QQ:1041264242
+# 注意事项：priority数值越小越先执行，同优先级按提交顺序执行
+import math
+import heapq
+import time
+import logging
+import itertools
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+from app.utils.metrics import record_queue_wait, task_metrics
+from app.utils.rate_limit import fair_share
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(Exception):
+    """任务队列已满"""
+
+
+class TaskExecutor:
+    """固定线程数、有界优先级队列的任务执行器"""
+
+    def __init__(self, max_workers: int = 4, max_queue_size: int = 64, estimated_duration: float = 180.0,
+                 on_shed: Optional[Callable[[str], None]] = None, name: str = "task-worker"):
+        """
+        Args:
+            max_workers: 工作线程数
+            max_queue_size: 等待队列容量
+            estimated_duration: 尚无历史数据时的单任务预估耗时（秒）
+            on_shed: 排队任务被更高优先级任务挤出时的回调，参数为task_id
+            name: 工作线程名前缀
+        """
+        self.max_workers = max_workers
+        self.max_queue_size = max_queue_size
+        self.on_shed = on_shed
+
+        self._heap: List[list] = []
+        self._queued: Dict[str, list] = {}
+        self._enqueued_at: Dict[str, float] = {}
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        self._busy = 0
+        self._shutdown = False
+
+        # 单任务耗时的指数滑动平均，用于估算排队时间
+        self._avg_duration = estimated_duration
+        self._completed = 0
+
+        self._workers = [
+            threading.Thread(target=self._worker_loop, name=f"{name}-{i}", daemon=True)
+            for i in range(max_workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, task_id: str, fn: Callable, *args, priority: int = 0, **kwargs) -> int:
+        """
+        提交任务
+
+        Args:
+            task_id: 任务ID
+            fn: 任务函数
+            priority: 优先级，数值越小越先执行
+            *args, **kwargs: 任务函数参数
+
+        Returns:
+            int: 提交后的排队位置（从1开始）
+
+        Raises:
+            QueueFullError: 队列已满且新任务优先级不高于队列中任何任务
+        """
+        shed_task_id = None
+        with self._cond:
+            if self._shutdown:
+                raise RuntimeError("任务执行器已关闭")
+            if len(self._queued) >= self.max_queue_size:
+                worst = max(self._queued.values())
+                if priority >= worst[0]:
+                    raise QueueFullError(f"任务队列已满 ({self.max_queue_size})")
+                shed_task_id = worst[2]
+                self._remove(shed_task_id)
+
+            entry = [priority, next(self._counter), task_id, fn, args, kwargs]
+            heapq.heappush(self._heap, entry)
+            self._queued[task_id] = entry
+            self._enqueued_at[task_id] = time.time()
+            self._cond.notify()
+            position = self._position(task_id)
+
+        if shed_task_id is not None:
+            logger.warning(f"队列已满，任务 {shed_task_id} 被更高优先级任务 {task_id} 挤出")
+            if self.on_shed is not None:
+                self.on_shed(shed_task_id)
+        return position
+
+    def _remove(self, task_id: str) -> bool:
+        entry = self._queued.pop(task_id, None)
+        if entry is None:
+            return False
+        self._enqueued_at.pop(task_id, None)
+        self._heap.remove(entry)
+        heapq.heapify(self._heap)
+        return True
+
+    def cancel(self, task_id: str) -> bool:
+        """
+        取消尚在排队的任务
+
+        Args:
+            task_id: 任务ID
+
+        Returns:
+            bool: 是否取消成功（已开始执行的任务无法取消）
+        """
+        with self._cond:
+            return self._remove(task_id)
+
+    def _position(self, task_id: str) -> Optional[int]:
+        entry = self._queued.get(task_id)
+        if entry is None:
+            return None
+        return sum(1 for other in self._heap if other[:2] < entry[:2]) + 1
+
+    def queue_position(self, task_id: str) -> Optional[int]:
+        """
+        获取任务排队位置
+
+        Args:
+            task_id: 任务ID
+
+        Returns:
+            Optional[int]: 排队位置（从1开始），不在队列中时返回None
+        """
+        with self._cond:
+            return self._position(task_id)
+
+    def estimate_wait(self, task_id: str) -> Optional[float]:
+        """
+        估算任务开始执行前还需等待的时间
+
+        Args:
+            task_id: 任务ID
+
+        Returns:
+            Optional[float]: 预计等待秒数，不在队列中时返回None
+        """
+        with self._cond:
+            position = self._position(task_id)
+            if position is None:
+                return None
+            ahead = position - 1 + self._busy
+            if ahead < self.max_workers:
+                return 0.0
+            return math.ceil((ahead - self.max_workers + 1) / self.max_workers) * self._avg_duration
+
+    def queue_wait(self, task_id: str) -> Optional[float]:
+        """获取任务已排队的时间（秒），不在队列中时返回None"""
+        with self._cond:
+            enqueued_at = self._enqueued_at.get(task_id)
+            return None if enqueued_at is None else time.time() - enqueued_at
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        获取执行器状态
+
+        Returns:
+            Dict[str, Any]: 线程数、运行中/排队任务数、队列容量、平均耗时
+        """
+        with self._cond:
+            return {
+                "workers": self.max_workers,
+                "running": self._busy,
+                "queued": len(self._queued),
+                "queue_capacity": self.max_queue_size,
+                "avg_task_duration": round(self._avg_duration, 2),
+                "completed": self._completed,
+            }
+
+    def _worker_loop(self):
+        while True:
+            with self._cond:
+                while not self._heap and not self._shutdown:
+                    self._cond.wait()
+                if self._shutdown and not self._heap:
+                    return
+                _, _, task_id, fn, args, kwargs = heapq.heappop(self._heap)
+                del self._queued[task_id]
+                enqueued_at = self._enqueued_at.pop(task_id, None)
+                self._busy += 1
+
+            started = time.time()
+            try:
+                # 任务内的阶段耗时、模型调用等指标记到该任务的收集器上，LLM请求按任务公平排队
+                with task_metrics(), fair_share(task_id):
+                    if enqueued_at is not None:
+                        record_queue_wait(started - enqueued_at)
+                    fn(*args, **kwargs)
+            except Exception as e:
+                logger.error(f"任务 {task_id} 执行异常: {e}")
+            finally:
+                duration = time.time() - started
+                with self._cond:
+                    self._busy -= 1
+                    self._completed += 1
+                    self._avg_duration = 0.8 * self._avg_duration + 0.2 * duration
+
+    def shutdown(self, wait: bool = True):
+        """
+        关闭执行器，已排队的任务会继续执行完毕
+
+        Args:
+            wait: 是否等待工作线程退出
+        """
+        with self._cond:
+            self._shutdown = True
+            self._cond.notify_all()
+        if wait:
+            for worker in self._workers:
+                worker.join()
@@ -0,0 +1,628 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time : 2025/9/2 10:45
+# @Author : 桐
+# @QQ:1041264242
+# 注意事项：运行中的任务常驻内存，已结束的任务按数量/时间从内存淘汰；SQLite后端下任务结果存放在独立文件中按需加载
+import os
+import json
+import atexit
+import time
+import logging
+import sqlite3
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+from app.core.config import settings
+from app.utils.tool import connect_sqlite, load_from_file
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_STATUSES = {"COMPLETED", "FAILED", "REJECTED", "INTERRUPTED"}
+
+
+def project_fields(data: Dict[str, Any], fields: List[str]) -> Dict[str, Any]:
+    """
+    按字段路径投影字典，支持"result.facts_info"形式的点分路径
+
+    Args:
+        data: 原始字典
+        fields: 字段路径列表
+
+    Returns:
+        Dict[str, Any]: 仅包含所选字段的字典，不存在的路径被忽略
+    """
+    projected: Dict[str, Any] = {}
+    for field in fields:
+        source, target = data, projected
+        parts = field.split(".")
+        for i, part in enumerate(parts):
+            if not isinstance(source, dict) or part not in source:
+                break
+            if i == len(parts) - 1:
+                target[part] = source[part]
+            else:
+                source = source[part]
+                target = target.setdefault(part, {})
+    return projected
+
+
+class SimpleTask:
+    """简单任务类，用于存储任务信息"""
+
+    __slots__ = ("task_id", "keyword", "search_paper_num", "keywords", "status", "progress", "stage", "version",
+                 "created_at", "updated_at", "error", "partial", "subtasks", "_result", "_result_loader")
+
+    def __init__(self, task_id: str, keyword: str, search_paper_num: int, keywords: Optional[List[str]] = None):
+        self.task_id = task_id
+        self.keyword = keyword
+        self.search_paper_num = search_paper_num
+        # 批量任务的关键词列表，普通任务为None
+        self.keywords = keywords
+        self.status = "PENDING"
+        self.progress = 0
+        self.stage = None
+        self.version = 0
+        self.created_at = datetime.now()
+        self.updated_at = datetime.now()
+        self.error = None
+        # 当前阶段流式生成中的部分结果，只保存在内存中，任务结束时清空
+        self.partial = None
+        # 批量任务中各子任务（关键词）的状态，SQLite后端下随版本号批量落盘（不含部分结果）
+        self.subtasks: Optional[Dict[str, Dict[str, Any]]] = None
+        self._result = None
+        self._result_loader: Optional[Callable[[], Any]] = None
+
+    @property
+    def result(self) -> Any:
+        """任务结果，已落盘的结果在首次访问时加载"""
+        if self._result is None and self._result_loader is not None:
+            self._result = self._result_loader()
+            self._result_loader = None
+        return self._result
+
+    @result.setter
+    def result(self, value: Any):
+        self._result = value
+        self._result_loader = None
+
+    def release_result(self, loader: Callable[[], Any]):
+        """释放内存中的结果，之后访问时通过loader重新加载"""
+        self._result = None
+        self._result_loader = loader
+
+    @property
+    def kind(self) -> str:
+        """任务类型：batch(批量任务) 或 single"""
+        return "batch" if self.keywords is not None else "single"
+
+    @property
+    def is_finished(self) -> bool:
+        return self.status in TERMINAL_STATUSES
+
+    @property
+    def etag(self) -> str:
+        return f"{self.task_id}:{self.version}"
+
+    def to_dict(self, include_result: bool = True) -> Dict[str, Any]:
+        """转换为字典格式"""
+        data = {
+            "task_id": self.task_id,
+            "keyword": self.keyword,
+            "search_paper_num": self.search_paper_num,
+            "kind": self.kind,
+            "status": self.status,
+            "progress": self.progress,
+            "stage": self.stage,
+            "version": self.version,
+            "etag": self.etag,
+            "created_at": self.created_at.isoformat(),
+            "updated_at": self.updated_at.isoformat(),
+            "error": self.error,
+            "partial": self.partial,
+            "subtasks": self.subtasks
+        }
+        if include_result:
+            data["result"] = self.result
+        return data
+
+    def progress_info(self) -> Dict[str, Any]:
+        """用于进度推送的精简状态"""
+        return {
+            "task_id": self.task_id,
+            "status": self.status,
+            "progress": self.progress,
+            "stage": self.stage,
+            "version": self.version,
+        }
+
+
+class TaskStore:
+    """内存任务存储，已结束的任务按数量和存活时间淘汰"""
+
+    def __init__(self, max_finished: int = 100, finished_ttl: float = 1800):
+        """
+        Args:
+            max_finished: 内存中保留的已结束任务上限
+            finished_ttl: 已结束任务在内存中的保留时间（秒）
+        """
+        self.max_finished = max_finished
+        self.finished_ttl = finished_ttl
+        self._lock = threading.RLock()
+        self._tasks: "OrderedDict[str, SimpleTask]" = OrderedDict()
+        self._listeners: Dict[str, List[Callable[[Dict[str, Any]], None]]] = {}
+
+    def add(self, task: SimpleTask):
+        """添加任务"""
+        with self._lock:
+            self._tasks[task.task_id] = task
+            self._persist(task, result_changed=task.result is not None)
+            self._evict()
+
+    def get(self, task_id: str) -> Optional[SimpleTask]:
+        """
+        获取任务
+
+        Args:
+            task_id: 任务ID
+
+        Returns:
+            Optional[SimpleTask]: 任务对象，不存在时返回None
+        """
+        with self._lock:
+            task = self._tasks.get(task_id)
+            if task is None:
+                task = self._load(task_id)
+            return task
+
+    def update(self, task_id: str, status: Optional[str] = None, progress: Optional[int] = None,
+               result: Any = None, error: Optional[str] = None, stage: Optional[str] = None) -> Optional[SimpleTask]:
+        """
+        更新任务状态，并通知该任务的监听者
+
+        Args:
+            task_id: 任务ID
+            status: 任务状态
+            progress: 进度百分比
+            result: 任务结果
+            error: 错误信息
+            stage: 当前流程阶段
+
+        Returns:
+            Optional[SimpleTask]: 更新后的任务，不存在时返回None
+        """
+        with self._lock:
+            task = self._tasks.get(task_id)
+            if task is None:
+                task = self._load(task_id)
+                if task is None:
+                    return None
+                self._tasks[task_id] = task
+
+            if status is not None:
+                task.status = status
+            task.version += 1
+            task.updated_at = datetime.now()
+            if progress is not None:
+                task.progress = progress
+            if result is not None:
+                task.result = result
+            if error is not None:
+                task.error = error
+            if stage is not None:
+                task.stage = stage
+            if task.status in TERMINAL_STATUSES:
+                task.partial = None
+                if task.subtasks:
+                    task.subtasks = {name: {key: value for key, value in info.items() if key != "partial"}
+                                     for name, info in task.subtasks.items()}
+
+            self._persist(task, result_changed=result is not None)
+            self._tasks.move_to_end(task_id)
+            self._evict()
+            info = task.progress_info()
+            listeners = list(self._listeners.get(task_id, ()))
+
+        self._notify(task_id, info, listeners)
+        return task
+
+    def reopen(self, task_id: str) -> Optional[SimpleTask]:
+        """
+        将已结束的任务重新置为排队状态（保留上一次的结果，直到新结果写入）
+
+        Args:
+            task_id: 任务ID
+
+        Returns:
+            Optional[SimpleTask]: 重新排队的任务，不存在或尚未结束时返回None
+        """
+        with self._lock:
+            task = self.get(task_id)
+            if task is None or not task.is_finished:
+                return None
+            task.status = "PENDING"
+            task.progress = 0
+            task.stage = None
+            task.error = None
+            task.partial = None
+            if task.subtasks:
+                task.subtasks = {name: {"status": "PENDING", "stage": None, "progress": 0} for name in task.subtasks}
+            task.version += 1
+            task.updated_at = datetime.now()
+
+            self._persist(task, result_changed=False)
+            self._tasks[task_id] = task
+            self._tasks.move_to_end(task_id)
+            info = task.progress_info()
+            listeners = list(self._listeners.get(task_id, ()))
+
+        self._notify(task_id, info, listeners)
+        return task
+
+    def set_partial(self, task_id: str, partial: Dict[str, Any]) -> Optional[SimpleTask]:
+        """
+        更新任务当前阶段的部分结果（不落盘，递增后的版本号延迟落盘），并通知监听者
+
+        Args:
+            task_id: 任务ID
+            partial: 部分结果 {stage, text, tokens, done, elapsed}
+
+        Returns:
+            Optional[SimpleTask]: 更新后的任务，不存在或已结束时返回None
+        """
+        with self._lock:
+            task = self._tasks.get(task_id)
+            if task is None or task.is_finished:
+                return None
+            task.partial = partial
+            task.version += 1
+            task.updated_at = datetime.now()
+            # 部分结果本身不落盘，版本号由后台线程定期批量落盘
+            self._persist_version(task)
+            info = task.progress_info()
+            listeners = list(self._listeners.get(task_id, ()))
+
+        self._notify(task_id, info, listeners)
+        return task
+
+    def update_subtask(self, task_id: str, name: str, fields: Dict[str, Any]) -> Optional[SimpleTask]:
+        """
+        更新批量任务中单个子任务的状态（子任务状态与递增后的版本号延迟落盘），并通知监听者
+
+        Args:
+            task_id: 任务ID
+            name: 子任务名（关键词）
+            fields: 需要更新的字段，如 {status, stage, progress, partial}
+
+        Returns:
+            Optional[SimpleTask]: 更新后的任务，不存在或已结束时返回None
+        """
+        with self._lock:
+            task = self._tasks.get(task_id)
+            if task is None or task.is_finished:
+                return None
+            # 整体替换，已取出的快照不受后续更新影响
+            subtasks = dict(task.subtasks or {})
+            subtasks[name] = {**subtasks.get(name, {}), **fields}
+            task.subtasks = subtasks
+            task.version += 1
+            task.updated_at = datetime.now()
+            self._persist_version(task)
+            info = task.progress_info()
+            listeners = list(self._listeners.get(task_id, ()))
+
+        self._notify(task_id, info, listeners)
+        return task
+
+    @staticmethod
+    def _notify(task_id: str, info: Dict[str, Any], listeners: List[Callable[[Dict[str, Any]], None]]):
+        for listener in listeners:
+            try:
+                listener(info)
+            except Exception as e:
+                logger.warning(f"任务 {task_id} 进度通知失败: {e}")
+
+    def add_listener(self, task_id: str, listener: Callable[[Dict[str, Any]], None]):
+        """
+        注册任务状态监听者，每次update后以精简状态字典回调（在更新线程中调用）
+
+        Args:
+            task_id: 任务ID
+            listener: 回调函数
+        """
+        with self._lock:
+            self._listeners.setdefault(task_id, []).append(listener)
+
+    def remove_listener(self, task_id: str, listener: Callable[[Dict[str, Any]], None]):
+        """注销任务状态监听者"""
+        with self._lock:
+            listeners = self._listeners.get(task_id, [])
+            if listener in listeners:
+                listeners.remove(listener)
+            if not listeners:
+                self._listeners.pop(task_id, None)
+
+    def snapshot(self, task_id: str, fields: Optional[List[str]] = None,
+                 since_version: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        """
+        获取任务状态快照，锁内只复制字段引用，结果加载和序列化在锁外进行
+
+        Args:
+            task_id: 任务ID
+            fields: 需要返回的字段路径，为空时返回全部字段
+            since_version: 客户端已有的版本号，任务未变化时只返回not_modified
+
+        Returns:
+            Optional[Dict[str, Any]]: 任务状态字典，不存在时返回None
+        """
+        with self._lock:
+            task = self.get(task_id)
+            if task is None:
+                return None
+            if since_version is not None and task.version <= since_version:
+                return {
+                    "task_id": task_id,
+                    "version": task.version,
+                    "etag": task.etag,
+                    "status": task.status,
+                    "not_modified": True,
+                }
+            data = task.to_dict(include_result=False)
+            result, loader = task._result, task._result_loader
+
+        need_result = fields is None or any(field.split(".")[0] == "result" for field in fields)
+        if need_result:
+            data["result"] = loader() if result is None and loader is not None else result
+        return project_fields(data, fields) if fields else data
+
+    def delete(self, task_id: str):
+        """删除任务"""
+        with self._lock:
+            self._tasks.pop(task_id, None)
+            self._remove(task_id)
+
+    def list_tasks(self, limit: int = 100) -> List[SimpleTask]:
+        """
+        列出最近更新的任务
+
+        Args:
+            limit: 最大数量
+
+        Returns:
+            List[SimpleTask]: 按更新时间倒序排列的任务
+        """
+        with self._lock:
+            tasks = {task_id: task for task_id, task in self._tasks.items()}
+            for task in self._list_persisted(limit):
+                tasks.setdefault(task.task_id, task)
+        return sorted(tasks.values(), key=lambda task: task.updated_at, reverse=True)[:limit]
+
+    def _evict(self):
+        finished = [task for task in self._tasks.values() if task.is_finished]
+        if not finished:
+            return
+        deadline = time.time() - self.finished_ttl
+        overflow = len(finished) - self.max_finished
+        for task in finished:
+            if overflow <= 0 and task.updated_at.timestamp() > deadline:
+                break
+            del self._tasks[task.task_id]
+            overflow -= 1
+
+    # 以下为持久化扩展点，内存存储不做任何处理
+    def _persist(self, task: SimpleTask, result_changed: bool):
+        pass
+
+    def _persist_version(self, task: SimpleTask):
+        pass
+
+    def _load(self, task_id: str) -> Optional[SimpleTask]:
+        return None
+
+    def _remove(self, task_id: str):
+        pass
+
+    def _list_persisted(self, limit: int) -> List[SimpleTask]:
+        return []
+
+
+# 服务重启时未结束任务的版本号额外增加的量，覆盖崩溃前尚未落盘的版本递增（每个刷新周期至多数十次）
+RECOVERY_VERSION_GAP = 1000
+
+
+class SQLiteTaskStore(TaskStore):
+    """SQLite(WAL)持久化任务存储，任务结果以JSON文件形式保存在result_dir下"""
+
+    def __init__(self, db_path: str, result_dir: str, max_finished: int = 100, finished_ttl: float = 1800,
+                 version_flush_interval: float = 1.0):
+        super().__init__(max_finished=max_finished, finished_ttl=finished_ttl)
+        self.result_dir = Path(result_dir)
+        self.result_dir.mkdir(parents=True, exist_ok=True)
+        self._conn = connect_sqlite(db_path)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS tasks (
+                task_id TEXT PRIMARY KEY,
+                keyword TEXT NOT NULL,
+                search_paper_num INTEGER NOT NULL,
+                status TEXT NOT NULL,
+                progress INTEGER NOT NULL,
+                stage TEXT,
+                version INTEGER NOT NULL DEFAULT 0,
+                created_at TEXT NOT NULL,
+                updated_at TEXT NOT NULL,
+                error TEXT,
+                has_result INTEGER NOT NULL DEFAULT 0,
+                keywords TEXT,
+                subtasks TEXT
+            )
+            """
+        )
+        self._migrate()
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_updated ON tasks(updated_at)")
+        self._recover_interrupted()
+
+        # 部分结果与子任务更新递增的版本号（及子任务状态）只在内存中标记，由后台线程批量落盘，更新线程不等待磁盘
+        self._dirty_versions: Dict[str, SimpleTask] = {}
+        self._version_flush_interval = version_flush_interval
+        self._flusher = threading.Thread(target=self._flush_loop, name="task-version-flush", daemon=True)
+        self._flusher.start()
+        atexit.register(self.flush_versions)
+
+    def _migrate(self):
+        """为旧版本数据库补充新增列"""
+        columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(tasks)")}
+        for column, ddl in (("version", "INTEGER NOT NULL DEFAULT 0"), ("stage", "TEXT"),
+                            ("keywords", "TEXT"), ("subtasks", "TEXT")):
+            if column not in columns:
+                self._conn.execute(f"ALTER TABLE tasks ADD COLUMN {column} {ddl}")
+        if "keywords" not in columns:
+            # 旧版本按keyword列是否为JSON数组判断批量任务，旧记录按原规则补写一次keywords列，新记录不再按keyword格式判断
+            for row in self._conn.execute("SELECT task_id, keyword FROM tasks WHERE keyword LIKE '[%'").fetchall():
+                try:
+                    keywords = json.loads(row["keyword"])
+                except ValueError:
+                    continue
+                if isinstance(keywords, list):
+                    self._conn.execute("UPDATE tasks SET keywords = ? WHERE task_id = ?",
+                                       (row["keyword"], row["task_id"]))
+        self._conn.commit()
+
+    def _recover_interrupted(self):
+        """服务重启后，将上次未结束的任务标记为中断"""
+        placeholders = ",".join("?" * len(TERMINAL_STATUSES))
+        cursor = self._conn.execute(
+            f"UPDATE tasks SET status = 'INTERRUPTED', error = ?, updated_at = ?, version = version + ? "
+            f"WHERE status NOT IN ({placeholders})",
+            ("服务重启，任务中断", datetime.now().isoformat(), RECOVERY_VERSION_GAP, *TERMINAL_STATUSES),
+        )
+        self._conn.commit()
+        if cursor.rowcount:
+            logger.warning(f"{cursor.rowcount} 个任务因服务重启被标记为中断")
+
+    def result_path(self, task_id: str) -> Path:
+        return self.result_dir / f"{task_id}.json"
+
+    def _write_result(self, task_id: str, result: Any):
+        path = self.result_path(task_id)
+        tmp_path = path.with_suffix(".json.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def _result_loader(self, task_id: str) -> Callable[[], Any]:
+        path = str(self.result_path(task_id))
+        return lambda: load_from_file(path)
+
+    def _persist(self, task: SimpleTask, result_changed: bool):
+        has_result = 0
+        if result_changed and task._result is not None:
+            self._write_result(task.task_id, task._result)
+            has_result = 1
+        self._conn.execute(
+            """
+            INSERT INTO tasks (task_id, keyword, search_paper_num, status, progress, stage, version,
+                               created_at, updated_at, error, has_result, keywords, subtasks)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(task_id) DO UPDATE SET
+                status = excluded.status,
+                progress = excluded.progress,
+                stage = excluded.stage,
+                version = excluded.version,
+                updated_at = excluded.updated_at,
+                error = excluded.error,
+                has_result = MAX(has_result, excluded.has_result),
+                subtasks = excluded.subtasks
+            """,
+            (task.task_id, task.keyword, task.search_paper_num, task.status, task.progress, task.stage, task.version,
+             task.created_at.isoformat(), task.updated_at.isoformat(), task.error, has_result,
+             None if task.keywords is None else json.dumps(task.keywords, ensure_ascii=False),
+             self._dump_subtasks(task)),
+        )
+        self._conn.commit()
+        self._dirty_versions.pop(task.task_id, None)
+
+        # 已结束任务的结果以文件为准，释放内存中的副本
+        if task.is_finished and task._result is not None:
+            task.release_result(self._result_loader(task.task_id))
+
+    @staticmethod
+    def _dump_subtasks(task: SimpleTask) -> Optional[str]:
+        """子任务状态序列化（部分结果不落盘）"""
+        if not task.subtasks:
+            return None
+        return json.dumps({name: {key: value for key, value in info.items() if key != "partial"}
+                           for name, info in task.subtasks.items()}, ensure_ascii=False)
+
+    def _persist_version(self, task: SimpleTask):
+        """标记版本号与子任务状态待落盘（在存储锁内调用），由后台线程或下一次_persist写入"""
+        self._dirty_versions[task.task_id] = task
+
+    def flush_versions(self):
+        """将待落盘的版本号、更新时间与子任务状态批量写入（只更新这几列，不重写整行）"""
+        with self._lock:
+            if not self._dirty_versions:
+                return
+            rows = [(task.version, task.updated_at.isoformat(), self._dump_subtasks(task), task_id)
+                    for task_id, task in self._dirty_versions.items()]
+            self._dirty_versions.clear()
+            try:
+                self._conn.executemany("UPDATE tasks SET version = ?, updated_at = ?, subtasks = ? WHERE task_id = ?",
+                                       rows)
+                self._conn.commit()
+            except Exception as e:
+                logger.warning(f"任务版本号落盘失败: {e}")
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self._version_flush_interval)
+            self.flush_versions()
+
+    def _row_to_task(self, row) -> SimpleTask:
+        keywords = json.loads(row["keywords"]) if row["keywords"] else None
+        task = SimpleTask(row["task_id"], row["keyword"], row["search_paper_num"], keywords=keywords)
+        if row["subtasks"]:
+            task.subtasks = json.loads(row["subtasks"])
+        task.status = row["status"]
+        task.progress = row["progress"]
+        task.stage = row["stage"]
+        task.version = row["version"]
+        task.created_at = datetime.fromisoformat(row["created_at"])
+        task.updated_at = datetime.fromisoformat(row["updated_at"])
+        task.error = row["error"]
+        if row["has_result"]:
+            task.release_result(self._result_loader(task.task_id))
+        return task
+
+    def _load(self, task_id: str) -> Optional[SimpleTask]:
+        row = self._conn.execute("SELECT * FROM tasks WHERE task_id = ?", (task_id,)).fetchone()
+        return None if row is None else self._row_to_task(row)
+
+    def _remove(self, task_id: str):
+        self._conn.execute("DELETE FROM tasks WHERE task_id = ?", (task_id,))
+        self._conn.commit()
+        self.result_path(task_id).unlink(missing_ok=True)
+
+    def _list_persisted(self, limit: int) -> List[SimpleTask]:
+        rows = self._conn.execute("SELECT * FROM tasks ORDER BY updated_at DESC LIMIT ?", (limit,)).fetchall()
+        return [self._row_to_task(row) for row in rows]
+
+
+def create_task_store() -> TaskStore:
+    """根据配置创建任务存储"""
+    if settings.TASK_STORE_BACKEND == "sqlite":
+        return SQLiteTaskStore(
+            db_path=settings.TASK_STORE_PATH,
+            result_dir=settings.TASK_RESULT_DIR,
+            max_finished=settings.TASK_MEMORY_MAX_FINISHED,
+            finished_ttl=settings.TASK_MEMORY_TTL,
+            version_flush_interval=settings.TASK_VERSION_FLUSH_INTERVAL,
+        )
+    return TaskStore(
+        max_finished=settings.TASK_MEMORY_MAX_FINISHED,
+        finished_ttl=settings.TASK_MEMORY_TTL,
+    )
@@ -0,0 +1,11 @@
+# Task Definition: The following numbered fact lists were extracted from different groups of papers on the same research topic. Merge them into a single fact list. Ensure that the merged information meets the following requirements:
+1. **Deduplication**: Combine facts that state the same finding, method or dataset into one statement, keeping the most specific wording and all concrete numbers.
+2. **Completeness**: Do not drop any fact that appears in only one of the lists.
+3. **Accuracy**: Do not add information that is not present in the input lists, and do not change the meaning of any fact.
+4. **Avoid Demonstrative Pronouns**: Keep using 'Related research' instead of 'this work', 'the study', etc., so that each fact stands alone.
+5. **Structured Format**: Output one fact per line as a single numbered list, renumbered from 1.
+
+# Example output format:
+1.Related research have shown that [research topic].
+2.Related research have used [methods], and find that [experimental results].
+3.The data comes from [data source] can be used in [research topic].
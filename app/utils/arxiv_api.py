@@ -4,11 +4,18 @@
 # @Author : 桐
 # @QQ:1041264242
 # 注意事项：
-import arxiv
+import re
 import json
 import time
 import logging
-from typing import List, Dict, Any
+import threading
+from typing import List, Dict, Any, Callable, Iterator, Optional
+import feedparser
+import requests
+from app.core.config import settings
+from app.utils.arxiv_cache import get_arxiv_cache
+from app.utils.metrics import record_arxiv_fetch
+from app.utils.paper_index import get_paper_index, search_local_papers
 
 # 配置日志
 logger = logging.getLogger(__name__)
@@ -31,19 +38,213 @@ def get_authors(authors, first_author=False):
     return output
 
 
-def get_papers(query="astronomy", max_results=2, timeout=30, max_retries=3):
+# 相邻两次ArXiv分页请求的全局互斥与时间戳，用于按页限速
+_page_lock = threading.Lock()
+_last_page_at = 0.0
+_session = requests.Session()
+
+
+def _wait_page_slot(deadline: Optional[float]):
+    """
+    按页限速：保证进程内相邻两次分页请求至少间隔ARXIV_PAGE_INTERVAL秒
+    锁内只预约请求时刻，在锁外等待，排队中的其他检索不会被本次等待阻塞
+    
+    Args:
+        deadline: 截止时间（time.monotonic()时间戳）
+    """
+    global _last_page_at
+    if deadline is None:
+        _page_lock.acquire()
+    elif not _page_lock.acquire(timeout=max(deadline - time.monotonic(), 0)):
+        raise TimeoutError("等待ArXiv限速锁超过截止时间")
+    try:
+        slot = max(time.monotonic(), _last_page_at + settings.ARXIV_PAGE_INTERVAL)
+        if deadline is not None and slot >= deadline:
+            raise TimeoutError("等待ArXiv限速间隔将超过截止时间")
+        _last_page_at = slot
+    finally:
+        _page_lock.release()
+    wait = slot - time.monotonic()
+    if wait > 0:
+        time.sleep(wait)
+
+
+def _read_with_deadline(response, deadline: Optional[float]) -> bytes:
+    """按块读取响应体，超过截止时间立即中断"""
+    chunks = []
+    for chunk in response.iter_content(chunk_size=64 * 1024):
+        if deadline is not None and time.monotonic() > deadline:
+            response.close()
+            raise TimeoutError("读取ArXiv响应超过截止时间")
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+def parse_entry(entry, query: str) -> Dict[str, Any]:
+    """
+    将Atom条目转换为论文信息字典
+    
+    Args:
+        entry: feedparser解析出的条目
+        query: 检索语句
+        
+    Returns:
+        Dict: 论文信息
+    """
+    pdf_url = None
+    for link in entry.get("links", []):
+        if link.get("title") == "pdf":
+            pdf_url = link.get("href")
+            break
+
+    return {"topic": query,
+            "title": re.sub(r"\s+", " ", entry.get("title", "")).strip(),
+            "id": entry.get("id"),
+            "doi": entry.get("arxiv_doi"),
+            "pdf": pdf_url,
+            "abstract": entry.get("summary", "").replace("\n", " "),
+            "authors": get_authors([author.get("name", "") for author in entry.get("authors", [])]),
+            "category": entry.get("arxiv_primary_category", {}).get("term"),
+            "time": entry.get("published", "")[:10]}
+
+
+def fetch_page(query: str, start: int, page_size: int, sort_by: str = "relevance",
+               deadline: Optional[float] = None) -> List[Dict[str, Any]]:
     """
-    从ArXiv获取论文信息
+    请求并解析一页ArXiv检索结果
+    
+    Args:
+        query: 检索语句
+        start: 起始位置
+        page_size: 每页数量
+        sort_by: 排序方式
+        deadline: 截止时间（time.monotonic()时间戳）
+        
+    Returns:
+        List[Dict]: 本页论文信息列表
+    """
+    _wait_page_slot(deadline)
+    read_timeout = settings.ARXIV_TIMEOUT
+    if deadline is not None:
+        read_timeout = max(0.1, min(read_timeout, deadline - time.monotonic()))
+
+    # 耗时从发出请求开始计算，不含限速等待
+    started = time.perf_counter()
+    try:
+        response = _session.get(
+            settings.ARXIV_API_URL,
+            params={
+                "search_query": query,
+                "start": start,
+                "max_results": page_size,
+                "sortBy": sort_by,
+                "sortOrder": "descending",
+            },
+            timeout=(min(10.0, read_timeout), read_timeout),
+            stream=True,
+        )
+        response.raise_for_status()
+        feed = feedparser.parse(_read_with_deadline(response, deadline))
+        if feed.bozo and not feed.entries:
+            raise ValueError(f"ArXiv返回无法解析的结果: {feed.bozo_exception}")
+        papers = [parse_entry(entry, query) for entry in feed.entries]
+    except Exception:
+        record_arxiv_fetch(time.perf_counter() - started, ok=False)
+        raise
+    record_arxiv_fetch(time.perf_counter() - started, len(papers))
+    return papers
+
+
+def iter_pages(query: str, max_results: int = 10, page_size: Optional[int] = None, timeout: Optional[float] = None,
+               max_retries: int = 3, sort_by: str = "relevance") -> Iterator[List[Dict[str, Any]]]:
+    """
+    流式分页获取ArXiv论文，每解析完一页立即产出该页论文（已去除与前面各页重复的论文）
+    
+    Args:
+        query: 检索语句
+        max_results: 最大结果数量
+        page_size: 每页数量，默认settings.ARXIV_PAGE_SIZE
+        timeout: 整个检索的墙钟时间上限（秒），超时抛出TimeoutError
+        max_retries: 单页最大重试次数
+        sort_by: 排序方式 (relevance / lastUpdatedDate / submittedDate)
+        
+    Yields:
+        List[Dict]: 本页论文信息列表
+    """
+    page_size = page_size or settings.ARXIV_PAGE_SIZE
+    deadline = time.monotonic() + timeout if timeout else None
+    fetched = 0
+    seen = set()
+
+    while fetched < max_results:
+        size = min(page_size, max_results - fetched)
+        for attempt in range(max_retries):
+            try:
+                logger.info(f"请求ArXiv分页，查询: {query}, 起始: {fetched}, 数量: {size} (尝试 {attempt + 1}/{max_retries})")
+                page = fetch_page(query, fetched, size, sort_by=sort_by, deadline=deadline)
+                break
+            except TimeoutError:
+                raise
+            except Exception as e:
+                logger.error(f"ArXiv分页请求失败 (尝试 {attempt + 1}/{max_retries}): {str(e)}")
+                if attempt == max_retries - 1:
+                    raise
+                backoff = 2 ** attempt
+                if deadline is not None and time.monotonic() + backoff >= deadline:
+                    raise TimeoutError(f"ArXiv检索超时 ({timeout}秒)")
+                time.sleep(backoff)  # 指数退避
+
+        fresh = []
+        for paper in page:
+            if paper["id"] in seen:
+                continue
+            seen.add(paper["id"])
+            fresh.append(paper)
+        if fresh:
+            yield fresh
+        fetched += len(page)
+
+        # 返回数量不足一页说明结果已取完
+        if len(page) < size:
+            break
+
+
+def iter_papers(query: str, max_results: int = 10, page_size: Optional[int] = None, timeout: Optional[float] = None,
+                max_retries: int = 3, sort_by: str = "relevance") -> Iterator[Dict[str, Any]]:
+    """逐篇产出iter_pages的结果，参数同iter_pages"""
+    for page in iter_pages(query, max_results, page_size=page_size, timeout=timeout, max_retries=max_retries,
+                           sort_by=sort_by):
+        yield from page
+
+
+def get_papers(query="astronomy", max_results=2, timeout=30, max_retries=3, sort_by="relevance", use_cache=True,
+               mode=None, page_size=None, on_page: Optional[Callable[[List[Dict[str, Any]]], None]] = None):
+    """
+    从ArXiv获取论文信息，优先读取本地检索缓存，按检索模式使用本地BM25索引
     
     Args:
         query: 搜索查询字符串
         max_results: 最大结果数量
-        timeout: 超时时间（秒）
-        max_retries: 最大重试次数
+        timeout: 超时时间（秒），为整个检索的墙钟时间上限
+        max_retries: 单页最大重试次数
+        sort_by: 排序方式 (relevance / lastUpdatedDate / submittedDate)
+        use_cache: 是否使用本地检索缓存
+        mode: 检索模式 (remote / local_first / offline)，默认settings.PAPER_SEARCH_MODE
+        page_size: 每页数量，默认settings.ARXIV_PAGE_SIZE
+        on_page: 每得到一批论文即回调（ArXiv每解析完一页回调一次，缓存或本地索引结果整体回调一次），
+            回调收到的论文依次拼接即为返回的论文列表，供下游在检索结束前开始处理
         
     Returns:
         List[Dict]: 论文信息列表
     """
+    def emit(papers):
+        if on_page is not None and papers:
+            try:
+                on_page(papers)
+            except Exception as e:
+                logger.warning(f"检索结果回调失败: {e}")
+        return papers
+    
     paper_list = []
     
     # 限制最大结果数量以避免过载
@@ -51,63 +252,42 @@ def get_papers(query="astronomy", max_results=2, timeout=30, max_retries=3):
         logger.warning(f"限制搜索结果数量从 {max_results} 到 100 以避免过载")
         max_results = 100
     
-    for attempt in range(max_retries):
-        try:
-            logger.info(f"开始搜索ArXiv论文，查询: {query}, 最大结果: {max_results} (尝试 {attempt + 1}/{max_retries})")
-            
-            # 创建搜索引擎，设置超时
-            search_engine = arxiv.Search(
-                query=query,
-                max_results=max_results,
-                sort_by=arxiv.SortCriterion.Relevance
-            )
-            
-            # 设置超时时间
-            start_time = time.time()
-            result_count = 0
-            
-            # 使用新的迭代方法替代弃用的results()方法
-            for result in search_engine.results():
-                # 检查超时
-                if time.time() - start_time > timeout:
-                    logger.warning(f"ArXiv搜索超时 ({timeout}秒)，已获取 {result_count} 个结果")
-                    break
-                
-                paper_id = result.entry_id
-                paper_title = result.title
-                paper_pdf = result.pdf_url
-                paper_doi = result.doi
-                paper_abstract = result.summary.replace("\n", " ")
-                paper_authors = get_authors(result.authors)
-                primary_category = result.primary_category
-                publish_time = result.published.date().isoformat()
-
-                data = {"topic": query,
-                        "title": paper_title,
-                        "id": paper_id,
-                        "doi": paper_doi,
-                        "pdf": paper_pdf,
-                        "abstract": paper_abstract,
-                        "authors": paper_authors,
-                        "category": primary_category,
-                        "time": publish_time}
-
-                paper_list.append(data)
-                result_count += 1
-                
-                # 添加小延迟以避免过快请求
-                time.sleep(0.1)
-            
-            logger.info(f"成功获取 {len(paper_list)} 篇论文")
-            break
-            
-        except Exception as e:
-            logger.error(f"ArXiv搜索失败 (尝试 {attempt + 1}/{max_retries}): {str(e)}")
-            if attempt == max_retries - 1:
-                logger.error("所有重试都失败了，返回空列表")
-                return []
-            time.sleep(2 ** attempt)  # 指数退避
+    cache = get_arxiv_cache()
+    if use_cache:
+        cached_papers = cache.get_search(query, sort_by, max_results)
+        if cached_papers is not None:
+            logger.info(f"命中ArXiv检索缓存，查询: {query}, 返回 {len(cached_papers)} 篇论文")
+            return emit(cached_papers)
     
+    mode = mode or settings.PAPER_SEARCH_MODE
+    if mode in ("local_first", "offline"):
+        local_papers = search_local_papers(query, max_results, require_all_terms=True)
+        if len(local_papers) >= max_results or mode == "offline":
+            logger.info(f"本地索引返回 {len(local_papers)} 篇论文，查询: {query}")
+            return emit(local_papers)
+    
+    logger.info(f"开始搜索ArXiv论文，查询: {query}, 最大结果: {max_results}")
+    timed_out = False
+    try:
+        for page in iter_pages(query, max_results, page_size=page_size, timeout=timeout,
+                               max_retries=max_retries, sort_by=sort_by):
+            paper_list.extend(page)
+            emit(page)
+    except TimeoutError:
+        logger.warning(f"ArXiv搜索超时 ({timeout}秒)，已获取 {len(paper_list)} 个结果")
+        timed_out = True
+    except Exception as e:
+        logger.error(f"ArXiv搜索失败: {str(e)}")
+        if not paper_list:
+            local_papers = search_local_papers(query, max_results)
+            logger.error(f"所有重试都失败了，回退本地索引，返回 {len(local_papers)} 篇论文")
+            return emit(local_papers)
+        timed_out = True
+
+    logger.info(f"成功获取 {len(paper_list)} 篇论文")
+    # 超时截断的结果不能视为完整结果，缓存只对结果数不超过已取得数量的检索命中
+    cache.put_search(query, sort_by, max_results, paper_list, exhausted=False if timed_out else None)
+    get_paper_index().add_papers(paper_list)
     return paper_list
 
 
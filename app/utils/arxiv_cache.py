@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time : 2025/8/28 11:05
+# @Author : 桐
+# @QQ:1041264242
+# 注意事项：论文按entry_id单独存储，检索记录只保存有序的entry_id列表
+import json
+import time
+import logging
+import threading
+from typing import Any, Dict, List, Optional
+
+from app.core.config import settings
+from app.utils.tool import connect_sqlite
+
+logger = logging.getLogger(__name__)
+
+# ArXiv布尔运算符区分大小写，归一化时保持原样
+QUERY_OPERATORS = {"AND", "OR", "ANDNOT"}
+
+
+def normalize_query(query: str) -> str:
+    """
+    归一化检索语句：合并空白、转小写（布尔运算符除外）
+
+    Args:
+        query: 原始检索语句
+
+    Returns:
+        str: 归一化后的检索语句
+    """
+    return " ".join(
+        token if token in QUERY_OPERATORS else token.lower()
+        for token in query.split()
+    )
+
+
+class ArxivCache:
+    """ArXiv检索结果本地缓存"""
+
+    def __init__(self, db_path: str, ttl: int = 24 * 3600, enabled: bool = True):
+        self.db_path = db_path
+        self.ttl = ttl
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _get_conn(self):
+        if self._conn is None:
+            self._conn = connect_sqlite(self.db_path)
+            self._conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS papers (
+                    entry_id TEXT PRIMARY KEY,
+                    data TEXT NOT NULL,
+                    updated_at REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS searches (
+                    query TEXT NOT NULL,
+                    sort_by TEXT NOT NULL,
+                    max_results INTEGER NOT NULL,
+                    entry_ids TEXT NOT NULL,
+                    exhausted INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    PRIMARY KEY (query, sort_by, max_results)
+                );
+                """
+            )
+            self._conn.commit()
+        return self._conn
+
+    def get_search(self, query: str, sort_by: str, max_results: int) -> Optional[List[Dict[str, Any]]]:
+        """
+        查询缓存的检索结果，结果更多的缓存记录会被截取后返回
+
+        Args:
+            query: 检索语句
+            sort_by: 排序方式
+            max_results: 最大结果数量
+
+        Returns:
+            Optional[List[Dict]]: 命中时返回论文列表，否则返回None
+        """
+        if not self.enabled:
+            return None
+        try:
+            with self._lock:
+                conn = self._get_conn()
+                rows = conn.execute(
+                    """
+                    SELECT entry_ids, exhausted FROM searches
+                    WHERE query = ? AND sort_by = ? AND created_at > ?
+                    ORDER BY max_results DESC
+                    """,
+                    (normalize_query(query), sort_by, time.time() - self.ttl),
+                ).fetchall()
+                # 只有实际结果数足够，或已取得该检索的全部结果(exhausted)时才能命中；
+                # 超时截断的记录结果数不足，不能当作完整结果
+                entry_ids = None
+                for ids_json, exhausted in rows:
+                    ids = json.loads(ids_json)
+                    if exhausted or len(ids) >= max_results:
+                        entry_ids = ids[:max_results]
+                        break
+                if entry_ids is None:
+                    return None
+                papers = self._get_papers(conn, entry_ids)
+        except Exception as e:
+            logger.warning(f"读取ArXiv缓存失败: {e}")
+            return None
+
+        if len(papers) < len(entry_ids):
+            return None
+        for paper in papers:
+            paper["topic"] = query
+        return papers
+
+    def _get_papers(self, conn, entry_ids: List[str]) -> List[Dict[str, Any]]:
+        if not entry_ids:
+            return []
+        placeholders = ",".join("?" * len(entry_ids))
+        rows = dict(conn.execute(
+            f"SELECT entry_id, data FROM papers WHERE entry_id IN ({placeholders})", entry_ids
+        ).fetchall())
+        return [json.loads(rows[entry_id]) for entry_id in entry_ids if entry_id in rows]
+
+    def get_papers(self, entry_ids: List[str]) -> List[Dict[str, Any]]:
+        """
+        按entry_id批量读取论文记录
+
+        Args:
+            entry_ids: ArXiv entry_id列表
+
+        Returns:
+            List[Dict]: 按输入顺序排列的论文记录（缺失的跳过）
+        """
+        with self._lock:
+            return self._get_papers(self._get_conn(), entry_ids)
+
+    def put_search(self, query: str, sort_by: str, max_results: int, papers: List[Dict[str, Any]],
+                   exhausted: Optional[bool] = None):
+        """
+        保存检索结果
+
+        Args:
+            query: 检索语句
+            sort_by: 排序方式
+            max_results: 请求的最大结果数量
+            papers: 论文列表
+            exhausted: 是否已取得该检索的全部结果，默认按结果数是否少于max_results判断；
+                为False且结果数不足时（超时截断），只有结果数更少的检索能命中该记录
+        """
+        if exhausted is None:
+            exhausted = len(papers) < max_results
+        if not self.enabled or not papers:
+            return
+        now = time.time()
+        try:
+            with self._lock:
+                conn = self._get_conn()
+                conn.executemany(
+                    "INSERT OR REPLACE INTO papers (entry_id, data, updated_at) VALUES (?, ?, ?)",
+                    [(paper["id"], json.dumps(paper, ensure_ascii=False), now) for paper in papers],
+                )
+                conn.execute(
+                    "INSERT OR REPLACE INTO searches VALUES (?, ?, ?, ?, ?, ?)",
+                    (
+                        normalize_query(query),
+                        sort_by,
+                        max_results,
+                        json.dumps([paper["id"] for paper in papers]),
+                        int(exhausted),
+                        now,
+                    ),
+                )
+                conn.execute("DELETE FROM searches WHERE created_at <= ?", (now - self.ttl,))
+                conn.commit()
+        except Exception as e:
+            logger.warning(f"写入ArXiv缓存失败: {e}")
+
+
+_arxiv_cache: Optional[ArxivCache] = None
+_arxiv_cache_lock = threading.Lock()
+
+
+def get_arxiv_cache() -> ArxivCache:
+    """获取进程内共享的ArXiv缓存实例"""
+    global _arxiv_cache
+    if _arxiv_cache is None:
+        with _arxiv_cache_lock:
+            if _arxiv_cache is None:
+                _arxiv_cache = ArxivCache(
+                    db_path=settings.ARXIV_CACHE_PATH,
+                    ttl=settings.ARXIV_CACHE_TTL,
+                    enabled=settings.ARXIV_CACHE_ENABLED,
+                )
+    return _arxiv_cache
@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time : 2025/9/19 14:10
+# @Author : 桐
+# @QQ:1041264242
+# 注意事项：熔断器按服务地址(base_url)共享，同一地址下的服务提供方与MoA模型一起熔断；429与4xx不计为失败
+import time
+import logging
+import threading
+from typing import Any, Dict, Optional
+
+from app.core.config import settings
+from app.utils.metrics import metrics_registry
+
+logger = logging.getLogger(__name__)
+
+CIRCUIT_TRANSITIONS = metrics_registry.counter("llm_circuit_transitions_total", "熔断器状态切换次数",
+                                               ("endpoint", "state"))
+CIRCUIT_REJECTED = metrics_registry.counter("llm_circuit_rejected_total", "熔断期间被立即拒绝的请求数",
+                                            ("endpoint",))
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(RuntimeError):
+    """服务地址处于熔断状态，请求未发出即失败"""
+
+    def __init__(self, endpoint: str, retry_in: float):
+        super().__init__(f"服务 {endpoint} 已熔断，{retry_in:.1f} 秒后重新探测")
+        self.endpoint = endpoint
+        self.retry_in = retry_in
+
+
+def is_failure(error: BaseException) -> bool:
+    """
+    判断异常是否说明服务本身不可用：连接错误、超时与5xx计为失败，
+    429（由限流器处理）及其他4xx（请求或配置问题）不计
+
+    Args:
+        error: 请求抛出的异常
+
+    Returns:
+        bool: 是否计为失败
+    """
+    if isinstance(error, CircuitOpenError):
+        return False
+    status = getattr(error, "status_code", None)
+    if status is None:
+        return True
+    return status >= 500 or status == 408
+
+
+class CircuitBreaker:
+    """
+    单个服务地址的熔断器
+
+    连续失败达到阈值后熔断(open)，期间请求立即失败；熔断时间过后进入半开(half_open)状态，
+    只放行有限个探测请求，探测成功则恢复(closed)，失败则再次熔断且熔断时间加倍
+    """
+
+    def __init__(self, endpoint: str, failure_threshold: int = 5, reset_timeout: float = 30.0,
+                 max_reset_timeout: float = 300.0, half_open_probes: int = 1):
+        """
+        Args:
+            endpoint: 服务地址
+            failure_threshold: 触发熔断的连续失败次数
+            reset_timeout: 首次熔断的持续时间（秒）
+            max_reset_timeout: 熔断时间加倍的上限（秒）
+            half_open_probes: 半开状态下同时放行的探测请求数
+        """
+        self.endpoint = endpoint
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+        self.half_open_probes = half_open_probes
+        self._state = CLOSED
+        self._failures = 0
+        self._open_for = reset_timeout
+        self._opened_at = 0.0
+        self._probes = 0
+        self._lock = threading.Lock()
+
+    def _transition(self, state: str):
+        self._state = state
+        CIRCUIT_TRANSITIONS.inc(endpoint=self.endpoint, state=state)
+
+    def _current_state(self, now: float) -> str:
+        if self._state == OPEN and now - self._opened_at >= self._open_for:
+            self._transition(HALF_OPEN)
+            self._probes = 0
+            logger.info(f"服务 {self.endpoint} 熔断结束，进入半开状态")
+        return self._state
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._current_state(time.monotonic())
+
+    def available(self) -> bool:
+        """是否会放行请求（不占用探测名额），用于路由与MoA挑选模型"""
+        with self._lock:
+            state = self._current_state(time.monotonic())
+            return state == CLOSED or (state == HALF_OPEN and self._probes < self.half_open_probes)
+
+    def allow(self) -> bool:
+        """
+        申请发出请求
+
+        Returns:
+            bool: 是否为半开状态下的探测请求，请求结束后传给record_*/release
+
+        Raises:
+            CircuitOpenError: 熔断中，或半开状态下探测名额已满
+        """
+        with self._lock:
+            now = time.monotonic()
+            state = self._current_state(now)
+            if state == CLOSED:
+                return False
+            if state == HALF_OPEN and self._probes < self.half_open_probes:
+                self._probes += 1
+                return True
+            retry_in = max(self._opened_at + self._open_for - now, 0.0)
+        CIRCUIT_REJECTED.inc(endpoint=self.endpoint)
+        raise CircuitOpenError(self.endpoint, retry_in)
+
+    def record_success(self, probe: bool = False):
+        with self._lock:
+            self._failures = 0
+            if probe:
+                self._probes = max(self._probes - 1, 0)
+            if self._state != CLOSED:
+                self._open_for = self.reset_timeout
+                self._transition(CLOSED)
+                logger.info(f"服务 {self.endpoint} 探测成功，熔断恢复")
+
+    def record_failure(self, probe: bool = False):
+        with self._lock:
+            now = time.monotonic()
+            if probe:
+                self._probes = max(self._probes - 1, 0)
+            self._failures += 1
+            state = self._current_state(now)
+            if state == HALF_OPEN and probe:
+                self._open_for = min(self._open_for * 2, self.max_reset_timeout)
+            elif not (state == CLOSED and self._failures >= self.failure_threshold):
+                return
+            self._opened_at = now
+            self._transition(OPEN)
+            logger.warning(f"服务 {self.endpoint} 连续失败 {self._failures} 次，熔断 {self._open_for:.0f} 秒")
+
+    def release(self, probe: bool = False):
+        """请求被取消或以不计失败的错误结束时归还探测名额"""
+        if probe:
+            with self._lock:
+                self._probes = max(self._probes - 1, 0)
+
+    def settle(self, probe: bool, success: Optional[bool]):
+        """
+        记录请求结果
+
+        Args:
+            probe: allow()的返回值
+            success: True为成功，False为失败，None为不计（取消、429等）
+        """
+        if success is True:
+            self.record_success(probe)
+        elif success is False:
+            self.record_failure(probe)
+        else:
+            self.release(probe)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            now = time.monotonic()
+            state = self._current_state(now)
+            return {
+                "state": state,
+                "consecutive_failures": self._failures,
+                "retry_in": round(max(self._opened_at + self._open_for - now, 0.0), 3) if state == OPEN else None,
+            }
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(endpoint: str) -> Optional[CircuitBreaker]:
+    """
+    获取服务地址对应的熔断器
+
+    Args:
+        endpoint: 服务地址(base_url)
+
+    Returns:
+        Optional[CircuitBreaker]: 熔断器，未启用熔断时返回None
+    """
+    if not settings.CIRCUIT_BREAKER_ENABLED:
+        return None
+    endpoint = endpoint.rstrip("/")
+    breaker = _breakers.get(endpoint)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = _breakers.get(endpoint)
+            if breaker is None:
+                breaker = CircuitBreaker(
+                    endpoint,
+                    failure_threshold=settings.CIRCUIT_FAILURE_THRESHOLD,
+                    reset_timeout=settings.CIRCUIT_RESET_TIMEOUT,
+                    max_reset_timeout=settings.CIRCUIT_MAX_RESET_TIMEOUT,
+                    half_open_probes=settings.CIRCUIT_HALF_OPEN_PROBES,
+                )
+                _breakers[endpoint] = breaker
+    return breaker
+
+
+def endpoint_available(endpoint: str) -> bool:
+    """服务地址当前是否放行请求，未启用熔断时总是放行"""
+    breaker = get_circuit_breaker(endpoint)
+    return breaker is None or breaker.available()
+
+
+def circuit_stats() -> Dict[str, Dict[str, Any]]:
+    """获取所有熔断器的状态"""
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return {breaker.endpoint: breaker.stats() for breaker in breakers}
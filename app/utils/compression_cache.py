@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time : 2025/9/9 10:05
+# @Author : 桐
+# @QQ:1041264242
+# 注意事项：压缩结果按 (论文ID, 模型, 模板摘要) 缓存，模型或压缩模板变化后自动失效；事件循环中使用aget_many/aset
+import time
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, Optional
+
+from app.core.config import settings
+from app.utils.tool import connect_sqlite
+
+logger = logging.getLogger(__name__)
+
+
+class PaperCompressionCache:
+    """论文全文压缩结果缓存"""
+
+    def __init__(self, db_path: str, enabled: bool = True):
+        self.db_path = db_path
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._conn = None
+        # 异步接口的磁盘读写在独立线程中执行，不占用调用方的事件循环
+        self._disk_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="compression-cache")
+
+    def _get_conn(self):
+        if self._conn is None:
+            self._conn = connect_sqlite(self.db_path)
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS compressions (
+                    paper_id TEXT NOT NULL,
+                    model TEXT NOT NULL,
+                    template_digest TEXT NOT NULL,
+                    summary TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    PRIMARY KEY (paper_id, model, template_digest)
+                )
+                """
+            )
+            self._conn.commit()
+        return self._conn
+
+    def get_many(self, paper_ids: Iterable[str], model: str, template_digest: str) -> Dict[str, str]:
+        """
+        批量查询压缩结果
+
+        Args:
+            paper_ids: 论文ID列表
+            model: 模型名称
+            template_digest: 压缩模板摘要
+
+        Returns:
+            Dict[str, str]: 命中缓存的 论文ID -> 压缩结果
+        """
+        paper_ids = list(paper_ids)
+        if not self.enabled or not paper_ids:
+            return {}
+        placeholders = ",".join("?" * len(paper_ids))
+        try:
+            with self._lock:
+                rows = self._get_conn().execute(
+                    f"SELECT paper_id, summary FROM compressions "
+                    f"WHERE model = ? AND template_digest = ? AND paper_id IN ({placeholders})",
+                    (model, template_digest, *paper_ids),
+                ).fetchall()
+            return dict(rows)
+        except Exception as e:
+            logger.warning(f"读取论文压缩缓存失败: {e}")
+            return {}
+
+    async def aget_many(self, paper_ids: Iterable[str], model: str, template_digest: str) -> Dict[str, str]:
+        """批量查询压缩结果（异步），在缓存线程中读取"""
+        if not self.enabled:
+            return {}
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._disk_executor, self.get_many, list(paper_ids), model, template_digest)
+
+    def get(self, paper_id: str, model: str, template_digest: str) -> Optional[str]:
+        """查询单篇论文的压缩结果"""
+        return self.get_many([paper_id], model, template_digest).get(paper_id)
+
+    def set(self, paper_id: str, model: str, template_digest: str, summary: str):
+        """写入压缩结果"""
+        if not self.enabled:
+            return
+        try:
+            with self._lock:
+                conn = self._get_conn()
+                conn.execute(
+                    "INSERT OR REPLACE INTO compressions (paper_id, model, template_digest, summary, created_at) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (paper_id, model, template_digest, summary, time.time()),
+                )
+                conn.commit()
+        except Exception as e:
+            logger.warning(f"写入论文压缩缓存失败: {e}")
+
+    async def aset(self, paper_id: str, model: str, template_digest: str, summary: str):
+        """写入压缩结果（异步），在缓存线程中写入"""
+        if not self.enabled:
+            return
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._disk_executor, self.set, paper_id, model, template_digest, summary)
+
+
+_compression_cache: Optional[PaperCompressionCache] = None
+_compression_cache_lock = threading.Lock()
+
+
+def get_compression_cache() -> PaperCompressionCache:
+    """获取进程内共享的论文压缩缓存实例"""
+    global _compression_cache
+    if _compression_cache is None:
+        with _compression_cache_lock:
+            if _compression_cache is None:
+                _compression_cache = PaperCompressionCache(
+                    db_path=settings.COMPRESSION_CACHE_PATH,
+                    enabled=settings.COMPRESSION_CACHE_ENABLED,
+                )
+    return _compression_cache
@@ -3,14 +3,34 @@
 # @Time : 2024/7/7 14:06
 # @Author : 桐
 # @QQ:1041264242
-# 注意事项：
+# 注意事项：acall_*为异步接口，call_*为同步包装，两者共用后台事件循环中的连接池
 
 import json
-import tiktoken
-from dashscope import Generation
-import dashscope
-from openai import OpenAI
-from app.core.config import DEEPSEEK_API_KEY, QWEN_API_KEY
+import time
+import asyncio
+from app.core.config import settings, DEEPSEEK_API_KEY, QWEN_API_KEY
+from app.utils.circuit_breaker import get_circuit_breaker, is_failure
+from app.utils.llm_cache import get_llm_cache
+from app.utils.llm_client import get_async_client, run_in_provider_loop, run_sync
+from app.utils.metrics import record_llm_call, record_llm_first_content
+from app.utils.prompt_packer import count_tokens
+from app.utils.rate_limit import get_rate_governor, is_rate_limited
+
+# 服务提供方连接信息，通义千问使用DashScope的OpenAI兼容接口
+PROVIDERS = {
+    "deepseek": {"api_key": DEEPSEEK_API_KEY, "base_url": settings.DEEPSEEK_BASE_URL},
+    "qwen": {"api_key": QWEN_API_KEY, "base_url": settings.QWEN_BASE_URL},
+}
+
+# 各服务提供方的默认模型
+DEEPSEEK_MODEL = "deepseek-chat"
+QWEN_MAX_MODEL = "qwen-max"
+
+# MoA模型配置(model_type)对应的OpenAI兼容服务地址，openai_chat类型使用配置中的client_args.base_url
+MODEL_TYPE_BASE_URLS = {
+    "dashscope_chat": settings.QWEN_BASE_URL,
+    "gemini_chat": "https://generativelanguage.googleapis.com/v1beta/openai/",
+}
 
 
 def calculate_token_cost(text, model_name="gpt-3.5-turbo"):
@@ -25,112 +45,349 @@ def calculate_token_cost(text, model_name="gpt-3.5-turbo"):
         int: token数量
     """
     try:
-        encoding = tiktoken.encoding_for_model(model_name)
-        tokens = encoding.encode(text)
-        return len(tokens)
+        return count_tokens(text, model_name)
     except Exception as e:
         print(f"Error calculating tokens: {e}")
         return 0
 
 
-def call_with_deepseek(system_prompt, question):
+async def _astream(client, provider, model, messages, kwargs, sink, started):
     """
-    使用DeepSeek模型进行对话
+    流式请求，增量文本写入sink
     
     Args:
+        client: 异步客户端
+        provider (str): 服务提供方
+        model (str): 模型名称
+        messages (list): 对话消息
+        kwargs (dict): 其他请求参数
+        sink (PartialWriter): 部分结果写入器
+        started (float): 请求开始时间，用于统计首个内容的到达时间
+    
+    Returns:
+        tuple: (完整回复, usage)
+    """
+    if settings.LLM_STREAM_INCLUDE_USAGE:
+        kwargs = {**kwargs, "stream_options": {"include_usage": True}}
+    sink.begin(model)
+    stream = await client.chat.completions.create(model=model, messages=messages, stream=True, **kwargs)
+    parts = []
+    usage = None
+    try:
+        async for chunk in stream:
+            if getattr(chunk, "usage", None) is not None:
+                usage = chunk.usage
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if not delta:
+                continue
+            if not parts:
+                record_llm_first_content(provider, model, time.perf_counter() - started)
+            parts.append(delta)
+            sink.append(delta)
+    finally:
+        # 被取消或中途出错时关闭连接，不再接收剩余内容
+        await stream.close()
+    sink.end(usage)
+    return "".join(parts), usage
+
+
+async def _achat(provider, model, system_prompt, question, response_format=None,
+                 use_cache=True, cache_response_format=None, connection=None, sink=None):
+    """
+    发起一次对话请求，先查询LLM缓存，未命中时请求模型并写回缓存
+    
+    Args:
+        provider (str): 服务提供方，对应PROVIDERS中的键
+        model (str): 模型名称
         system_prompt (str): 系统提示词
         question (str): 用户问题
+        response_format (dict): 请求的返回格式
+        use_cache (bool): 为False时绕过缓存直接请求
+        cache_response_format (dict): 参与缓存键计算的返回格式，默认同response_format
+        connection (dict): 连接信息(api_key, base_url)，默认取PROVIDERS[provider]
+        sink (PartialWriter): 部分结果写入器，提供时以流式请求并增量写入
     
     Returns:
         str: 模型回复
     """
-    client = OpenAI(api_key=DEEPSEEK_API_KEY, base_url="https://api.deepseek.com")
+    cache = get_llm_cache()
+    key = None
+    if use_cache:
+        key = cache.make_key(provider, model, system_prompt, question, cache_response_format or response_format)
+        # 磁盘层在缓存线程中读取，不阻塞后台事件循环中的其他请求
+        cached = await cache.aget(key)
+        if cached is not None:
+            record_llm_call(provider, model, "cached")
+            return cached
+
+    conn = connection or PROVIDERS[provider]
+    client = get_async_client(conn["api_key"], conn["base_url"])
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": question},
+    ]
+    kwargs = {}
+    if response_format is not None:
+        kwargs["response_format"] = response_format
+    governor = get_rate_governor()
+    breaker = get_circuit_breaker(conn["base_url"])
+    retries = 0
+    while True:
+        # 服务已熔断时立即抛出CircuitOpenError，不再排队等待超时
+        probe = breaker.allow() if breaker is not None else False
+        success = None
+        try:
+            # 请求耗时不含在限流器中的排队时间
+            async with governor.slot(provider, model, system_prompt + question) as permit:
+                started = time.perf_counter()
+                try:
+                    if sink is None:
+                        response = await client.chat.completions.create(
+                            model=model, messages=messages, stream=False, **kwargs
+                        )
+                        content = response.choices[0].message.content
+                        usage = getattr(response, "usage", None)
+                    else:
+                        content, usage = await _astream(client, provider, model, messages, kwargs, sink, started)
+                except asyncio.CancelledError:
+                    # MoA达到法定响应数后会取消其余请求
+                    record_llm_call(provider, model, "cancelled", time.perf_counter() - started)
+                    raise
+                except Exception as e:
+                    # 限流器已按Retry-After暂停该提供方，重新排队等待许可
+                    if permit is not None and is_rate_limited(e) and retries < settings.LLM_RATE_LIMIT_RETRIES:
+                        retries += 1
+                        record_llm_call(provider, model, "rate_limited", time.perf_counter() - started)
+                        continue
+                    success = False if is_failure(e) else None
+                    record_llm_call(provider, model, "error", time.perf_counter() - started)
+                    raise
+                success = True
+                if permit is not None:
+                    permit.complete(usage)
+        finally:
+            if breaker is not None:
+                breaker.settle(probe, success)
+        break
+    record_llm_call(provider, model, "ok", time.perf_counter() - started, usage)
+
+    if key is not None:
+        await cache.aset(key, content, provider=provider, model=model)
+    return content
+
+
+async def acall_with_deepseek(system_prompt, question, use_cache=True):
+    """
+    使用DeepSeek模型进行对话（异步）
+    
+    Args:
+        system_prompt (str): 系统提示词
+        question (str): 用户问题
+        use_cache (bool): 是否使用LLM缓存
     
-    response = client.chat.completions.create(
-        model="deepseek-chat",
-        messages=[
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": question},
-        ],
-        stream=False
+    Returns:
+        str: 模型回复
+    """
+    return await run_in_provider_loop(
+        _achat("deepseek", DEEPSEEK_MODEL, system_prompt, question, use_cache=use_cache)
     )
+
+
+async def acall_with_deepseek_jsonout(system_prompt, question, use_cache=True):
+    """
+    使用DeepSeek模型进行对话，返回JSON格式（异步）
     
-    return response.choices[0].message.content
+    Args:
+        system_prompt (str): 系统提示词
+        question (str): 用户问题
+        use_cache (bool): 是否使用LLM缓存
+    
+    Returns:
+        str: JSON格式的模型回复
+    """
+    return await run_in_provider_loop(
+        _achat("deepseek", DEEPSEEK_MODEL, system_prompt, question,
+               response_format={'type': 'json_object'}, use_cache=use_cache)
+    )
 
 
-def call_with_deepseek_jsonout(system_prompt, question):
+async def acall_with_qwenmax(system_prompt, question, use_cache=True):
     """
-    使用DeepSeek模型进行对话，返回JSON格式
+    使用QwenMax模型进行对话（异步）
+    
+    Args:
+        system_prompt (str): 系统提示词
+        question (str): 用户问题
+        use_cache (bool): 是否使用LLM缓存
+    
+    Returns:
+        str: 模型回复
+    """
+    return await run_in_provider_loop(
+        _achat("qwen", QWEN_MAX_MODEL, system_prompt, question, use_cache=use_cache)
+    )
+
+
+async def acall_with_qwenmax_jsonout(system_prompt, question, use_cache=True):
+    """
+    使用QwenMax模型进行对话，返回JSON格式（异步）
     
     Args:
         system_prompt (str): 系统提示词
         question (str): 用户问题
+        use_cache (bool): 是否使用LLM缓存
     
     Returns:
         str: JSON格式的模型回复
     """
-    client = OpenAI(api_key=DEEPSEEK_API_KEY, base_url="https://api.deepseek.com")
-    
-    response = client.chat.completions.create(
-        model="deepseek-chat",
-        messages=[
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": question},
-        ],
-        response_format={
-            'type': 'json_object'
-        },
-        stream=False
+    # 请求参数与acall_with_qwenmax一致，但调用方期望JSON，缓存单独分区避免串用
+    return await run_in_provider_loop(
+        _achat("qwen", QWEN_MAX_MODEL, system_prompt, question,
+               use_cache=use_cache, cache_response_format={'type': 'json_object'})
     )
+
+
+def model_config_connection(model_config):
+    """
+    根据MoA模型配置获取连接信息
+    
+    Args:
+        model_config (dict): model_configs中的单个配置
     
-    return response.choices[0].message.content
+    Returns:
+        dict: 包含api_key和base_url的连接信息
+    """
+    base_url = model_config.get("client_args", {}).get("base_url") \
+        or MODEL_TYPE_BASE_URLS.get(model_config.get("model_type"))
+    if not base_url:
+        raise ValueError(f"无法确定模型 {model_config.get('config_name')} 的服务地址")
+    return {"api_key": model_config["api_key"], "base_url": base_url}
 
 
-def call_with_qwenmax(system_prompt, question):
+async def acall_with_model_config(model_config, system_prompt, question, use_cache=True, sink=None):
     """
-    使用QwenMax模型进行对话
+    使用MoA模型配置中的任意模型进行对话（异步）
     
     Args:
+        model_config (dict): model_configs中的单个配置
         system_prompt (str): 系统提示词
         question (str): 用户问题
+        use_cache (bool): 是否使用LLM缓存
+        sink (PartialWriter): 部分结果写入器，提供时以流式请求并增量写入
     
     Returns:
         str: 模型回复
     """
-    dashscope.api_key = QWEN_API_KEY
-    
-    response = Generation.call(
-        model='qwen-max',
-        messages=[
-            {'role': 'system', 'content': system_prompt},
-            {'role': 'user', 'content': question}
-        ],
-        result_format='message',
+    return await run_in_provider_loop(
+        _achat(model_config["config_name"], model_config["model_name"], system_prompt, question,
+               use_cache=use_cache, connection=model_config_connection(model_config), sink=sink)
     )
+
+
+# PROVIDERS中各服务提供方的默认模型
+PROVIDER_MODELS = {
+    "deepseek": DEEPSEEK_MODEL,
+    "qwen": QWEN_MAX_MODEL,
+}
+
+
+def provider_model_config(provider):
+    """
+    将PROVIDERS中的服务提供方表示为MoA模型配置格式，config_name与acall_with_deepseek等接口的缓存分区一致
+    
+    Args:
+        provider (str): 服务提供方，对应PROVIDERS中的键
     
-    return response.output.choices[0]['message']['content']
+    Returns:
+        dict: 模型配置
+    """
+    conn = PROVIDERS[provider]
+    return {
+        "config_name": provider,
+        "model_type": "openai_chat",
+        "model_name": PROVIDER_MODELS[provider],
+        "api_key": conn["api_key"],
+        "client_args": {"base_url": conn["base_url"]},
+    }
 
 
-def call_with_qwenmax_jsonout(system_prompt, question):
+async def acached_answer(model_config, system_prompt, question):
     """
-    使用QwenMax模型进行对话，返回JSON格式
+    查询某个模型配置对同一问题的缓存回复，不发起请求（异步）
     
     Args:
+        model_config (dict): 模型配置
         system_prompt (str): 系统提示词
         question (str): 用户问题
     
+    Returns:
+        str: 缓存的回复，未命中时返回None
+    """
+    cache = get_llm_cache()
+    key = cache.make_key(model_config["config_name"], model_config["model_name"], system_prompt, question, None)
+    cached = await cache.aget(key)
+    if cached is not None:
+        record_llm_call(model_config["config_name"], model_config["model_name"], "cached")
+    return cached
+
+
+def call_with_deepseek(system_prompt, question, use_cache=True):
+    """
+    使用DeepSeek模型进行对话
+    
+    Args:
+        system_prompt (str): 系统提示词
+        question (str): 用户问题
+        use_cache (bool): 是否使用LLM缓存
+    
+    Returns:
+        str: 模型回复
+    """
+    return run_sync(acall_with_deepseek(system_prompt, question, use_cache=use_cache))
+
+
+def call_with_deepseek_jsonout(system_prompt, question, use_cache=True):
+    """
+    使用DeepSeek模型进行对话，返回JSON格式
+    
+    Args:
+        system_prompt (str): 系统提示词
+        question (str): 用户问题
+        use_cache (bool): 是否使用LLM缓存
+    
     Returns:
         str: JSON格式的模型回复
     """
-    dashscope.api_key = QWEN_API_KEY
+    return run_sync(acall_with_deepseek_jsonout(system_prompt, question, use_cache=use_cache))
+
+
+def call_with_qwenmax(system_prompt, question, use_cache=True):
+    """
+    使用QwenMax模型进行对话
     
-    response = Generation.call(
-        model='qwen-max',
-        messages=[
-            {'role': 'system', 'content': system_prompt},
-            {'role': 'user', 'content': question}
-        ],
-        result_format='message',
-    )
+    Args:
+        system_prompt (str): 系统提示词
+        question (str): 用户问题
+        use_cache (bool): 是否使用LLM缓存
+    
+    Returns:
+        str: 模型回复
+    """
+    return run_sync(acall_with_qwenmax(system_prompt, question, use_cache=use_cache))
+
+
+def call_with_qwenmax_jsonout(system_prompt, question, use_cache=True):
+    """
+    使用QwenMax模型进行对话，返回JSON格式
     
-    return response.output.choices[0]['message']['content']
\ No newline at end of file
+    Args:
+        system_prompt (str): 系统提示词
+        question (str): 用户问题
+        use_cache (bool): 是否使用LLM缓存
+    
+    Returns:
+        str: JSON格式的模型回复
+    """
+    return run_sync(acall_with_qwenmax_jsonout(system_prompt, question, use_cache=use_cache))
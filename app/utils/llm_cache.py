@@ -0,0 +1,331 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time : 2025/8/26 10:12
+# @Author : 桐
+# @QQ:1041264242
+# 注意事项：两级缓存，内存LRU在前，SQLite(WAL)持久化在后；事件循环中使用aget/aset，磁盘读写在缓存线程中执行
+import json
+import time
+import asyncio
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional, Tuple
+
+from app.core.config import settings
+from app.utils.tool import connect_sqlite
+
+logger = logging.getLogger(__name__)
+
+# 内存命中计数累积到该值后再批量写回磁盘，避免每次命中都写库
+HIT_FLUSH_THRESHOLD = 32
+
+
+class LLMCache:
+    """LLM调用结果缓存（内容寻址）"""
+
+    def __init__(self, db_path: str, ttl: int = 7 * 24 * 3600, memory_size: int = 256,
+                 max_entries: int = 20000, max_bytes: int = 512 * 1024 * 1024, enabled: bool = True):
+        self.db_path = db_path
+        self.ttl = ttl
+        self.memory_size = memory_size
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+
+        # 内存层与磁盘层分别加锁，事件循环中只持有内存锁，不会等待磁盘读写
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+        self._pending_hits: Dict[str, int] = {}
+        self._conn = None
+        # 异步接口的磁盘读写在独立线程中执行，不占用调用方的事件循环
+        self._disk_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="llm-cache")
+
+    @staticmethod
+    def make_key(provider: str, model: str, system_prompt: str, question: str,
+                 response_format: Optional[Dict[str, Any]] = None) -> str:
+        """
+        根据请求内容生成缓存键
+
+        Args:
+            provider: 服务提供方
+            model: 模型名称
+            system_prompt: 系统提示词
+            question: 用户问题
+            response_format: 返回格式
+
+        Returns:
+            str: sha256十六进制摘要
+        """
+        payload = json.dumps(
+            [provider, model, system_prompt, question, response_format],
+            ensure_ascii=False,
+            sort_keys=True,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _get_conn(self):
+        if self._conn is None:
+            self._conn = connect_sqlite(self.db_path)
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS llm_cache (
+                    key TEXT PRIMARY KEY,
+                    provider TEXT,
+                    model TEXT,
+                    response TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    expires_at REAL NOT NULL,
+                    last_access REAL NOT NULL,
+                    hits INTEGER NOT NULL DEFAULT 0
+                )
+                """
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_access ON llm_cache(last_access)")
+            self._conn.commit()
+        return self._conn
+
+    def _remember(self, key: str, value: str, expires_at: float):
+        with self._lock:
+            self._memory[key] = (value, expires_at)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_size:
+                self._memory.popitem(last=False)
+
+    def _forget(self, key: str):
+        with self._lock:
+            self._memory.pop(key, None)
+            self._pending_hits.pop(key, None)
+
+    def _flush_hits(self):
+        with self._lock:
+            pending, self._pending_hits = self._pending_hits, {}
+        if not pending:
+            return
+        now = time.time()
+        with self._db_lock:
+            conn = self._get_conn()
+            conn.executemany(
+                "UPDATE llm_cache SET hits = hits + ?, last_access = ? WHERE key = ?",
+                [(count, now, key) for key, count in pending.items()],
+            )
+            conn.commit()
+
+    def _get_memory(self, key: str, now: float) -> Tuple[Optional[str], bool]:
+        """
+        查询内存层
+
+        Returns:
+            Tuple[Optional[str], bool]: (命中的回复, 是否需要写回累积的命中计数)
+        """
+        with self._lock:
+            cached = self._memory.get(key)
+            if cached is None:
+                return None, False
+            value, expires_at = cached
+            if expires_at <= now:
+                del self._memory[key]
+                return None, False
+            self._memory.move_to_end(key)
+            self._pending_hits[key] = self._pending_hits.get(key, 0) + 1
+            return value, len(self._pending_hits) >= HIT_FLUSH_THRESHOLD
+
+    def _get_disk(self, key: str, now: float) -> Optional[str]:
+        """查询磁盘层，命中时载入内存层"""
+        try:
+            with self._db_lock:
+                conn = self._get_conn()
+                row = conn.execute(
+                    "SELECT response, expires_at FROM llm_cache WHERE key = ?", (key,)
+                ).fetchone()
+                if row is None:
+                    return None
+                value, expires_at = row
+                if expires_at <= now:
+                    conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                    conn.commit()
+                    return None
+                conn.execute(
+                    "UPDATE llm_cache SET hits = hits + 1, last_access = ? WHERE key = ?", (now, key)
+                )
+                conn.commit()
+            self._remember(key, value, expires_at)
+            return value
+        except Exception as e:
+            logger.warning(f"读取LLM缓存失败: {e}")
+            return None
+
+    def _flush_hits_quietly(self):
+        try:
+            self._flush_hits()
+        except Exception as e:
+            logger.warning(f"写回LLM缓存命中计数失败: {e}")
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        读取缓存（在调用线程中读写磁盘）
+
+        Args:
+            key: 缓存键
+
+        Returns:
+            Optional[str]: 命中时返回模型回复，否则返回None
+        """
+        if not self.enabled:
+            return None
+        now = time.time()
+        value, flush = self._get_memory(key, now)
+        if value is not None:
+            if flush:
+                self._flush_hits_quietly()
+            return value
+        return self._get_disk(key, now)
+
+    async def aget(self, key: str) -> Optional[str]:
+        """
+        读取缓存（异步），内存层在当前事件循环中查询，磁盘层在缓存线程中读取
+
+        Args:
+            key: 缓存键
+
+        Returns:
+            Optional[str]: 命中时返回模型回复，否则返回None
+        """
+        if not self.enabled:
+            return None
+        now = time.time()
+        value, flush = self._get_memory(key, now)
+        if value is not None:
+            if flush:
+                self._disk_executor.submit(self._flush_hits_quietly)
+            return value
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._disk_executor, self._get_disk, key, now)
+
+    def _write(self, key: str, value: str, provider: str, model: str, now: float, expires_at: float):
+        """写入磁盘层并按上限淘汰"""
+        try:
+            with self._db_lock:
+                conn = self._get_conn()
+                conn.execute(
+                    """
+                    INSERT OR REPLACE INTO llm_cache
+                        (key, provider, model, response, size, created_at, expires_at, last_access, hits)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, COALESCE((SELECT hits FROM llm_cache WHERE key = ?), 0))
+                    """,
+                    (key, provider, model, value, len(value.encode("utf-8")), now, expires_at, now, key),
+                )
+                self._evict(conn, now)
+                conn.commit()
+        except Exception as e:
+            logger.warning(f"写入LLM缓存失败: {e}")
+
+    def set(self, key: str, value: str, provider: str = "", model: str = ""):
+        """
+        写入缓存（在调用线程中写入磁盘）
+
+        Args:
+            key: 缓存键
+            value: 模型回复
+            provider: 服务提供方
+            model: 模型名称
+        """
+        if not self.enabled or not value:
+            return
+        now = time.time()
+        expires_at = now + self.ttl
+        self._remember(key, value, expires_at)
+        self._write(key, value, provider, model, now, expires_at)
+
+    async def aset(self, key: str, value: str, provider: str = "", model: str = ""):
+        """
+        写入缓存（异步），内存层立即可见，磁盘层在缓存线程中写入
+
+        Args:
+            key: 缓存键
+            value: 模型回复
+            provider: 服务提供方
+            model: 模型名称
+        """
+        if not self.enabled or not value:
+            return
+        now = time.time()
+        expires_at = now + self.ttl
+        self._remember(key, value, expires_at)
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._disk_executor, self._write, key, value, provider, model, now, expires_at)
+
+    def _evict(self, conn, now: float):
+        """清理过期条目，并按最近访问时间淘汰超出条数/容量上限的条目"""
+        conn.execute("DELETE FROM llm_cache WHERE expires_at <= ?", (now,))
+        count, total_bytes = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_cache").fetchone()
+        if count <= self.max_entries and total_bytes <= self.max_bytes:
+            return
+
+        evicted = 0
+        rows = conn.execute("SELECT key, size FROM llm_cache ORDER BY last_access ASC").fetchall()
+        for key, size in rows:
+            if count <= self.max_entries and total_bytes <= self.max_bytes:
+                break
+            conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+            self._forget(key)
+            count -= 1
+            total_bytes -= size
+            evicted += 1
+        logger.info(f"LLM缓存淘汰 {evicted} 条记录")
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        获取缓存统计信息
+
+        Returns:
+            Dict[str, Any]: 条目数、占用字节数、累计命中次数等
+        """
+        self._flush_hits()
+        with self._db_lock:
+            count, total_bytes, hits = self._get_conn().execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(hits), 0) FROM llm_cache"
+            ).fetchone()
+        with self._lock:
+            memory_entries = len(self._memory)
+        return {
+            "enabled": self.enabled,
+            "entries": count,
+            "bytes": total_bytes,
+            "hits": hits,
+            "memory_entries": memory_entries,
+        }
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._memory.clear()
+            self._pending_hits.clear()
+        with self._db_lock:
+            self._get_conn().execute("DELETE FROM llm_cache")
+            self._get_conn().commit()
+
+
+_llm_cache: Optional[LLMCache] = None
+_llm_cache_lock = threading.Lock()
+
+
+def get_llm_cache() -> LLMCache:
+    """获取进程内共享的LLM缓存实例"""
+    global _llm_cache
+    if _llm_cache is None:
+        with _llm_cache_lock:
+            if _llm_cache is None:
+                _llm_cache = LLMCache(
+                    db_path=settings.LLM_CACHE_PATH,
+                    ttl=settings.LLM_CACHE_TTL,
+                    memory_size=settings.LLM_CACHE_MEMORY_SIZE,
+                    max_entries=settings.LLM_CACHE_MAX_ENTRIES,
+                    max_bytes=settings.LLM_CACHE_MAX_BYTES,
+                    enabled=settings.LLM_CACHE_ENABLED,
+                )
+    return _llm_cache
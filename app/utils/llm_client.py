@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time : 2025/8/27 15:40
+# @Author : 桐
+# @QQ:1041264242
+# 注意事项：所有异步模型请求都在同一个后台事件循环中执行，HTTP连接池与该循环绑定
+import asyncio
+import logging
+import threading
+from typing import TYPE_CHECKING, Any, Awaitable, Dict, Optional, Tuple
+
+from app.core.config import settings
+
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI
+
+logger = logging.getLogger(__name__)
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_thread: Optional[threading.Thread] = None
+_loop_lock = threading.Lock()
+
+_clients: Dict[Tuple[str, str], "AsyncOpenAI"] = {}
+
+
+def get_provider_loop() -> asyncio.AbstractEventLoop:
+    """
+    获取模型请求专用的后台事件循环，首次调用时启动
+
+    Returns:
+        asyncio.AbstractEventLoop: 后台事件循环
+    """
+    global _loop, _loop_thread
+    if _loop is None:
+        with _loop_lock:
+            if _loop is None:
+                loop = asyncio.new_event_loop()
+                thread = threading.Thread(target=loop.run_forever, name="llm-provider-loop", daemon=True)
+                thread.start()
+                _loop_thread = thread
+                _loop = loop
+                logger.info("LLM后台事件循环已启动")
+    return _loop
+
+
+def _in_provider_loop() -> bool:
+    try:
+        return asyncio.get_running_loop() is _loop
+    except RuntimeError:
+        return False
+
+
+async def run_in_provider_loop(coro: Awaitable) -> Any:
+    """
+    在后台事件循环中执行协程，可从任意事件循环中await
+
+    Args:
+        coro: 协程对象
+
+    Returns:
+        Any: 协程返回值
+    """
+    if _in_provider_loop():
+        return await coro
+    future = asyncio.run_coroutine_threadsafe(coro, get_provider_loop())
+    return await asyncio.wrap_future(future)
+
+
+def run_sync(coro: Awaitable, timeout: Optional[float] = None) -> Any:
+    """
+    在同步代码中执行协程并等待结果
+
+    Args:
+        coro: 协程对象
+        timeout: 等待超时时间（秒）
+
+    Returns:
+        Any: 协程返回值
+    """
+    if _in_provider_loop():
+        coro.close()
+        raise RuntimeError("不能在LLM后台事件循环内同步等待，请直接await对应的异步函数")
+    future = asyncio.run_coroutine_threadsafe(coro, get_provider_loop())
+    return future.result(timeout)
+
+
+def get_async_client(api_key: str, base_url: str) -> "AsyncOpenAI":
+    """
+    获取共享的OpenAI兼容异步客户端，按(base_url, api_key)复用长连接
+    仅在后台事件循环中调用
+
+    Args:
+        api_key: API密钥
+        base_url: 服务地址
+
+    Returns:
+        AsyncOpenAI: 异步客户端
+    """
+    key = (base_url, api_key)
+    client = _clients.get(key)
+    if client is None:
+        # openai SDK导入较慢，首次请求时再加载，避免拖慢服务启动
+        import httpx
+        from openai import AsyncOpenAI
+        from app.utils.rate_limit import observe_response
+
+        http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=settings.LLM_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.LLM_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=settings.LLM_KEEPALIVE_EXPIRY,
+            ),
+            timeout=httpx.Timeout(settings.LLM_TIMEOUT, connect=10.0),
+            # SDK内部重试收到的429同样反馈给限流器
+            event_hooks={"response": [observe_response]},
+        )
+        client = AsyncOpenAI(api_key=api_key, base_url=base_url, http_client=http_client)
+        _clients[key] = client
+        logger.info(f"创建LLM客户端连接池: {base_url}")
+    return client
+
+
+async def _close_clients():
+    for client in list(_clients.values()):
+        try:
+            await client.close()
+        except Exception as e:
+            logger.warning(f"关闭LLM客户端失败: {e}")
+    _clients.clear()
+
+
+def close_clients():
+    """关闭所有共享客户端及其连接池"""
+    if _loop is None:
+        return
+    run_sync(_close_clients(), timeout=10)
@@ -0,0 +1,398 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time : 2025/9/15 10:40
+# @Author : 桐
+# @QQ:1041264242
+# 注意事项：进程级指标（计数器、直方图）汇总全部任务，可导出为Prometheus文本格式；
+#          单个任务的指标由上下文变量中的TaskMetrics收集，协程经run_coroutine_threadsafe提交到
+#          LLM后台事件循环时会复制调用方上下文，因此后台循环中的模型调用也会记到发起任务上
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from app.core.config import settings
+
+# 耗时直方图的默认分桶（秒），覆盖毫秒级缓存命中到数分钟的模型调用
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _format_labels(names: Tuple[str, ...], values: LabelValues, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...], lock: threading.Lock):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = lock
+
+    def _key(self, labels: Dict[str, Any]) -> LabelValues:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"指标 {self.name} 需要标签 {self.labelnames}，实际为 {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+
+class Counter(_Metric):
+    """单调递增计数器"""
+
+    kind = "counter"
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def samples(self) -> List[Tuple[LabelValues, float]]:
+        with self._lock:
+            return sorted(self._values.items())
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        return [{"labels": dict(zip(self.labelnames, key)), "value": value} for key, value in self.samples()]
+
+    def prometheus(self) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+                for key, value in self.samples()]
+
+
+class Histogram(_Metric):
+    """固定分桶直方图"""
+
+    kind = "histogram"
+
+    def __init__(self, *args, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(*args)
+        self.buckets = tuple(sorted(buckets))
+        # 每个标签组合: [各分桶计数（非累积，最后一个为+Inf）, 总和, 总数]
+        self._series: Dict[LabelValues, list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][bisect.bisect_left(self.buckets, value)] += 1
+            series[1] += value
+            series[2] += 1
+
+    def _series_copy(self) -> List[Tuple[LabelValues, List[int], float, int]]:
+        with self._lock:
+            return [(key, list(counts), total, count) for key, (counts, total, count) in sorted(self._series.items())]
+
+    def _quantile(self, counts: List[int], count: int, q: float) -> float:
+        """按分桶线性插值估算分位数，落在+Inf桶时返回最大有限边界"""
+        rank = q * count
+        cumulative = 0
+        for i, bucket_count in enumerate(counts):
+            if cumulative + bucket_count >= rank and bucket_count:
+                if i == len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[i - 1] if i else 0.0
+                return lower + (self.buckets[i] - lower) * (rank - cumulative) / bucket_count
+            cumulative += bucket_count
+        return 0.0
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        return [{
+            "labels": dict(zip(self.labelnames, key)),
+            "count": count,
+            "sum": round(total, 6),
+            "avg": round(total / count, 6) if count else 0.0,
+            "p50": round(self._quantile(counts, count, 0.5), 6),
+            "p95": round(self._quantile(counts, count, 0.95), 6),
+            "p99": round(self._quantile(counts, count, 0.99), 6),
+        } for key, counts, total, count in self._series_copy()]
+
+    def prometheus(self) -> List[str]:
+        lines = []
+        for key, counts, total, count in self._series_copy():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else _format_value(bound)
+                labels = _format_labels(self.labelnames, key, 'le="' + le + '"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """进程级指标注册表"""
+
+    def __init__(self, namespace: str = "astroinsight"):
+        self.namespace = namespace
+        self._lock = threading.Lock()
+        self._metrics: Dict[str, _Metric] = {}
+
+    def _register(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"指标已注册: {metric.name}")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+        """注册计数器，名称自动加命名空间前缀"""
+        return self._register(Counter(f"{self.namespace}_{name}", documentation, labelnames, self._lock))
+
+    def histogram(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        """注册直方图，名称自动加命名空间前缀"""
+        return self._register(Histogram(f"{self.namespace}_{name}", documentation, labelnames, self._lock,
+                                        buckets=buckets))
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        获取全部指标的当前值
+
+        Returns:
+            Dict[str, Any]: 指标名到各标签组合取值的映射，直方图附带按分桶估算的p50/p95/p99
+        """
+        return {
+            name: {"type": metric.kind, "help": metric.documentation, "series": metric.snapshot()}
+            for name, metric in self._metrics.items()
+        }
+
+    def prometheus(self) -> str:
+        """导出为Prometheus文本格式(0.0.4)"""
+        lines = []
+        for name, metric in self._metrics.items():
+            lines.append(f"# HELP {name} {metric.documentation}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            lines.extend(metric.prometheus())
+        return "\n".join(lines) + "\n"
+
+
+metrics_registry = MetricsRegistry()
+
+STAGE_SECONDS = metrics_registry.histogram("stage_duration_seconds", "流程各阶段耗时（秒）", ("stage",))
+TASK_SECONDS = metrics_registry.histogram("task_duration_seconds", "完整流程耗时（秒）", ("status",))
+QUEUE_WAIT_SECONDS = metrics_registry.histogram("task_queue_wait_seconds", "任务在执行队列中的等待时间（秒）")
+LLM_REQUESTS = metrics_registry.counter("llm_requests_total", "LLM请求次数", ("provider", "model", "status"))
+LLM_SECONDS = metrics_registry.histogram("llm_request_duration_seconds", "LLM请求耗时（秒，不含缓存命中）",
+                                         ("provider", "model"))
+LLM_FIRST_CONTENT_SECONDS = metrics_registry.histogram("llm_first_content_seconds",
+                                                       "流式请求从发出到收到首个内容的时间（秒）", ("provider", "model"))
+LLM_TOKENS = metrics_registry.counter("llm_tokens_total", "LLM消耗的token数量", ("provider", "model", "kind"))
+LLM_COST = metrics_registry.counter("llm_cost_total", "按LLM_PRICES估算的调用费用", ("provider", "model"))
+ARXIV_FETCHES = metrics_registry.counter("arxiv_fetches_total", "ArXiv分页请求次数", ("status",))
+ARXIV_SECONDS = metrics_registry.histogram("arxiv_fetch_duration_seconds", "ArXiv分页请求耗时（秒，含解析）")
+ARXIV_ENTRIES = metrics_registry.counter("arxiv_entries_total", "ArXiv分页请求返回的论文数")
+
+
+def llm_cost(model: str, prompt_tokens: int, completion_tokens: int) -> Optional[float]:
+    """
+    按配置的单价估算一次调用的费用
+
+    Args:
+        model: 模型名称
+        prompt_tokens: 输入token数
+        completion_tokens: 输出token数
+
+    Returns:
+        Optional[float]: 费用（元），未配置单价的模型返回None
+    """
+    prices = settings.LLM_PRICES.get(model)
+    if not prices:
+        return None
+    return (prompt_tokens * prices["input"] + completion_tokens * prices["output"]) / 1_000_000
+
+
+class TaskMetrics:
+    """单个任务的指标：阶段耗时、排队时间、模型调用与ArXiv请求"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.perf_counter()
+        self.queue_wait: Optional[float] = None
+        self.stages: Dict[str, float] = {}
+        self.llm: Dict[str, Dict[str, Any]] = {}
+        self.arxiv = {"fetches": 0, "errors": 0, "entries": 0, "seconds": 0.0}
+
+    def record_stage(self, stage: str, seconds: float):
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def record_llm(self, provider: str, model: str, status: str, seconds: float,
+                   prompt_tokens: int = 0, completion_tokens: int = 0, cost: Optional[float] = None):
+        with self._lock:
+            entry = self.llm.setdefault(f"{provider}/{model}", {
+                "calls": 0, "cached": 0, "errors": 0, "cancelled": 0, "seconds": 0.0,
+                "prompt_tokens": 0, "completion_tokens": 0, "cost": 0.0,
+            })
+            if status == "ok":
+                entry["calls"] += 1
+            elif status in ("cached", "cancelled"):
+                entry[status] += 1
+            else:
+                entry["errors"] += 1
+            entry["seconds"] += seconds
+            entry["prompt_tokens"] += prompt_tokens
+            entry["completion_tokens"] += completion_tokens
+            entry["cost"] += cost or 0.0
+
+    def record_arxiv(self, seconds: float, entries: int, ok: bool):
+        with self._lock:
+            self.arxiv["fetches"] += 1
+            self.arxiv["errors"] += int(not ok)
+            self.arxiv["entries"] += entries
+            self.arxiv["seconds"] += seconds
+
+    def summary(self) -> Dict[str, Any]:
+        """
+        汇总任务指标
+
+        Returns:
+            Dict[str, Any]: 各阶段耗时、排队时间、模型调用统计（总计与按模型）、ArXiv请求统计，耗时单位为毫秒
+        """
+        with self._lock:
+            by_model = {
+                name: {**{key: value for key, value in entry.items() if key not in ("seconds", "cost")},
+                       "latency_ms": round(entry["seconds"] * 1000, 1),
+                       "cost": round(entry["cost"], 6)}
+                for name, entry in self.llm.items()
+            }
+            totals = {key: sum(entry[key] for entry in self.llm.values())
+                      for key in ("calls", "cached", "errors", "cancelled", "prompt_tokens", "completion_tokens")}
+            return {
+                "elapsed_ms": round((time.perf_counter() - self.started) * 1000, 1),
+                "queue_wait_ms": None if self.queue_wait is None else round(self.queue_wait * 1000, 1),
+                "stages_ms": {stage: round(seconds * 1000, 1) for stage, seconds in self.stages.items()},
+                "llm": {
+                    **totals,
+                    "latency_ms": round(sum(entry["seconds"] for entry in self.llm.values()) * 1000, 1),
+                    "cost": round(sum(entry["cost"] for entry in self.llm.values()), 6),
+                    "by_model": by_model,
+                },
+                "arxiv": {
+                    "fetches": self.arxiv["fetches"],
+                    "errors": self.arxiv["errors"],
+                    "entries": self.arxiv["entries"],
+                    "fetch_ms": round(self.arxiv["seconds"] * 1000, 1),
+                },
+            }
+
+
+_current: ContextVar[Optional[TaskMetrics]] = ContextVar("astroinsight_task_metrics", default=None)
+
+
+def current_task_metrics() -> Optional[TaskMetrics]:
+    """获取当前上下文中的任务指标收集器，不在任务中时返回None"""
+    return _current.get()
+
+
+@contextmanager
+def task_metrics() -> Iterator[TaskMetrics]:
+    """
+    在当前上下文中启用任务指标收集，已有收集器时直接复用（嵌套调用记到同一任务上）
+
+    Yields:
+        TaskMetrics: 任务指标收集器
+    """
+    collector = _current.get()
+    if collector is not None:
+        yield collector
+        return
+    collector = TaskMetrics()
+    # 工作线程在多个任务间复用同一上下文，退出时必须恢复
+    token = _current.set(collector)
+    try:
+        yield collector
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def stage_timer(stage: str) -> Iterator[None]:
+    """记录一个流程阶段的耗时"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.observe(elapsed, stage=stage)
+        collector = _current.get()
+        if collector is not None:
+            collector.record_stage(stage, elapsed)
+
+
+def record_queue_wait(seconds: float):
+    """记录任务排队时间（在任务开始执行时、任务上下文中调用）"""
+    QUEUE_WAIT_SECONDS.observe(seconds)
+    collector = _current.get()
+    if collector is not None:
+        collector.queue_wait = seconds
+
+
+def record_task(status: str, seconds: float):
+    """记录一次完整流程的耗时"""
+    TASK_SECONDS.observe(seconds, status=status)
+
+
+def record_llm_call(provider: str, model: str, status: str, seconds: float = 0.0, usage: Any = None):
+    """
+    记录一次模型调用
+
+    Args:
+        provider: 服务提供方（MoA模型为配置名）
+        model: 模型名称
+        status: ok / cached / error / cancelled / rate_limited（429后经限流器重试）
+        seconds: 请求耗时，缓存命中时为0
+        usage: 响应中的usage对象（含prompt_tokens、completion_tokens）
+    """
+    prompt_tokens = int(getattr(usage, "prompt_tokens", 0) or 0)
+    completion_tokens = int(getattr(usage, "completion_tokens", 0) or 0)
+    cost = llm_cost(model, prompt_tokens, completion_tokens) if usage is not None else None
+
+    LLM_REQUESTS.inc(provider=provider, model=model, status=status)
+    if status == "ok":
+        LLM_SECONDS.observe(seconds, provider=provider, model=model)
+    if prompt_tokens:
+        LLM_TOKENS.inc(prompt_tokens, provider=provider, model=model, kind="prompt")
+    if completion_tokens:
+        LLM_TOKENS.inc(completion_tokens, provider=provider, model=model, kind="completion")
+    if cost:
+        LLM_COST.inc(cost, provider=provider, model=model)
+
+    collector = _current.get()
+    if collector is not None:
+        collector.record_llm(provider, model, status, seconds, prompt_tokens, completion_tokens, cost)
+
+
+def record_llm_first_content(provider: str, model: str, seconds: float):
+    """记录流式请求从发出到收到首个内容的时间"""
+    LLM_FIRST_CONTENT_SECONDS.observe(seconds, provider=provider, model=model)
+
+
+def record_arxiv_fetch(seconds: float, entries: int = 0, ok: bool = True):
+    """记录一次ArXiv分页请求"""
+    ARXIV_FETCHES.inc(status="ok" if ok else "error")
+    ARXIV_SECONDS.observe(seconds)
+    if entries:
+        ARXIV_ENTRIES.inc(entries)
+    collector = _current.get()
+    if collector is not None:
+        collector.record_arxiv(seconds, entries, ok)
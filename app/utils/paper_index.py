@@ -0,0 +1,364 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time : 2025/8/29 09:30
+# @Author : 桐
+# @QQ:1041264242
+# 注意事项：已落盘的索引段通过mmap只读访问，新增论文先进入内存增量索引，达到阈值后合并写回
+import os
+import re
+import json
+import math
+import mmap
+import atexit
+import heapq
+import struct
+import logging
+import threading
+from collections import defaultdict
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from app.core.config import settings
+from app.utils.arxiv_cache import get_arxiv_cache
+
+logger = logging.getLogger(__name__)
+
+# 索引文件格式: MAGIC | 头部长度(uint64) | 头部JSON | 倒排表(每条记录为 uint32文档序号 + float32加权词频)
+INDEX_MAGIC = b"PIDX0001"
+HEADER_LEN = struct.Struct("<Q")
+POSTING = struct.Struct("<If")
+
+# 各字段的词频权重
+FIELD_WEIGHTS = {
+    "title": 3.0,
+    "abstract": 1.0,
+    "authors": 1.5,
+    "category": 1.0,
+}
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "in", "is", "it", "of", "on",
+    "or", "that", "the", "this", "to", "we", "with", "our", "which", "these", "its", "can",
+}
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    分词：转小写后按字母数字切分，去除停用词
+
+    Args:
+        text: 输入文本
+
+    Returns:
+        List[str]: 词项列表
+    """
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOPWORDS]
+
+
+# ArXiv检索语法：字段前缀、布尔运算符与括号
+ARXIV_FIELD_PREFIX = re.compile(r"\b(?:ti|au|abs|co|jr|cat|rn|id|all):", re.IGNORECASE)
+ARXIV_OPERATORS = {"AND", "OR", "ANDNOT"}
+QUERY_TOKEN = re.compile(r"[()]|[^\s()]+")
+
+
+def parse_query(query: str) -> Tuple[List[str], List[Tuple[str, ...]], bool]:
+    """
+    将ArXiv检索语句转换为本地索引检索词：去除字段前缀(ti:、abs:、cat:等)，布尔运算符不作为检索词，
+    ANDNOT之后的子句（直到下一个运算符或所在括号结束）中的每个词作为一组排除词，如"hep-th"为("hep", "th")
+
+    Args:
+        query: 检索语句，如"ti:dark AND abs:matter ANDNOT cat:hep-th"，普通关键词原样分词
+
+    Returns:
+        Tuple[List[str], List[Tuple[str, ...]], bool]: (检索词, 排除词组, 排除子句之外是否含OR运算符)
+    """
+    terms, excluded = [], []
+    has_or = False
+    negated = [False]
+    pending_not = False
+    for token in QUERY_TOKEN.findall(ARXIV_FIELD_PREFIX.sub(" ", query)):
+        if token == "(":
+            negated.append(negated[-1] or pending_not)
+            pending_not = False
+        elif token == ")":
+            if len(negated) > 1:
+                negated.pop()
+        elif token in ARXIV_OPERATORS:
+            pending_not = token == "ANDNOT"
+            has_or = has_or or (token == "OR" and not negated[-1])
+        elif negated[-1] or pending_not:
+            group = tuple(tokenize(token))
+            if group:
+                excluded.append(group)
+        else:
+            terms.extend(tokenize(token))
+    return list(dict.fromkeys(terms)), list(dict.fromkeys(excluded)), has_or
+
+
+def paper_term_weights(paper: Dict[str, Any]) -> Dict[str, float]:
+    """
+    计算论文各词项的字段加权词频
+
+    Args:
+        paper: 论文信息字典
+
+    Returns:
+        Dict[str, float]: 词项到加权词频的映射
+    """
+    weights: Dict[str, float] = defaultdict(float)
+    for field, weight in FIELD_WEIGHTS.items():
+        value = paper.get(field) or ""
+        if isinstance(value, list):
+            value = " ".join(str(item) for item in value)
+        for token in tokenize(str(value)):
+            weights[token] += weight
+    return weights
+
+
+class PaperIndex:
+    """论文元数据BM25全文检索索引"""
+
+    def __init__(self, index_path: str, flush_threshold: int = 200):
+        self.index_path = index_path
+        self.flush_threshold = flush_threshold
+        self._lock = threading.RLock()
+
+        # 已落盘段
+        self._mmap: Optional[mmap.mmap] = None
+        self._file = None
+        self._postings_offset = 0
+        self._segment_terms: Dict[str, Tuple[int, int]] = {}
+
+        # 全部文档（落盘段 + 增量）
+        self._doc_ids: List[str] = []
+        self._doc_lens: List[float] = []
+        self._doc_index: Dict[str, int] = {}
+        self._total_len = 0.0
+
+        # 增量倒排表
+        self._delta_terms: Dict[str, List[Tuple[int, float]]] = defaultdict(list)
+        self._delta_docs = 0
+
+        # 各文档的BM25长度归一化因子，文档集合变化后重新计算
+        self._norms: Optional[List[float]] = None
+
+        self._load()
+
+    def _load(self):
+        """映射已落盘的索引段"""
+        if not os.path.exists(self.index_path):
+            return
+        try:
+            self._file = open(self.index_path, "rb")
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            if self._mmap[:len(INDEX_MAGIC)] != INDEX_MAGIC:
+                raise ValueError("索引文件格式不匹配")
+            start = len(INDEX_MAGIC)
+            (header_len,) = HEADER_LEN.unpack_from(self._mmap, start)
+            start += HEADER_LEN.size
+            # 头部（词项位置表与文档列表）整体读入内存，只有倒排表按需从mmap读取
+            header = json.loads(self._mmap[start:start + header_len].decode("utf-8"))
+            self._postings_offset = start + header_len
+
+            self._segment_terms = {term: tuple(loc) for term, loc in header["terms"].items()}
+            self._doc_ids = header["doc_ids"]
+            self._doc_lens = header["doc_lens"]
+            self._doc_index = {doc_id: i for i, doc_id in enumerate(self._doc_ids)}
+            self._total_len = sum(self._doc_lens)
+            self._norms = None
+            logger.info(f"已加载论文索引: {len(self._doc_ids)} 篇论文, {len(self._segment_terms)} 个词项")
+        except Exception as e:
+            logger.error(f"加载论文索引失败，将重新建立: {e}")
+            self._close_segment()
+            self._segment_terms = {}
+            self._doc_ids, self._doc_lens, self._doc_index = [], [], {}
+            self._total_len = 0.0
+
+    def _close_segment(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __len__(self):
+        return len(self._doc_ids)
+
+    def add_papers(self, papers: Iterable[Dict[str, Any]]) -> int:
+        """
+        增量添加论文，已收录的论文会被跳过
+
+        Args:
+            papers: 论文信息字典（需包含id字段）
+
+        Returns:
+            int: 新增论文数量
+        """
+        added = 0
+        with self._lock:
+            for paper in papers:
+                doc_id = paper.get("id")
+                if not doc_id or doc_id in self._doc_index:
+                    continue
+                doc_idx = len(self._doc_ids)
+                weights = paper_term_weights(paper)
+                doc_len = sum(weights.values())
+                self._doc_ids.append(doc_id)
+                self._doc_lens.append(doc_len)
+                self._doc_index[doc_id] = doc_idx
+                self._total_len += doc_len
+                for term, weight in weights.items():
+                    self._delta_terms[term].append((doc_idx, weight))
+                self._delta_docs += 1
+                added += 1
+            if added:
+                self._norms = None
+
+            if self._delta_docs >= self.flush_threshold:
+                self.flush()
+        return added
+
+    def _segment_postings(self, term: str) -> Iterable[Tuple[int, float]]:
+        location = self._segment_terms.get(term)
+        if location is None or self._mmap is None:
+            return ()
+        offset, count = location
+        start = self._postings_offset + offset
+        return POSTING.iter_unpack(self._mmap[start:start + count * POSTING.size])
+
+    def _postings(self, term: str) -> List[Tuple[int, float]]:
+        postings = list(self._segment_postings(term))
+        postings.extend(self._delta_terms.get(term, ()))
+        return postings
+
+    def search(self, query: str, limit: int = 10, require_all_terms: bool = False) -> List[Tuple[str, float]]:
+        """
+        BM25检索，支持ArXiv检索语法（见parse_query）
+
+        Args:
+            query: 检索语句
+            limit: 返回结果数量
+            require_all_terms: 是否要求文档包含全部检索词，检索语句含OR运算符时不生效
+
+        Returns:
+            List[Tuple[str, float]]: 按得分降序排列的 (entry_id, 得分) 列表
+        """
+        terms, excluded, has_or = parse_query(query)
+        if not terms:
+            return []
+        require_all_terms = require_all_terms and not has_or
+        with self._lock:
+            doc_count = len(self._doc_ids)
+            if doc_count == 0:
+                return []
+            if self._norms is None:
+                avg_len = self._total_len / doc_count or 1.0
+                self._norms = [BM25_K1 * (1 - BM25_B + BM25_B * doc_len / avg_len) for doc_len in self._doc_lens]
+            norms = self._norms
+            scores: Dict[int, float] = defaultdict(float)
+            matched: Dict[int, int] = defaultdict(int)
+            for term in terms:
+                postings = self._postings(term)
+                if not postings:
+                    continue
+                df = len(postings)
+                idf = math.log(1 + (doc_count - df + 0.5) / (df + 0.5))
+                boost = idf * (BM25_K1 + 1)
+                for doc_idx, tf in postings:
+                    scores[doc_idx] += boost * tf / (tf + norms[doc_idx])
+                    matched[doc_idx] += 1
+
+            if require_all_terms:
+                scores = {doc_idx: score for doc_idx, score in scores.items() if matched[doc_idx] == len(terms)}
+            # 排除同时包含一组排除词的文档
+            for group in excluded:
+                docs = set.intersection(*({doc_idx for doc_idx, _ in self._postings(term)} for term in group))
+                for doc_idx in docs:
+                    scores.pop(doc_idx, None)
+            top = heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
+            return [(self._doc_ids[doc_idx], score) for doc_idx, score in top]
+
+    def flush(self):
+        """将增量索引与已落盘段合并后原子写回磁盘，并重新映射"""
+        with self._lock:
+            if self._delta_docs == 0:
+                return
+            terms = sorted(set(self._segment_terms) | set(self._delta_terms))
+            header_terms = {}
+            tmp_path = f"{self.index_path}.tmp"
+            Path(self.index_path).parent.mkdir(parents=True, exist_ok=True)
+
+            with open(tmp_path + ".postings", "wb") as postings_file:
+                offset = 0
+                for term in terms:
+                    postings = self._postings(term)
+                    postings_file.write(b"".join(POSTING.pack(doc_idx, tf) for doc_idx, tf in postings))
+                    header_terms[term] = [offset, len(postings)]
+                    offset += len(postings) * POSTING.size
+
+            header = json.dumps({
+                "doc_ids": self._doc_ids,
+                "doc_lens": self._doc_lens,
+                "terms": header_terms,
+            }, ensure_ascii=False).encode("utf-8")
+            with open(tmp_path, "wb") as index_file, open(tmp_path + ".postings", "rb") as postings_file:
+                index_file.write(INDEX_MAGIC)
+                index_file.write(HEADER_LEN.pack(len(header)))
+                index_file.write(header)
+                while True:
+                    chunk = postings_file.read(1 << 20)
+                    if not chunk:
+                        break
+                    index_file.write(chunk)
+                index_file.flush()
+                os.fsync(index_file.fileno())
+            os.remove(tmp_path + ".postings")
+
+            self._close_segment()
+            os.replace(tmp_path, self.index_path)
+            self._delta_terms = defaultdict(list)
+            self._delta_docs = 0
+            self._load()
+
+
+_paper_index: Optional[PaperIndex] = None
+_paper_index_lock = threading.Lock()
+
+
+def get_paper_index() -> PaperIndex:
+    """获取进程内共享的论文索引实例，进程退出时自动落盘"""
+    global _paper_index
+    if _paper_index is None:
+        with _paper_index_lock:
+            if _paper_index is None:
+                _paper_index = PaperIndex(
+                    index_path=settings.PAPER_INDEX_PATH,
+                    flush_threshold=settings.PAPER_INDEX_FLUSH_DOCS,
+                )
+                atexit.register(_paper_index.flush)
+    return _paper_index
+
+
+def search_local_papers(query: str, max_results: int = 10, require_all_terms: bool = False) -> List[Dict[str, Any]]:
+    """
+    在本地索引中检索论文，并从ArXiv缓存中读取论文记录
+
+    Args:
+        query: 检索语句
+        max_results: 最大结果数量
+        require_all_terms: 是否要求论文包含全部检索词
+
+    Returns:
+        List[Dict]: 论文信息列表
+    """
+    hits = get_paper_index().search(query, limit=max_results, require_all_terms=require_all_terms)
+    papers = get_arxiv_cache().get_papers([entry_id for entry_id, _ in hits])
+    for paper in papers:
+        paper["topic"] = query
+    return papers
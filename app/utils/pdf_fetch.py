@@ -0,0 +1,290 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time : 2025/9/10 14:15
+# @Author : 桐
+# @QQ:1041264242
+# 注意事项：PDF按内容sha256存放在 {PDF_CACHE_DIR}/objects 下，url->sha256 记录在索引库中；
+#          未完成的下载保留为 .part 文件，下次通过Range请求续传；文本提取在forkserver/spawn启动的独立进程中进行
+import os
+import mmap
+import time
+import hashlib
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+import requests
+
+from app.core.config import settings
+from app.utils.pdf_worker import extract_pdf_text
+from app.utils.tool import connect_sqlite
+
+logger = logging.getLogger(__name__)
+
+PDF_MAGIC = b"%PDF"
+CHUNK_SIZE = 1 << 16
+
+
+def sha256_file(path: str) -> str:
+    """通过内存映射计算文件的sha256"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return digest.hexdigest()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for start in range(0, len(mm), 1 << 20):
+                digest.update(mm[start:start + (1 << 20)])
+    return digest.hexdigest()
+
+
+class PDFStore:
+    """PDF下载、内容寻址缓存与文本提取"""
+
+    def __init__(self, root: str, download_workers: int = 4, extract_workers: int = 2,
+                 timeout: float = 60.0, max_bytes: int = 50 * 1024 * 1024, max_pages: int = 0):
+        """
+        Args:
+            root: 缓存根目录
+            download_workers: 并发下载数
+            extract_workers: 文本提取进程数
+            timeout: 单次HTTP请求超时（秒）
+            max_bytes: 单个PDF的大小上限
+            max_pages: 文本提取的页数上限，0表示全部
+        """
+        self.root = Path(root)
+        self.objects_dir = self.root / "objects"
+        self.partial_dir = self.root / "partial"
+        self.objects_dir.mkdir(parents=True, exist_ok=True)
+        self.partial_dir.mkdir(parents=True, exist_ok=True)
+        self.timeout = timeout
+        self.max_bytes = max_bytes
+        self.max_pages = max_pages
+
+        self._lock = threading.Lock()
+        self._conn = connect_sqlite(str(self.root / "index.sqlite3"))
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS pdfs (
+                url TEXT PRIMARY KEY,
+                sha256 TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.commit()
+
+        # 同一url同时只允许一个下载，其余调用等待该下载结果
+        self._inflight: Dict[str, Future] = {}
+        self._local = threading.local()
+        self._download_pool = ThreadPoolExecutor(max_workers=download_workers, thread_name_prefix="pdf-download")
+        self._extract_workers = extract_workers
+        self._extract_pool: Optional[ProcessPoolExecutor] = None
+
+    def object_path(self, sha256: str, suffix: str = ".pdf") -> Path:
+        return self.objects_dir / sha256[:2] / f"{sha256}{suffix}"
+
+    def _session(self) -> requests.Session:
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = requests.Session()
+            session.headers["User-Agent"] = "AstroInsight/1.0"
+            self._local.session = session
+        return session
+
+    def lookup(self, url: str) -> Optional[Path]:
+        """查询已缓存的PDF路径"""
+        with self._lock:
+            row = self._conn.execute("SELECT sha256 FROM pdfs WHERE url = ?", (url,)).fetchone()
+        if row is None:
+            return None
+        path = self.object_path(row[0])
+        return path if path.exists() else None
+
+    def _record(self, url: str, sha256: str, size: int):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO pdfs (url, sha256, size, created_at) VALUES (?, ?, ?, ?)",
+                (url, sha256, size, time.time()),
+            )
+            self._conn.commit()
+
+    def _download(self, url: str, max_retries: int = 3) -> Path:
+        """下载PDF，支持断点续传，完成后按内容摘要入库"""
+        cached = self.lookup(url)
+        if cached is not None:
+            return cached
+
+        part_path = self.partial_dir / f"{hashlib.sha256(url.encode('utf-8')).hexdigest()}.part"
+        last_error: Optional[Exception] = None
+        for attempt in range(max_retries):
+            offset = part_path.stat().st_size if part_path.exists() else 0
+            headers = {"Range": f"bytes={offset}-"} if offset else {}
+            try:
+                with self._session().get(url, headers=headers, stream=True, timeout=self.timeout) as response:
+                    if response.status_code == 416:
+                        # 已下载完整
+                        pass
+                    else:
+                        response.raise_for_status()
+                        # 服务器不支持Range时从头下载
+                        mode = "ab" if offset and response.status_code == 206 else "wb"
+                        with open(part_path, mode) as f:
+                            for chunk in response.iter_content(CHUNK_SIZE):
+                                f.write(chunk)
+                                if f.tell() > self.max_bytes:
+                                    raise ValueError(f"PDF超过大小上限 {self.max_bytes} 字节")
+                break
+            except ValueError:
+                part_path.unlink(missing_ok=True)
+                raise
+            except Exception as e:
+                last_error = e
+                logger.warning(f"下载PDF失败 {url} (尝试 {attempt + 1}/{max_retries}，已下载 "
+                               f"{part_path.stat().st_size if part_path.exists() else 0} 字节): {e}")
+        else:
+            raise RuntimeError(f"下载PDF失败: {url}") from last_error
+
+        with open(part_path, "rb") as f:
+            if f.read(len(PDF_MAGIC)) != PDF_MAGIC:
+                part_path.unlink(missing_ok=True)
+                raise ValueError(f"下载内容不是PDF: {url}")
+
+        sha256 = sha256_file(str(part_path))
+        size = part_path.stat().st_size
+        path = self.object_path(sha256)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if path.exists():
+            part_path.unlink()
+        else:
+            os.replace(part_path, path)
+        self._record(url, sha256, size)
+        logger.info(f"PDF已缓存: {url} -> {sha256[:12]} ({size} 字节)")
+        return path
+
+    def fetch(self, url: str) -> Future:
+        """
+        提交PDF下载（有界并发），同一url的并发请求共享同一次下载
+
+        Args:
+            url: PDF地址
+
+        Returns:
+            Future: 结果为本地PDF路径
+        """
+        with self._lock:
+            future = self._inflight.get(url)
+            if future is not None:
+                return future
+            future = self._download_pool.submit(self._download, url)
+            self._inflight[url] = future
+        future.add_done_callback(lambda _: self._forget(url))
+        return future
+
+    def _forget(self, url: str):
+        with self._lock:
+            self._inflight.pop(url, None)
+
+    def _get_extract_pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._extract_pool is None:
+                # 服务进程中有LLM事件循环、下载与任务线程，fork出的子进程可能继承被这些线程持有的锁而死锁，
+                # 因此用forkserver（不支持时用spawn）启动提取进程。入口模块会在子进程中以__mp_main__导入，
+                # 服务入口据此跳过初始化；forkserver预先导入入口与提取模块，之后的子进程直接从中fork
+                methods = multiprocessing.get_all_start_methods()
+                context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+                if context.get_start_method() == "forkserver":
+                    context.set_forkserver_preload(["__main__", "app.utils.pdf_worker"])
+                self._extract_pool = ProcessPoolExecutor(max_workers=self._extract_workers, mp_context=context)
+            return self._extract_pool
+
+    def _cached_text(self, pdf_path: Path) -> Optional[str]:
+        text_path = pdf_path.with_suffix(".txt")
+        if text_path.exists():
+            return text_path.read_text(encoding="utf-8")
+        return None
+
+    def _save_text(self, pdf_path: Path, text: str):
+        text_path = pdf_path.with_suffix(".txt")
+        tmp_path = text_path.with_suffix(f".txt.{threading.get_ident()}.tmp")
+        tmp_path.write_text(text, encoding="utf-8")
+        os.replace(tmp_path, text_path)
+
+    def extract(self, pdf_path: Path) -> Future:
+        """提交文本提取任务，已提取过的文件直接返回缓存文本"""
+        text = self._cached_text(pdf_path)
+        if text is not None:
+            future: Future = Future()
+            future.set_result(text)
+            return future
+        def save(done: Future):
+            if done.exception() is None:
+                self._save_text(pdf_path, done.result())
+
+        future = self._get_extract_pool().submit(extract_pdf_text, str(pdf_path), self.max_pages)
+        future.add_done_callback(save)
+        return future
+
+    def load_text(self, url: str, timeout: Optional[float] = None) -> str:
+        """
+        下载并提取单篇PDF的文本（阻塞）
+
+        Args:
+            url: PDF地址
+            timeout: 等待超时（秒）
+
+        Returns:
+            str: 全文文本
+        """
+        pdf_path = self.fetch(url).result(timeout)
+        return self.extract(pdf_path).result(timeout)
+
+    def shutdown(self):
+        """关闭下载线程池和提取进程池"""
+        self._download_pool.shutdown(wait=False, cancel_futures=True)
+        if self._extract_pool is not None:
+            self._extract_pool.shutdown(wait=False, cancel_futures=True)
+
+
+_pdf_store: Optional[PDFStore] = None
+_pdf_store_lock = threading.Lock()
+
+
+def get_pdf_store() -> PDFStore:
+    """获取进程内共享的PDF存储实例"""
+    global _pdf_store
+    if _pdf_store is None:
+        with _pdf_store_lock:
+            if _pdf_store is None:
+                _pdf_store = PDFStore(
+                    root=settings.PDF_CACHE_DIR,
+                    download_workers=settings.PDF_DOWNLOAD_CONCURRENCY,
+                    extract_workers=settings.PDF_EXTRACT_WORKERS,
+                    timeout=settings.PDF_DOWNLOAD_TIMEOUT,
+                    max_bytes=settings.PDF_MAX_BYTES,
+                    max_pages=settings.PDF_MAX_PAGES,
+                )
+    return _pdf_store
+
+
+def load_paper_full_text(paper: Dict[str, Any]) -> Optional[str]:
+    """
+    获取论文全文，可作为论文压缩阶段的全文加载函数
+
+    Args:
+        paper: 论文信息（需包含pdf字段）
+
+    Returns:
+        Optional[str]: 全文文本，无PDF地址或获取失败时返回None
+    """
+    url = paper.get("pdf")
+    if not url:
+        return None
+    try:
+        return get_pdf_store().load_text(url) or None
+    except Exception as e:
+        logger.warning(f"论文 {paper.get('id')} 全文获取失败: {e!r}")
+        return None
@@ -0,0 +1,33 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time : 2025/9/21 09:30
+# @Author : 桐
+# @QQ:1041264242
+# 注意事项：本模块在PDF文本提取子进程中导入，只能依赖标准库与pypdf，不能导入服务的其他模块
+import mmap
+
+
+def extract_pdf_text(path: str, max_pages: int = 0) -> str:
+    """
+    提取PDF文本（在子进程中执行）
+
+    Args:
+        path: PDF文件路径
+        max_pages: 最多提取的页数，0表示全部
+
+    Returns:
+        str: 提取出的文本
+    """
+    from pypdf import PdfReader
+
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        reader = PdfReader(mm)
+        pages = reader.pages if not max_pages else reader.pages[:max_pages]
+        texts = []
+        for page in pages:
+            try:
+                texts.append(page.extract_text() or "")
+            except Exception:
+                # 单页解析失败不影响其他页
+                continue
+        return "\n".join(texts)
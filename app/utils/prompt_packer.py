@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time : 2025/9/5 15:40
+# @Author : 桐
+# @QQ:1041264242
+# 注意事项：论文按传入顺序视为相关度排名，超出预算时先截断排名靠后的摘要，仍超出时再整篇舍弃
+import logging
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# 无法加载tiktoken编码时的兜底编码
+FALLBACK_ENCODING = "cl100k_base"
+
+# 截断后的摘要结尾标记
+TRUNCATION_MARK = " ..."
+
+
+@lru_cache(maxsize=None)
+def _load_encoding(encoding_name: str):
+    try:
+        import tiktoken
+        return tiktoken.get_encoding(encoding_name)
+    except Exception as e:
+        logger.warning(f"加载编码 {encoding_name} 失败，token数量将按字符数估算: {e}")
+        return None
+
+
+@lru_cache(maxsize=None)
+def get_encoder(model_name: str):
+    """
+    获取模型对应的tiktoken编码器，结果按模型名缓存，未知模型使用cl100k_base
+
+    Args:
+        model_name: 模型名称
+
+    Returns:
+        tiktoken.Encoding: 编码器，tiktoken不可用或编码文件无法加载时返回None（改用字符数估算）
+    """
+    try:
+        import tiktoken
+    except ImportError:
+        logger.warning("未安装tiktoken，token数量将按字符数估算")
+        return None
+    try:
+        encoding_name = tiktoken.encoding_name_for_model(model_name)
+    except KeyError:
+        encoding_name = FALLBACK_ENCODING
+    return _load_encoding(encoding_name) or (None if encoding_name == FALLBACK_ENCODING
+                                             else _load_encoding(FALLBACK_ENCODING))
+
+
+def estimate_tokens(text: str) -> int:
+    """按字符估算token数量：ASCII字符约4个一个token，其他字符（如中文）每字一个token"""
+    ascii_chars = sum(1 for char in text if ord(char) < 128)
+    return (ascii_chars + 3) // 4 + len(text) - ascii_chars
+
+
+def count_tokens_batch(texts: List[str], model_name: str) -> List[int]:
+    """
+    批量计算文本的token数量
+
+    Args:
+        texts: 文本列表
+        model_name: 模型名称
+
+    Returns:
+        List[int]: 各文本的token数量
+    """
+    encoder = get_encoder(model_name)
+    if encoder is None:
+        return [estimate_tokens(text) for text in texts]
+    return [len(tokens) for tokens in encoder.encode_batch(texts, disallowed_special=())]
+
+
+def count_tokens(text: str, model_name: str) -> int:
+    """计算单段文本的token数量"""
+    return count_tokens_batch([text], model_name)[0]
+
+
+def truncate_to_tokens(text: str, max_tokens: int, model_name: str) -> str:
+    """
+    将文本截断到指定token数量以内
+
+    Args:
+        text: 原始文本
+        max_tokens: 最大token数量
+        model_name: 模型名称
+
+    Returns:
+        str: 截断后的文本，发生截断时末尾带有截断标记
+    """
+    if max_tokens <= 0:
+        return ""
+    encoder = get_encoder(model_name)
+    if encoder is None:
+        total = estimate_tokens(text)
+        if total <= max_tokens:
+            return text
+        keep = max(max_tokens - estimate_tokens(TRUNCATION_MARK), 1)
+        return text[:max(len(text) * keep // total, 1)].rstrip() + TRUNCATION_MARK
+    tokens = encoder.encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+    # 预留截断标记占用的token
+    return encoder.decode(tokens[:max(max_tokens - 1, 1)]).rstrip() + TRUNCATION_MARK
+
+
+def context_window(model_name: str) -> int:
+    """获取模型的上下文窗口大小（token）"""
+    return settings.LLM_CONTEXT_WINDOWS.get(model_name, settings.LLM_DEFAULT_CONTEXT_WINDOW)
+
+
+def papers_budget(model_name: str, reserved_tokens: int = 0) -> int:
+    """
+    计算论文部分可用的token预算：上下文窗口扣除输出预留和其他部分占用，且不超过论文部分上限
+
+    Args:
+        model_name: 模型名称
+        reserved_tokens: 提示词其他部分（系统提示、指令等）已占用的token数量
+
+    Returns:
+        int: 论文部分的token预算
+    """
+    available = context_window(model_name) - settings.PROMPT_OUTPUT_RESERVE - reserved_tokens
+    return max(min(available, settings.PROMPT_PAPERS_MAX_TOKENS), 0)
+
+
+def format_paper_header(index: int, paper: Dict[str, Any]) -> str:
+    """格式化论文标题、作者和发布日期"""
+    authors = paper.get("authors", [])
+    if isinstance(authors, list):
+        authors = ", ".join(str(author) for author in authors)
+    published = str(paper.get("published") or paper.get("time") or "")[:10]
+    return (
+        f"\n\n=== 论文 {index} ===\n"
+        f"标题: {paper.get('title', '')}\n"
+        f"作者: {authors}\n"
+        f"发布日期: {published}\n"
+        f"摘要: "
+    )
+
+
+def paper_body(paper: Dict[str, Any]) -> str:
+    """论文正文部分：摘要，若有全文压缩结果则附在摘要之后"""
+    body = str(paper.get("abstract") or paper.get("summary") or "")
+    if paper.get("compressed"):
+        body = f"{body}\n全文要点:\n{paper['compressed']}"
+    return body
+
+
+def paper_tokens(papers: List[Dict[str, Any]], model_name: str) -> List[int]:
+    """批量计算每篇论文（标题、作者、日期和摘要）的token数量"""
+    texts = [format_paper_header(i, paper) + paper_body(paper) for i, paper in enumerate(papers, 1)]
+    return count_tokens_batch(texts, model_name) if texts else []
+
+
+def pack_papers(papers: List[Dict[str, Any]], model_name: str, budget: Optional[int] = None,
+                reserved_tokens: int = 0, start_index: int = 1) -> Tuple[str, Dict[str, Any]]:
+    """
+    将论文按排名装入token预算
+
+    Args:
+        papers: 按相关度排序的论文列表
+        model_name: 目标模型名称
+        budget: 论文部分的token预算，为空时按模型上下文窗口计算
+        reserved_tokens: 提示词其他部分已占用的token数量（仅在budget为空时使用）
+        start_index: 第一篇论文的编号
+
+    Returns:
+        Tuple[str, Dict[str, Any]]: (论文文本, 装箱统计)
+    """
+    if budget is None:
+        budget = papers_budget(model_name, reserved_tokens)
+
+    headers = [format_paper_header(i, paper) for i, paper in enumerate(papers, start_index)]
+    abstracts = [paper_body(paper) for paper in papers]
+    header_tokens = count_tokens_batch(headers, model_name) if headers else []
+    abstract_tokens = count_tokens_batch(abstracts, model_name) if abstracts else []
+    abstract_limits = list(abstract_tokens)
+
+    included = len(papers)
+    total = sum(header_tokens) + sum(abstract_tokens)
+
+    # 先从排名最靠后的论文开始截断摘要
+    min_abstract = settings.PROMPT_MIN_ABSTRACT_TOKENS
+    for i in reversed(range(included)):
+        if total <= budget:
+            break
+        target = max(min_abstract, abstract_limits[i] - (total - budget))
+        if target < abstract_limits[i]:
+            total -= abstract_limits[i] - target
+            abstract_limits[i] = target
+
+    # 仍然超出预算时舍弃排名靠后的论文
+    while included and total > budget:
+        included -= 1
+        total -= header_tokens[included] + abstract_limits[included]
+
+    parts = []
+    per_paper = []
+    truncated = 0
+    for i in range(included):
+        abstract = abstracts[i]
+        if abstract_limits[i] < abstract_tokens[i]:
+            abstract = truncate_to_tokens(abstract, abstract_limits[i], model_name)
+            truncated += 1
+        parts.append(headers[i])
+        parts.append(abstract)
+        parts.append("\n")
+        per_paper.append(header_tokens[i] + abstract_limits[i])
+
+    stats = {
+        "model": model_name,
+        "budget": budget,
+        "papers_tokens": sum(per_paper),
+        "papers_tokens_unpacked": sum(header_tokens) + sum(abstract_tokens),
+        "per_paper_tokens": per_paper,
+        "papers_included": included,
+        "papers_truncated": truncated,
+        "papers_dropped": len(papers) - included,
+    }
+    if truncated or included < len(papers):
+        logger.info(f"论文超出token预算({budget})，截断 {truncated} 篇摘要，舍弃 {len(papers) - included} 篇论文")
+    return "".join(parts), stats
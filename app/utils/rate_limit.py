@@ -0,0 +1,427 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time : 2025/9/18 10:40
+# @Author : 桐
+# @QQ:1041264242
+# 注意事项：限流器只在LLM后台事件循环中使用（asyncio原语与该循环绑定），stats()可从任意线程读取
+import time
+import asyncio
+import logging
+import threading
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from email.utils import parsedate_to_datetime
+from typing import Any, Deque, Dict, Optional, Tuple
+
+from app.core.config import settings
+from app.utils.metrics import metrics_registry
+from app.utils.prompt_packer import count_tokens
+
+logger = logging.getLogger(__name__)
+
+RATE_WAIT_SECONDS = metrics_registry.histogram("llm_rate_wait_seconds", "LLM请求在限流器中的排队时间",
+                                               ("provider",))
+RATE_LIMITED = metrics_registry.counter("llm_rate_limited_total", "服务提供方返回429的次数", ("provider",))
+
+# 公平排队的分组键（通常为任务ID），未设置时归入同一组
+_fair_key: ContextVar[Optional[str]] = ContextVar("llm_fair_key", default=None)
+# 当前请求所属的限流器，供HTTP响应钩子把429反馈给对应的服务提供方
+_active_limiter: ContextVar[Optional["ProviderLimiter"]] = ContextVar("llm_active_limiter", default=None)
+
+
+@contextmanager
+def fair_share(key: Optional[str]):
+    """
+    在上下文内发起的LLM请求按key分组公平排队：各组轮流获得请求许可，单个任务的大量并发请求不会饿死其他任务
+
+    Args:
+        key: 分组键，通常为任务ID
+    """
+    token = _fair_key.set(key)
+    try:
+        yield
+    finally:
+        _fair_key.reset(token)
+
+
+def parse_retry_after(headers) -> Optional[float]:
+    """
+    解析限流响应头中的重试等待时间
+
+    Args:
+        headers: HTTP响应头
+
+    Returns:
+        Optional[float]: 等待秒数，响应头缺失或无法解析时返回None
+    """
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return max(float(value) / 1000.0, 0.0)
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+def is_rate_limited(error: BaseException) -> bool:
+    """判断异常是否为服务提供方的429限流响应"""
+    return getattr(error, "status_code", None) == 429
+
+
+class TokenBucket:
+    """令牌桶：按rate每秒补充，最多积累capacity；允许透支，透支部分由后续补充偿还"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def set_rate(self, rate: float, now: float):
+        self._refill(now)
+        self.rate = rate
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """取出amount需要等待的秒数，amount超过容量时按容量计算，避免大请求永远无法获得许可"""
+        self._refill(now)
+        missing = min(amount, self.capacity) - self.tokens
+        return missing / self.rate if missing > 0 else 0.0
+
+    def take(self, amount: float, now: float):
+        self._refill(now)
+        self.tokens -= amount
+
+    def give(self, amount: float, now: float):
+        self._refill(now)
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class Permit:
+    """一次请求许可，请求完成后通过complete()记录实际token用量以修正令牌桶"""
+
+    __slots__ = ("tokens", "usage_tokens", "completion_tokens")
+
+    def __init__(self, tokens: int):
+        self.tokens = tokens
+        self.usage_tokens: Optional[int] = None
+        self.completion_tokens: Optional[int] = None
+
+    def complete(self, usage: Any = None):
+        """
+        标记请求成功
+
+        Args:
+            usage: 响应中的usage对象，缺失时按预估token数计
+        """
+        total = getattr(usage, "total_tokens", None)
+        self.usage_tokens = int(total) if total is not None else self.tokens
+        completion = getattr(usage, "completion_tokens", None)
+        self.completion_tokens = int(completion) if completion is not None else None
+
+
+class ProviderLimiter:
+    """
+    单个服务提供方的限流器：每分钟请求数与token数两个令牌桶，加并发上限
+
+    等待中的请求按公平分组键分队，各队轮流获得许可。收到429时暂停到Retry-After之后，
+    并把速率与并发上限按乘性系数下调（冷却期内只下调一次）；冷却期过后随成功请求按时间线性恢复，
+    接近上次触发429的速率时放慢恢复，使持续吞吐稳定在限额之下而不是反复触发限流
+    """
+
+    def __init__(self, name: str, rpm: float = 0, tpm: float = 0, max_in_flight: int = 0,
+                 burst_seconds: float = 1.0, decrease: float = 0.8, increase: float = 0.05,
+                 min_scale: float = 0.1, cooldown: float = 5.0, default_backoff: float = 1.0):
+        """
+        Args:
+            name: 服务提供方名称
+            rpm: 每分钟请求数上限，0表示不限制
+            tpm: 每分钟token数上限（输入+输出），0表示不限制
+            max_in_flight: 并发请求上限，0表示不限制
+            burst_seconds: 令牌桶容量对应的秒数，决定允许的突发量
+            decrease: 收到429时速率的乘性下调系数
+            increase: 冷却期后每秒的加性恢复量（相对配置速率的比例），与请求量无关
+            min_scale: 速率下调的下限（相对配置速率的比例）
+            cooldown: 下调后的冷却时间（秒），期间的429不再重复下调
+            default_backoff: 429响应未带Retry-After时的暂停时间（秒）
+        """
+        self.name = name
+        self.rpm = rpm
+        self.tpm = tpm
+        self.max_in_flight = max_in_flight
+        self.decrease = decrease
+        self.increase = increase
+        self.min_scale = min_scale
+        self.cooldown = cooldown
+        self.default_backoff = default_backoff
+        now = time.monotonic()
+        self._requests = TokenBucket(rpm / 60.0, max(rpm / 60.0 * burst_seconds, 1.0)) if rpm else None
+        self._tokens = TokenBucket(tpm / 60.0, max(tpm / 60.0 * burst_seconds, 1.0)) if tpm else None
+        self.scale = 1.0
+        self._ceiling = 1.0
+        self._cooldown_until = now
+        self._recovered_at = now
+        self.blocked_until = now
+        self.in_flight = 0
+        # 按输出token数的滑动平均预估新请求的输出长度
+        self.expected_completion = 512.0
+        self._queues: Dict[Optional[str], Deque[Tuple[asyncio.Future, int]]] = {}
+        self._rotation: Deque[Optional[str]] = deque()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._timer_at = 0.0
+        self.rate_limited = 0
+
+    @property
+    def in_flight_limit(self) -> int:
+        if not self.max_in_flight:
+            return 0
+        return max(1, int(self.max_in_flight * self.scale))
+
+    def _wait_time(self, tokens: int, now: float) -> float:
+        wait = self.blocked_until - now
+        if self._requests is not None:
+            wait = max(wait, self._requests.wait_time(1, now))
+        if self._tokens is not None:
+            wait = max(wait, self._tokens.wait_time(tokens, now))
+        return wait
+
+    def _schedule(self, delay: float):
+        loop = asyncio.get_running_loop()
+        at = loop.time() + delay
+        if self._timer is not None and not self._timer.cancelled() and self._timer_at <= at:
+            return
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer_at = at
+        self._timer = loop.call_at(at, self._on_timer)
+
+    def _on_timer(self):
+        self._timer = None
+        self._dispatch()
+
+    def _dispatch(self):
+        """按分组轮流为排队请求发放许可，直到并发或令牌不足"""
+        now = time.monotonic()
+        while self._rotation:
+            limit = self.in_flight_limit
+            if limit and self.in_flight >= limit:
+                return
+            key = self._rotation[0]
+            queue = self._queues[key]
+            while queue and queue[0][0].done():
+                queue.popleft()
+            if not queue:
+                self._rotation.popleft()
+                del self._queues[key]
+                continue
+            future, tokens = queue[0]
+            wait = self._wait_time(tokens, now)
+            if wait > 0:
+                self._schedule(wait)
+                return
+            if self._requests is not None:
+                self._requests.take(1, now)
+            if self._tokens is not None:
+                self._tokens.take(tokens, now)
+            self.in_flight += 1
+            queue.popleft()
+            future.set_result(None)
+            self._rotation.rotate(-1)
+
+    def estimate_tokens(self, prompt_tokens: int) -> int:
+        """预估一次请求消耗的token数（输入+预估输出）"""
+        return int(prompt_tokens + self.expected_completion)
+
+    async def acquire(self, tokens: int) -> Permit:
+        """
+        等待请求许可
+
+        Args:
+            tokens: 预估token数
+
+        Returns:
+            Permit: 请求许可，使用完毕后必须调用release()
+        """
+        key = _fair_key.get()
+        future = asyncio.get_running_loop().create_future()
+        if key not in self._queues:
+            self._queues[key] = deque()
+            self._rotation.append(key)
+        self._queues[key].append((future, tokens))
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            # 许可已发放但调用方同时被取消时归还并发名额
+            if future.done() and not future.cancelled():
+                self.in_flight -= 1
+                self._dispatch()
+            raise
+        return Permit(tokens)
+
+    def release(self, permit: Permit):
+        """归还并发名额；请求成功时按实际用量修正token令牌桶，并恢复被下调的速率"""
+        self.in_flight -= 1
+        now = time.monotonic()
+        if permit.usage_tokens is not None:
+            if self._tokens is not None:
+                difference = permit.usage_tokens - permit.tokens
+                if difference > 0:
+                    self._tokens.take(difference, now)
+                else:
+                    self._tokens.give(-difference, now)
+            if permit.completion_tokens is not None:
+                self.expected_completion = 0.8 * self.expected_completion + 0.2 * permit.completion_tokens
+            self._recover(now)
+        self._dispatch()
+
+    def _apply_scale(self, now: float):
+        if self._requests is not None:
+            self._requests.set_rate(self.rpm / 60.0 * self.scale, now)
+        if self._tokens is not None:
+            self._tokens.set_rate(self.tpm / 60.0 * self.scale, now)
+
+    def _recover(self, now: float):
+        if self.scale >= 1.0 or now < self._cooldown_until:
+            return
+        elapsed = now - max(self._recovered_at, self._cooldown_until)
+        self._recovered_at = now
+        # 接近上次触发429的速率时放慢恢复，减少反复触发
+        rate = self.increase if self.scale < 0.9 * self._ceiling else self.increase / 4
+        self.scale = min(1.0, self.scale + rate * elapsed)
+        self._apply_scale(now)
+
+    def on_rate_limited(self, retry_after: Optional[float]):
+        """
+        记录一次429响应：暂停发放许可直到Retry-After之后，冷却期外时下调速率
+
+        Args:
+            retry_after: 服务提供方建议的等待秒数
+        """
+        now = time.monotonic()
+        delay = retry_after if retry_after is not None else self.default_backoff
+        self.blocked_until = max(self.blocked_until, now + delay)
+        self.rate_limited += 1
+        RATE_LIMITED.inc(provider=self.name)
+        if now >= self._cooldown_until:
+            self._ceiling = self.scale
+            self.scale = max(self.min_scale, self.scale * self.decrease)
+            self._cooldown_until = now + max(delay, self.cooldown)
+            self._apply_scale(now)
+            logger.warning(f"{self.name} 返回429，暂停 {delay:.2f} 秒，速率下调至配置的 {self.scale:.0%}")
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        return {
+            "rpm": round(self.rpm * self.scale, 1) if self.rpm else None,
+            "tpm": round(self.tpm * self.scale) if self.tpm else None,
+            "scale": round(self.scale, 3),
+            "in_flight": self.in_flight,
+            "in_flight_limit": self.in_flight_limit or None,
+            "queued": sum(len(queue) for queue in list(self._queues.values())),
+            "blocked_for": round(max(self.blocked_until - now, 0.0), 3),
+            "rate_limited": self.rate_limited,
+        }
+
+
+class RateGovernor:
+    """进程内所有LLM请求共用的限流器集合，按服务提供方（deepseek/qwen或MoA的config_name）各一个"""
+
+    def __init__(self, limits: Dict[str, Dict[str, float]], enabled: bool = True, **options):
+        """
+        Args:
+            limits: 各服务提供方的限额，default项为未单独配置的提供方的默认值
+            enabled: 是否启用限流
+            **options: 传给ProviderLimiter的其他参数
+        """
+        self.limits = limits
+        self.enabled = enabled
+        self.options = options
+        self._limiters: Dict[str, ProviderLimiter] = {}
+
+    def limiter(self, provider: str) -> ProviderLimiter:
+        limiter = self._limiters.get(provider)
+        if limiter is None:
+            config = {**self.limits.get("default", {}), **self.limits.get(provider, {})}
+            limiter = ProviderLimiter(provider, **config, **self.options)
+            self._limiters[provider] = limiter
+        return limiter
+
+    @asynccontextmanager
+    async def slot(self, provider: str, model: str = "", prompt: str = ""):
+        """
+        获取请求许可，上下文退出时归还
+
+        Args:
+            provider: 服务提供方
+            model: 模型名称，用于计算输入token数
+            prompt: 输入文本，仅在该提供方配置了token限额时计数
+
+        Yields:
+            Optional[Permit]: 请求许可，限流未启用时为None
+        """
+        if not self.enabled:
+            yield None
+            return
+        limiter = self.limiter(provider)
+        prompt_tokens = count_tokens(prompt, model) if limiter.tpm and prompt else 0
+        started = time.perf_counter()
+        permit = await limiter.acquire(limiter.estimate_tokens(prompt_tokens))
+        RATE_WAIT_SECONDS.observe(time.perf_counter() - started, provider=provider)
+        token = _active_limiter.set(limiter)
+        try:
+            yield permit
+        finally:
+            _active_limiter.reset(token)
+            limiter.release(permit)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "providers": {name: limiter.stats() for name, limiter in list(self._limiters.items())},
+        }
+
+
+async def observe_response(response):
+    """httpx响应钩子：把429（含SDK内部重试时收到的）反馈给当前请求所属的限流器"""
+    if response.status_code != 429:
+        return
+    limiter = _active_limiter.get()
+    if limiter is not None:
+        limiter.on_rate_limited(parse_retry_after(response.headers))
+
+
+_governor: Optional[RateGovernor] = None
+_governor_lock = threading.Lock()
+
+
+def get_rate_governor() -> RateGovernor:
+    """获取进程内共享的LLM限流器"""
+    global _governor
+    if _governor is None:
+        with _governor_lock:
+            if _governor is None:
+                _governor = RateGovernor(
+                    settings.LLM_RATE_LIMITS,
+                    enabled=settings.LLM_RATE_LIMIT_ENABLED,
+                    burst_seconds=settings.LLM_RATE_BURST_SECONDS,
+                    decrease=settings.LLM_RATE_DECREASE,
+                    increase=settings.LLM_RATE_INCREASE,
+                    min_scale=settings.LLM_RATE_MIN_SCALE,
+                    cooldown=settings.LLM_RATE_COOLDOWN,
+                )
+    return _governor
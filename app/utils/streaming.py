@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time : 2025/9/20 10:15
+# @Author : 桐
+# @QQ:1041264242
+# 注意事项：增量文本在LLM后台事件循环线程中收集，部分结果回调在独立线程中执行；写入按时间节流，流结束时总会写入一次
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from app.core.config import settings
+from app.utils.prompt_packer import count_tokens
+
+logger = logging.getLogger(__name__)
+
+PartialCallback = Callable[[Dict[str, Any]], None]
+
+# 当前阶段名与部分结果回调，由流程在每个阶段外层设置
+_partial_target: ContextVar[Optional[Tuple[str, PartialCallback]]] = ContextVar("llm_partial_target", default=None)
+
+
+@contextmanager
+def stream_partials(stage: str, callback: Optional[PartialCallback]):
+    """
+    在上下文内以流式请求的模型回复，增量写入callback
+
+    Args:
+        stage: 流程阶段名
+        callback: 部分结果回调，参数为 {stage, text, tokens, done, elapsed}，为空时不流式请求
+    """
+    token = _partial_target.set((stage, callback) if callback is not None else None)
+    try:
+        yield
+    finally:
+        _partial_target.reset(token)
+
+
+# 部分结果回调在独立线程中执行：回调会写任务存储（加锁、落盘），不能阻塞LLM后台事件循环
+_dispatcher: Optional[ThreadPoolExecutor] = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_partial_dispatcher() -> ThreadPoolExecutor:
+    """获取执行部分结果回调的单线程执行器（单线程保证同一写入器的结果按顺序写入）"""
+    global _dispatcher
+    if _dispatcher is None:
+        with _dispatcher_lock:
+            if _dispatcher is None:
+                _dispatcher = ThreadPoolExecutor(max_workers=1, thread_name_prefix="llm-partial")
+    return _dispatcher
+
+
+class PartialWriter:
+    """把一次流式回复的增量文本按时间节流写入部分结果回调"""
+
+    def __init__(self, stage: str, callback: PartialCallback, interval: float = 0.5):
+        """
+        Args:
+            stage: 流程阶段名
+            callback: 部分结果回调
+            interval: 两次写入的最小间隔（秒）
+        """
+        self.stage = stage
+        self.callback = callback
+        self.interval = interval
+        self.model = ""
+        self._parts: List[str] = []
+        self._ascii_chars = 0
+        self._other_chars = 0
+        self._started = time.perf_counter()
+        self._emitted_at = 0.0
+        self._emitted = False
+        # 尚未交给回调的最新部分结果；回调线程积压时只保留最新一份
+        self._pending: Optional[Dict[str, Any]] = None
+        self._pending_lock = threading.Lock()
+
+    def begin(self, model: str):
+        """开始一次请求；失败后切换模型重试时，之前写入的部分结果被清空"""
+        self.model = model
+        self._parts = []
+        self._ascii_chars = 0
+        self._other_chars = 0
+        if self._emitted:
+            self._emit(done=False)
+
+    @property
+    def receiving(self) -> bool:
+        """当前请求是否已收到内容"""
+        return bool(self._parts)
+
+    def append(self, delta: str):
+        self._parts.append(delta)
+        # 生成过程中的token数按字符增量估算，避免每次写入都对全文重新分词
+        ascii_chars = sum(1 for char in delta if ord(char) < 128)
+        self._ascii_chars += ascii_chars
+        self._other_chars += len(delta) - ascii_chars
+        now = time.perf_counter()
+        if now - self._emitted_at >= self.interval:
+            self._emit(done=False, now=now)
+
+    def end(self, usage: Any = None):
+        """流结束，写入完整文本；usage中有输出token数时以其为准，否则在回调线程中对全文计数"""
+        completion = getattr(usage, "completion_tokens", None)
+        self._emit(done=True, tokens=int(completion) if completion is not None else None)
+
+    def _emit(self, done: bool, now: Optional[float] = None, tokens: Optional[int] = None):
+        self._emitted_at = now or time.perf_counter()
+        self._emitted = True
+        if tokens is None and not done:
+            tokens = (self._ascii_chars + 3) // 4 + self._other_chars
+        payload = {
+            "stage": self.stage,
+            "text": "".join(self._parts),
+            "tokens": tokens,
+            "done": done,
+            "elapsed": round(self._emitted_at - self._started, 3),
+        }
+        with self._pending_lock:
+            scheduled = self._pending is not None
+            self._pending = payload
+        if not scheduled:
+            get_partial_dispatcher().submit(self._deliver)
+
+    def _deliver(self):
+        """在回调线程中写入最新的部分结果"""
+        with self._pending_lock:
+            payload, self._pending = self._pending, None
+        if payload is None:
+            return
+        try:
+            if payload["tokens"] is None:
+                payload["tokens"] = count_tokens(payload["text"], self.model) if payload["text"] else 0
+            self.callback(payload)
+        except Exception as e:
+            logger.warning(f"阶段 {self.stage} 部分结果写入失败: {e}")
+
+
+def partial_writer() -> Optional[PartialWriter]:
+    """
+    获取当前阶段的部分结果写入器
+
+    Returns:
+        Optional[PartialWriter]: 未启用流式或当前上下文没有部分结果回调时返回None
+    """
+    target = _partial_target.get()
+    if target is None or not settings.LLM_STREAM_ENABLED:
+        return None
+    stage, callback = target
+    return PartialWriter(stage, callback, interval=settings.LLM_STREAM_PARTIAL_INTERVAL)
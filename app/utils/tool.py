@@ -8,6 +8,7 @@ import os
 import re
 import json
 import logging
+import sqlite3
 from typing import Dict, Any, List
 from pathlib import Path
 
@@ -62,6 +63,22 @@ def load_from_file(file_path: str) -> Any:
         logger.error(f"加载文件失败: {e}")
         return None
 
+def connect_sqlite(db_path: str) -> sqlite3.Connection:
+    """
+    打开SQLite数据库连接（WAL模式）
+    
+    Args:
+        db_path: 数据库文件路径
+        
+    Returns:
+        sqlite3.Connection: 可跨线程使用的连接，调用方需自行加锁
+    """
+    Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
 def format_paper_info(paper: Dict[str, Any]) -> str:
     """
     格式化论文信息
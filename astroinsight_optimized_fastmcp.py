@@ -25,50 +25,37 @@ logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
     handlers=[
         logging.FileHandler('astroinsight_fastmcp.log', encoding='utf-8'),
-        logging.StreamHandler(sys.stdout)
+        # stdio传输下stdout专用于MCP协议消息，日志输出到stderr
+        logging.StreamHandler(sys.stderr)
     ]
 )
 logger = logging.getLogger(__name__)
 
 # FastMCP导入
 try:
-    from mcp.server.fastmcp import FastMCP
+    from mcp.server.fastmcp import FastMCP, Context
     from mcp.types import TextContent
 except ImportError as e:
     logger.error(f"FastMCP导入失败: {e}")
     sys.exit(1)
 
-# 任务状态存储
-tasks_storage: Dict[str, Dict[str, Any]] = {}
-tasks_lock = threading.Lock()
+from app.core.config import settings
+from app.task.coalesce import SingleFlight, LEADER, FOLLOWER, COMPLETED, research_task_key
+from app.task.executor import TaskExecutor, QueueFullError
+from app.task.checkpoint import get_checkpoint_store
+from app.task.store import SimpleTask, TERMINAL_STATUSES, create_task_store
+from app.utils.metrics import metrics_registry
 
-class SimpleTask:
-    """简单任务类，用于存储任务信息"""
-    
-    def __init__(self, task_id: str, keyword: str, search_paper_num: int):
-        self.task_id = task_id
-        self.keyword = keyword
-        self.search_paper_num = search_paper_num
-        self.status = "PENDING"
-        self.progress = 0
-        self.created_at = datetime.now()
-        self.updated_at = datetime.now()
-        self.result = None
-        self.error = None
+# multiprocessing以forkserver/spawn启动子进程（PDF文本提取进程）时会以__mp_main__重新导入本模块，
+# 子进程中不创建任务存储和执行器，避免重复恢复中断任务、启动工作线程
+SERVICE_PROCESS = __name__ != "__mp_main__"
 
-    def to_dict(self) -> Dict[str, Any]:
-        """转换为字典格式"""
-        return {
-            "task_id": self.task_id,
-            "keyword": self.keyword,
-            "search_paper_num": self.search_paper_num,
-            "status": self.status,
-            "progress": self.progress,
-            "created_at": self.created_at.isoformat(),
-            "updated_at": self.updated_at.isoformat(),
-            "result": self.result,
-            "error": self.error
-        }
+if SERVICE_PROCESS:
+    # 任务状态存储
+    task_store = create_task_store()
+    
+    # 相同请求合并：重复提交的任务镜像正在执行的任务
+    task_coalescer = SingleFlight(completed_window=settings.TASK_COALESCE_WINDOW)
 
 def generate_task_id() -> str:
     """生成唯一任务ID"""
@@ -80,25 +67,92 @@ def ensure_temp_directory():
     temp_dir.mkdir(exist_ok=True)
     return temp_dir
 
-def update_task_status(task_id: str, status: str, progress: int = None, result: Any = None, error: str = None):
-    """更新任务状态"""
-    with tasks_lock:
-        if task_id in tasks_storage:
-            task = tasks_storage[task_id]
-            task.status = status
-            task.updated_at = datetime.now()
-            
-            if progress is not None:
-                task.progress = progress
-            if result is not None:
-                task.result = result
-            if error is not None:
-                task.error = error
-                
-            logger.info(f"任务 {task_id} 状态更新: {status}, 进度: {task.progress}%")
+def update_task_status(task_id: str, status: str, progress: int = None, result: Any = None, error: str = None,
+                       stage: str = None):
+    """更新任务状态，并推送给正在等待该任务的客户端"""
+    task = task_store.update(task_id, status=status, progress=progress, result=result, error=error, stage=stage)
+    if task is not None:
+        logger.info(f"任务 {task_id} 状态更新: {status}, 阶段: {task.stage}, 进度: {task.progress}%")
+    
+    # 同步给合并到该任务的重复请求
+    with task_coalescer.lock:
+        for follower_id in task_coalescer.followers(task_id):
+            task_store.update(follower_id, status=status, progress=progress, result=result, error=error, stage=stage)
+        if status in TERMINAL_STATUSES:
+            task_coalescer.finish(task_id, success=status == "COMPLETED")
+
+def update_task_partial(task_id: str, partial: Dict[str, Any]):
+    """更新任务当前阶段流式生成中的部分结果，同步给合并到该任务的重复请求"""
+    task_store.set_partial(task_id, partial)
+    with task_coalescer.lock:
+        for follower_id in task_coalescer.followers(task_id):
+            task_store.set_partial(follower_id, partial)
+
+def mirror_task(task_id: str, source_id: str) -> bool:
+    """将已有任务的当前状态和结果复制到新任务"""
+    source = task_store.get(source_id)
+    if source is None:
+        return False
+    task_store.update(task_id, status=source.status, progress=source.progress, result=source.result,
+                      error=source.error, stage=source.stage)
+    return True
+
+def task_not_found(task_id: str) -> str:
+    """任务不存在时各工具统一返回的结果"""
+    return json.dumps({
+        "error": "任务不存在",
+        "task_id": task_id,
+        "status": "not_found"
+    }, ensure_ascii=False)
+
+def watch_task(task_id: str, ctx: Optional[Context]):
+    """
+    将任务的状态和阶段变化以MCP日志通知(notifications/message)推送给提交任务的会话，任务结束后自动注销
+    MCP进度通知(notifications/progress)必须携带请求的progressToken，提交任务的请求返回后该令牌即失效，
+    因此任务执行期间改用不依赖请求的日志通知；进度通知只在wait_for_task等待期间发送
+    
+    Args:
+        task_id: 任务ID
+        ctx: 提交任务的请求上下文，为空或不在事件循环中调用时不推送
+    """
+    if ctx is None:
+        return
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return
+    session = ctx.session
+    last_event = {}
+    
+    async def send(info: Dict[str, Any]):
+        try:
+            await session.send_log_message(level="info", data=info, logger="astroinsight.tasks")
+        except Exception as e:
+            # 会话已断开时不再推送
+            logger.info(f"任务 {task_id} 阶段通知发送失败，停止推送: {e}")
+            task_store.remove_listener(task_id, listener)
+    
+    def listener(info: Dict[str, Any]):
+        # 只推送状态或阶段的变化，流式部分结果等其他更新不推送
+        event = (info["status"], info["stage"])
+        if last_event.get("event") == event:
+            return
+        last_event["event"] = event
+        if info["status"] in TERMINAL_STATUSES:
+            task_store.remove_listener(task_id, listener)
+        try:
+            asyncio.run_coroutine_threadsafe(send(info), loop)
+        except RuntimeError:
+            # 事件循环已关闭
+            task_store.remove_listener(task_id, listener)
+    
+    task_store.add_listener(task_id, listener)
+    task = task_store.get(task_id)
+    if task is None or task.status in TERMINAL_STATUSES:
+        task_store.remove_listener(task_id, listener)
 
-def run_paper_generation_task(task_id: str, keyword: str, search_paper_num: int):
-    """运行论文生成任务"""
+def run_paper_generation_task(task_id: str, keyword: str, search_paper_num: int, start_stage: str = None):
+    """运行论文生成任务，每个阶段完成后保存检查点，start_stage指定从哪个阶段重新执行"""
     try:
         logger.info(f"开始执行任务 {task_id}: {keyword}")
         update_task_status(task_id, "RUNNING", 10)
@@ -109,7 +163,20 @@ def run_paper_generation_task(task_id: str, keyword: str, search_paper_num: int)
             
             # 执行主要流程
             update_task_status(task_id, "RUNNING", 20)
-            result = generate_research_paper_main(keyword, search_paper_num)
+            result = generate_research_paper_main(
+                keyword,
+                search_paper_num,
+                progress_callback=lambda stage, progress: update_task_status(task_id, "RUNNING", progress, stage=stage),
+                task_id=task_id,
+                start_stage=start_stage,
+                partial_callback=lambda partial: update_task_partial(task_id, partial)
+            )
+            
+            # 流程内部出错时返回status=error，按失败处理，避免进入请求合并的结果复用窗口
+            if result.get("status") == "error":
+                update_task_status(task_id, "FAILED", result=result, error=result.get("error"))
+                logger.error(f"任务 {task_id} 执行失败: {result.get('error')}")
+                return
             
             # 任务完成
             update_task_status(task_id, "COMPLETED", 100, result)
@@ -134,20 +201,66 @@ def run_paper_generation_task(task_id: str, keyword: str, search_paper_num: int)
         logger.error(f"任务 {task_id} 执行失败: {e}")
         update_task_status(task_id, "FAILED", error=str(e))
 
+def run_batch_generation_task(task_id: str, keywords: List[str], search_paper_num: int):
+    """运行批量论文生成任务，各关键词的进度与部分结果写入任务的subtasks字段"""
+    try:
+        logger.info(f"开始执行批量任务 {task_id}: {keywords}")
+        update_task_status(task_id, "RUNNING", 5)
+        
+        from main import generate_research_papers_batch_main
+        
+        result = generate_research_papers_batch_main(
+            keywords,
+            search_paper_num,
+            progress_callback=lambda stage, progress: update_task_status(task_id, "RUNNING", progress, stage=stage),
+            keyword_callback=lambda keyword, fields: task_store.update_subtask(task_id, keyword, fields)
+        )
+        
+        if result.get("status") == "error":
+            update_task_status(task_id, "FAILED", result=result, error=result.get("error"))
+            logger.error(f"批量任务 {task_id} 执行失败: {result.get('error')}")
+            return
+        
+        update_task_status(task_id, "COMPLETED", 100, result)
+        logger.info(f"批量任务 {task_id} 执行完成")
+        
+    except Exception as e:
+        logger.error(f"批量任务 {task_id} 执行失败: {e}")
+        update_task_status(task_id, "FAILED", error=str(e))
+
+def batch_keywords(task: SimpleTask) -> Optional[List[str]]:
+    """批量任务的关键词列表，普通任务返回None"""
+    return task.keywords
+
+def shed_task(task_id: str):
+    """排队任务被更高优先级任务挤出时标记为已拒绝"""
+    update_task_status(task_id, "REJECTED", error="服务繁忙，任务被更高优先级任务挤出队列，请稍后重试")
+
+# 任务执行器：固定工作线程数，有界优先级队列
+if SERVICE_PROCESS:
+    task_executor = TaskExecutor(
+        max_workers=settings.TASK_WORKERS,
+        max_queue_size=settings.TASK_QUEUE_SIZE,
+        estimated_duration=settings.TASK_ESTIMATED_DURATION,
+        on_shed=shed_task,
+    )
+
 # 创建FastMCP应用
 mcp = FastMCP("AstroInsight Research Assistant")
 
 @mcp.tool()
-def generate_research_paper(keyword: str, search_paper_num: int = 10) -> str:
+def generate_research_paper(keyword: str, search_paper_num: int = 10, priority: int = 0,
+                            ctx: Context = None) -> str:
     """
     启动研究论文生成任务
     
     Args:
         keyword: 研究关键词
-        search_paper_num: 搜索论文数量 (1-20)
+        search_paper_num: 搜索论文数量 (1-100，超过20篇时分块并发提取事实)
+        priority: 任务优先级，数值越小越先执行
     
     Returns:
-        任务ID和状态信息
+        任务ID和状态信息；任务执行期间的状态与阶段变化以MCP日志通知推送给当前会话
     """
     try:
         # 参数验证
@@ -157,8 +270,8 @@ def generate_research_paper(keyword: str, search_paper_num: int = 10) -> str:
                 "status": "error"
             }, ensure_ascii=False)
         
-        if not (1 <= search_paper_num <= 20):
-            search_paper_num = min(max(search_paper_num, 1), 20)
+        if not (1 <= search_paper_num <= settings.TASK_MAX_SEARCH_PAPERS):
+            search_paper_num = min(max(search_paper_num, 1), settings.TASK_MAX_SEARCH_PAPERS)
         
         # 生成任务ID
         task_id = generate_task_id()
@@ -166,25 +279,69 @@ def generate_research_paper(keyword: str, search_paper_num: int = 10) -> str:
         # 创建任务
         task = SimpleTask(task_id, keyword.strip(), search_paper_num)
         
-        with tasks_lock:
-            tasks_storage[task_id] = task
+        task_store.add(task)
         
-        # 启动后台任务
-        thread = threading.Thread(
-            target=run_paper_generation_task,
-            args=(task_id, keyword.strip(), search_paper_num),
-            daemon=True
-        )
-        thread.start()
+        # 相同关键词和论文数量的任务已在执行或刚完成时，直接复用其执行过程和结果
+        if settings.TASK_COALESCE_ENABLED:
+            key = research_task_key(keyword, search_paper_num)
+            with task_coalescer.lock:
+                role, leader_id = task_coalescer.join(key, task_id)
+                if role == COMPLETED and task_store.get(leader_id) is None:
+                    # 可复用的任务记录已被清理，按新任务执行
+                    task_coalescer.forget(leader_id)
+                    role, leader_id = task_coalescer.join(key, task_id)
+                coalesced = role != LEADER and mirror_task(task_id, leader_id)
+            if coalesced:
+                task = task_store.get(task_id)
+                logger.info(f"任务 {task_id} 已合并到任务 {leader_id}，关键词: {keyword}")
+                response = {
+                    "task_id": task_id,
+                    "keyword": keyword.strip(),
+                    "search_paper_num": search_paper_num,
+                    "status": task.status,
+                    "progress": task.progress,
+                    "message": "相同任务正在执行，已合并到该任务" if role == FOLLOWER else "相同任务刚刚完成，直接复用其结果",
+                    "coalesced_with": leader_id,
+                    "created_at": task.created_at.isoformat()
+                }
+                if task.status == "PENDING":
+                    response["queue_position"] = task_executor.queue_position(leader_id)
+                    response["eta_seconds"] = task_executor.estimate_wait(leader_id)
+                watch_task(task_id, ctx)
+                return json.dumps(response, ensure_ascii=False)
         
-        logger.info(f"任务 {task_id} 已启动，关键词: {keyword}")
+        # 提交到任务执行器，队列已满时拒绝
+        try:
+            queue_position = task_executor.submit(
+                task_id,
+                run_paper_generation_task,
+                task_id,
+                keyword.strip(),
+                search_paper_num,
+                priority=priority
+            )
+        except QueueFullError as e:
+            # 期间合并进来的重复请求一并拒绝
+            update_task_status(task_id, "REJECTED", error=f"服务繁忙，请稍后重试: {str(e)}")
+            task_store.delete(task_id)
+            logger.warning(f"任务队列已满，拒绝任务: {keyword}")
+            return json.dumps({
+                "error": f"服务繁忙，请稍后重试: {str(e)}",
+                "status": "rejected",
+                "executor": task_executor.stats()
+            }, ensure_ascii=False)
+        
+        logger.info(f"任务 {task_id} 已提交，关键词: {keyword}, 排队位置: {queue_position}")
+        watch_task(task_id, ctx)
         
         return json.dumps({
             "task_id": task_id,
             "keyword": keyword.strip(),
             "search_paper_num": search_paper_num,
             "status": "PENDING",
-            "message": "任务已创建并开始执行",
+            "message": "任务已创建并进入执行队列",
+            "queue_position": queue_position,
+            "eta_seconds": task_executor.estimate_wait(task_id),
             "created_at": task.created_at.isoformat()
         }, ensure_ascii=False)
         
@@ -196,27 +353,199 @@ def generate_research_paper(keyword: str, search_paper_num: int = 10) -> str:
         }, ensure_ascii=False)
 
 @mcp.tool()
-def get_task_status(task_id: str) -> str:
+def generate_research_papers_batch(keywords: List[str], search_paper_num: int = 10, priority: int = 0,
+                                   ctx: Context = None) -> str:
+    """
+    启动批量研究论文生成任务：各关键词并发检索，论文跨关键词去重后只提取一次事实，
+    再按关键词分别生成假设并优化；各关键词的进度见任务状态的subtasks字段
+    
+    Args:
+        keywords: 研究关键词列表（重复的关键词只执行一次）
+        search_paper_num: 每个关键词的搜索论文数量 (1-100)
+        priority: 任务优先级，数值越小越先执行
+    
+    Returns:
+        批量任务ID和状态信息；任务执行期间的状态与阶段变化以MCP日志通知推送给当前会话
+    """
+    try:
+        # 参数验证：去除空白与重复关键词（忽略大小写），保持提交顺序
+        unique_keywords = {}
+        for keyword in keywords or []:
+            if isinstance(keyword, str) and keyword.strip():
+                unique_keywords.setdefault(research_task_key(keyword, 0)[0], keyword.strip())
+        keywords = list(unique_keywords.values())
+        if not keywords:
+            return json.dumps({
+                "error": "关键词列表不能为空",
+                "status": "error"
+            }, ensure_ascii=False)
+        if len(keywords) > settings.BATCH_MAX_KEYWORDS:
+            return json.dumps({
+                "error": f"关键词数量不能超过 {settings.BATCH_MAX_KEYWORDS} 个",
+                "status": "error"
+            }, ensure_ascii=False)
+        
+        search_paper_num = min(max(search_paper_num, 1), settings.TASK_MAX_SEARCH_PAPERS)
+        
+        task_id = generate_task_id()
+        task = SimpleTask(task_id, json.dumps(keywords, ensure_ascii=False), search_paper_num, keywords=keywords)
+        task.subtasks = {keyword: {"status": "PENDING", "stage": None, "progress": 0} for keyword in keywords}
+        task_store.add(task)
+        
+        # 批量任务不参与请求合并，直接提交执行
+        try:
+            queue_position = task_executor.submit(
+                task_id,
+                run_batch_generation_task,
+                task_id,
+                keywords,
+                search_paper_num,
+                priority=priority
+            )
+        except QueueFullError as e:
+            update_task_status(task_id, "REJECTED", error=f"服务繁忙，请稍后重试: {str(e)}")
+            task_store.delete(task_id)
+            logger.warning(f"任务队列已满，拒绝批量任务: {keywords}")
+            return json.dumps({
+                "error": f"服务繁忙，请稍后重试: {str(e)}",
+                "status": "rejected",
+                "executor": task_executor.stats()
+            }, ensure_ascii=False)
+        
+        logger.info(f"批量任务 {task_id} 已提交，关键词: {keywords}, 排队位置: {queue_position}")
+        watch_task(task_id, ctx)
+        
+        return json.dumps({
+            "task_id": task_id,
+            "keywords": keywords,
+            "search_paper_num": search_paper_num,
+            "status": "PENDING",
+            "message": "批量任务已创建并进入执行队列",
+            "queue_position": queue_position,
+            "eta_seconds": task_executor.estimate_wait(task_id),
+            "created_at": task.created_at.isoformat()
+        }, ensure_ascii=False)
+        
+    except Exception as e:
+        logger.error(f"创建批量任务失败: {e}")
+        return json.dumps({
+            "error": f"创建批量任务失败: {str(e)}",
+            "status": "error"
+        }, ensure_ascii=False)
+
+@mcp.tool()
+def resume_task(task_id: str, from_stage: Optional[str] = None, priority: int = 0, ctx: Context = None) -> str:
+    """
+    恢复或重新执行已结束的任务，已完成的阶段复用检查点，不重复调用LLM（批量任务整体重新执行）
+    
+    Args:
+        task_id: 任务ID
+        from_stage: 从该阶段开始重新执行(search/compression/facts/hypothesis/optimization)，为空时从第一个未完成的阶段继续
+        priority: 任务优先级，数值越小越先执行
+    
+    Returns:
+        任务ID、将复用的阶段和排队信息；任务执行期间的状态与阶段变化以MCP日志通知推送给当前会话
+    """
+    try:
+        from main import PIPELINE_STAGES
+        
+        if from_stage is not None and from_stage not in PIPELINE_STAGES:
+            return json.dumps({
+                "error": f"未知阶段: {from_stage}，可选阶段: {', '.join(PIPELINE_STAGES)}",
+                "task_id": task_id,
+                "status": "error"
+            }, ensure_ascii=False)
+        
+        task = task_store.get(task_id)
+        if task is None:
+            return task_not_found(task_id)
+        
+        keywords = batch_keywords(task)
+        if keywords is not None and from_stage is not None:
+            return json.dumps({
+                "error": "批量任务不支持指定起始阶段",
+                "task_id": task_id,
+                "status": "error"
+            }, ensure_ascii=False)
+        
+        # 任务重新执行后旧结果不再供重复请求复用
+        task_coalescer.forget(task_id)
+        task = task_store.reopen(task_id)
+        if task is None:
+            return json.dumps({
+                "error": "任务尚未结束，无法恢复",
+                "task_id": task_id,
+                "status": "error"
+            }, ensure_ascii=False)
+        
+        checkpointed = get_checkpoint_store().stages(task_id)
+        if from_stage is not None:
+            checkpointed = [stage for stage in checkpointed
+                            if PIPELINE_STAGES.index(stage) < PIPELINE_STAGES.index(from_stage)]
+        
+        # 恢复的任务不参与请求合并，直接提交执行
+        if keywords is not None:
+            runner = (run_batch_generation_task, task_id, keywords, task.search_paper_num)
+        else:
+            runner = (run_paper_generation_task, task_id, task.keyword, task.search_paper_num, from_stage)
+        try:
+            queue_position = task_executor.submit(task_id, *runner, priority=priority)
+        except QueueFullError as e:
+            update_task_status(task_id, "REJECTED", error=f"服务繁忙，请稍后重试: {str(e)}")
+            return json.dumps({
+                "error": f"服务繁忙，请稍后重试: {str(e)}",
+                "task_id": task_id,
+                "status": "rejected",
+                "executor": task_executor.stats()
+            }, ensure_ascii=False)
+        
+        logger.info(f"任务 {task_id} 已重新提交，起始阶段: {from_stage or '自动'}, 可复用检查点: {checkpointed}")
+        watch_task(task_id, ctx)
+        
+        return json.dumps({
+            "task_id": task_id,
+            "keyword": task.keyword,
+            "search_paper_num": task.search_paper_num,
+            "status": "PENDING",
+            "message": "任务已重新进入执行队列",
+            "from_stage": from_stage,
+            "checkpointed_stages": [stage for stage in PIPELINE_STAGES if stage in checkpointed],
+            "queue_position": queue_position,
+            "eta_seconds": task_executor.estimate_wait(task_id)
+        }, ensure_ascii=False)
+        
+    except Exception as e:
+        logger.error(f"恢复任务失败: {e}")
+        return json.dumps({
+            "error": f"恢复任务失败: {str(e)}",
+            "task_id": task_id,
+            "status": "error"
+        }, ensure_ascii=False)
+
+@mcp.tool()
+def get_task_status(task_id: str, fields: Optional[List[str]] = None, if_changed_since: Optional[int] = None) -> str:
     """
     获取任务状态
     
     Args:
         task_id: 任务ID
+        fields: 需要返回的字段，支持"result.optimization_info"形式的点分路径，为空时返回全部字段
+        if_changed_since: 客户端已有的任务版本号(version)，任务未变化时只返回not_modified
     
     Returns:
         任务状态信息
     """
     try:
-        with tasks_lock:
-            if task_id not in tasks_storage:
-                return json.dumps({
-                    "error": "任务不存在",
-                    "task_id": task_id,
-                    "status": "not_found"
-                }, ensure_ascii=False)
-            
-            task = tasks_storage[task_id]
-            return json.dumps(task.to_dict(), ensure_ascii=False)
+        task_info = task_store.snapshot(task_id, fields=fields, since_version=if_changed_since)
+        if task_info is None:
+            return task_not_found(task_id)
+        
+        # 排队中的任务附带排队位置和预计等待时间
+        if task_info.get("status") == "PENDING" and not task_info.get("not_modified"):
+            queued_id = task_coalescer.leader_of(task_id) or task_id
+            task_info["queue_position"] = task_executor.queue_position(queued_id)
+            task_info["eta_seconds"] = task_executor.estimate_wait(queued_id)
+        return json.dumps(task_info, ensure_ascii=False)
             
     except Exception as e:
         logger.error(f"获取任务状态失败: {e}")
@@ -226,6 +555,70 @@ def get_task_status(task_id: str) -> str:
             "status": "error"
         }, ensure_ascii=False)
 
+@mcp.tool()
+async def wait_for_task(task_id: str, timeout: float = 60, min_progress: Optional[int] = None,
+                        ctx: Context = None) -> str:
+    """
+    等待任务完成或达到指定进度（长轮询），等待期间通过MCP进度通知推送各阶段进度
+    进度通知与本次请求的progressToken绑定，只在等待期间发送；提交任务后的阶段变化以日志通知推送给提交任务的会话
+    
+    Args:
+        task_id: 任务ID
+        timeout: 最长等待时间（秒，最大300）
+        min_progress: 达到该进度即返回，为空时等待任务结束
+    
+    Returns:
+        任务状态信息，超时返回时附带timed_out=true
+    """
+    try:
+        timeout = min(max(timeout, 0), 300)
+        loop = asyncio.get_running_loop()
+        updates: asyncio.Queue = asyncio.Queue()
+        
+        def listener(info: Dict[str, Any]):
+            loop.call_soon_threadsafe(updates.put_nowait, info)
+        
+        def reached(info: Dict[str, Any]) -> bool:
+            if info["status"] in TERMINAL_STATUSES:
+                return True
+            return min_progress is not None and info["progress"] >= min_progress
+        
+        task_store.add_listener(task_id, listener)
+        try:
+            task = task_store.get(task_id)
+            if task is None:
+                return task_not_found(task_id)
+            
+            info = task.progress_info()
+            deadline = loop.time() + timeout
+            while not reached(info):
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    info = await asyncio.wait_for(updates.get(), remaining)
+                except asyncio.TimeoutError:
+                    break
+                if ctx is not None:
+                    await ctx.report_progress(info["progress"], 100)
+        finally:
+            task_store.remove_listener(task_id, listener)
+        
+        # 等待期间任务可能已被清理
+        task_info = task_store.snapshot(task_id)
+        if task_info is None:
+            return task_not_found(task_id)
+        task_info["timed_out"] = not reached(info)
+        return json.dumps(task_info, ensure_ascii=False)
+        
+    except Exception as e:
+        logger.error(f"等待任务失败: {e}")
+        return json.dumps({
+            "error": f"等待任务失败: {str(e)}",
+            "task_id": task_id,
+            "status": "error"
+        }, ensure_ascii=False)
+
 @mcp.tool()
 def list_active_tasks() -> str:
     """
@@ -235,24 +628,24 @@ def list_active_tasks() -> str:
         活跃任务列表
     """
     try:
-        with tasks_lock:
-            active_tasks = []
-            for task_id, task in tasks_storage.items():
-                task_info = {
-                    "task_id": task_id,
-                    "keyword": task.keyword,
-                    "status": task.status,
-                    "progress": task.progress,
-                    "created_at": task.created_at.isoformat(),
-                    "updated_at": task.updated_at.isoformat()
-                }
-                active_tasks.append(task_info)
-            
-            return json.dumps({
-                "active_tasks": active_tasks,
-                "total_count": len(active_tasks),
-                "timestamp": datetime.now().isoformat()
-            }, ensure_ascii=False)
+        active_tasks = []
+        for task in task_store.list_tasks():
+            task_info = {
+                "task_id": task.task_id,
+                "keyword": task.keyword,
+                "status": task.status,
+                "progress": task.progress,
+                "created_at": task.created_at.isoformat(),
+                "updated_at": task.updated_at.isoformat()
+            }
+            active_tasks.append(task_info)
+        
+        return json.dumps({
+            "active_tasks": active_tasks,
+            "total_count": len(active_tasks),
+            "executor": task_executor.stats(),
+            "timestamp": datetime.now().isoformat()
+        }, ensure_ascii=False)
             
     except Exception as e:
         logger.error(f"列出任务失败: {e}")
@@ -262,11 +655,59 @@ def list_active_tasks() -> str:
             "total_count": 0
         }, ensure_ascii=False)
 
+@mcp.tool()
+def get_metrics(format: str = "json") -> str:
+    """
+    获取服务运行指标：各阶段耗时、按服务提供方/模型统计的LLM请求耗时与token用量、估算费用、
+    ArXiv请求耗时、任务排队时间
+    
+    Args:
+        format: json（含按分桶估算的p50/p95/p99，以及执行器、任务合并、模型路由、限流器、熔断器状态）或 prometheus（Prometheus文本格式）
+    
+    Returns:
+        指标数据
+    """
+    try:
+        if format == "prometheus":
+            return metrics_registry.prometheus()
+        if format != "json":
+            return json.dumps({
+                "error": f"不支持的格式: {format}，可选 json / prometheus",
+                "status": "error"
+            }, ensure_ascii=False)
+        
+        # 路由器在首次LLM请求时才需要加载
+        from app.core.router import get_router
+        from app.utils.circuit_breaker import circuit_stats
+        from app.utils.rate_limit import get_rate_governor
+        
+        return json.dumps({
+            "metrics": metrics_registry.snapshot(),
+            "executor": task_executor.stats(),
+            "coalescer": task_coalescer.stats(),
+            "router": get_router().stats(),
+            "rate_limits": get_rate_governor().stats(),
+            "circuits": circuit_stats(),
+            "timestamp": datetime.now().isoformat()
+        }, ensure_ascii=False)
+        
+    except Exception as e:
+        logger.error(f"获取指标失败: {e}")
+        return json.dumps({
+            "error": f"获取指标失败: {str(e)}",
+            "status": "error"
+        }, ensure_ascii=False)
+
 if __name__ == "__main__":
     logger.info("启动 AstroInsight FastMCP 服务器...")
     
     # 确保必要目录存在
     ensure_temp_directory()
+    get_checkpoint_store().prune(settings.TASK_CHECKPOINT_TTL)
+    
+    # 预编译提示词模板
+    from app.core.tpl import template_registry
+    logger.info(f"提示词模板预编译完成: {template_registry.precompile()}")
     
     # 启动服务器
     mcp.run()
\ No newline at end of file
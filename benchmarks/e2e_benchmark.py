@@ -0,0 +1,505 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time : 2025/9/13 17:05
+# @Author : 桐
+# @QQ:1041264242
+# 注意事项：所有相对路径（缓存、任务库、检查点、日志）都落在临时工作目录中，LLM与ArXiv缓存关闭，
+#          每次运行使用不同关键词，保证每次测量都完整执行各阶段
+"""
+端到端流程基准测试（本地桩服务，不消耗真实模型额度）
+
+场景:
+1. pipeline: 顺序执行 generate_research_paper_main，统计各阶段耗时
+2. concurrency: 同时执行N个流程，统计吞吐量、单任务耗时、峰值RSS与线程数
+3. mcp（--mcp）: 通过stdio启动MCP服务，经 generate_research_paper / get_task_status 工具并发执行任务
+
+用法:
+    python benchmarks/e2e_benchmark.py [--profile fast] [--papers 10] [--runs 3] [--concurrency 1,4,8]
+                                       [--mcp] [--output result.json] [--baseline previous.json]
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import runpy
+import shutil
+import argparse
+import platform
+import tempfile
+import threading
+import statistics
+import subprocess
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+from urllib.request import urlopen
+
+import psutil
+
+BENCHMARK_DIR = Path(__file__).resolve().parent
+PROJECT_ROOT = BENCHMARK_DIR.parent
+SERVER_SCRIPT = PROJECT_ROOT / "astroinsight_optimized_fastmcp.py"
+PROTOCOL_VERSION = "2024-11-05"
+TERMINAL_STATUSES = {"COMPLETED", "FAILED", "REJECTED", "INTERRUPTED"}
+
+# 对比基线时，这些指标越大越好，其余指标（耗时、内存、线程数）越小越好
+HIGHER_IS_BETTER = ("throughput_tps",)
+
+
+def benchmark_env(urls: Dict[str, str], args: argparse.Namespace) -> Dict[str, str]:
+    """
+    将服务配置指向桩服务的环境变量
+
+    Args:
+        urls: 桩服务地址
+        args: 命令行参数
+
+    Returns:
+        Dict[str, str]: 需要设置的环境变量
+    """
+    return {
+        "DEEPSEEK_BASE_URL": urls["openai"],
+        "DEEPSEEK_API_TOKEN": "stub",
+        "QWEN_BASE_URL": urls["dashscope"],
+        "QWEN_API_TOKEN": "stub",
+        "ARXIV_API_URL": urls["arxiv"],
+        "ARXIV_PAGE_INTERVAL": str(args.arxiv_interval),
+        "PAPER_SEARCH_MODE": "remote",
+        "LLM_CACHE_ENABLED": "false",
+        "ARXIV_CACHE_ENABLED": "false",
+        "COMPRESSION_CACHE_ENABLED": "false",
+        "COMPRESSION_ENABLED": "true" if args.compression else "false",
+        "TASK_COALESCE_ENABLED": "false",
+        "NO_PROXY": "127.0.0.1,localhost",
+        "no_proxy": "127.0.0.1,localhost",
+        "PYTHONUNBUFFERED": "1",
+    }
+
+
+def route_moa_to_stubs(urls: Dict[str, str]):
+    """将MoA模型配置中的服务地址改为桩服务（DashScope类型走dashscope桩，其余走OpenAI兼容桩）"""
+    from app.core.moa import model_configs
+
+    for config in model_configs:
+        stub = "dashscope" if config.get("model_type") == "dashscope_chat" else "openai"
+        config["api_key"] = "stub"
+        config["client_args"] = {"base_url": urls[stub]}
+
+
+def start_stubs(args: argparse.Namespace) -> Tuple[subprocess.Popen, Dict[str, str]]:
+    """在独立进程中启动桩服务，避免桩服务的线程和内存计入被测进程"""
+    command = [sys.executable, str(BENCHMARK_DIR / "stub_servers.py"),
+               "--profile", args.profile, "--time-scale", str(args.time_scale)]
+    if args.profile_file:
+        command += ["--profile-file", args.profile_file]
+    proc = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+    line = proc.stdout.readline()
+    if not line:
+        raise RuntimeError(f"桩服务启动失败，返回码: {proc.wait()}")
+    return proc, json.loads(line)
+
+
+def stub_stats(urls: Dict[str, str]) -> Dict[str, Dict[str, int]]:
+    """读取各桩服务的请求计数"""
+    stats = {}
+    for name, url in urls.items():
+        parsed = urlparse(url)
+        with urlopen(f"{parsed.scheme}://{parsed.netloc}/stats", timeout=5) as response:
+            stats[name] = json.loads(response.read())
+    return stats
+
+
+def stats_delta(before: Dict[str, Dict[str, int]], after: Dict[str, Dict[str, int]]) -> Dict[str, Dict[str, int]]:
+    return {name: {key: after[name][key] - before[name].get(key, 0) for key in after[name]} for name in after}
+
+
+def summarize(samples: List[float]) -> Dict[str, float]:
+    """计算样本统计值（毫秒）"""
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+    return {
+        "count": len(ordered),
+        "min": round(ordered[0], 1),
+        "median": round(statistics.median(ordered), 1),
+        "mean": round(statistics.fmean(ordered), 1),
+        "p95": round(ordered[min(int(len(ordered) * 0.95), len(ordered) - 1)], 1),
+        "max": round(ordered[-1], 1),
+    }
+
+
+class ResourceSampler:
+    """后台定期采样进程的RSS与线程数，记录峰值"""
+
+    def __init__(self, pid: Optional[int] = None, interval: float = 0.02):
+        self.process = psutil.Process(pid)
+        self.interval = interval
+        self.peak_rss = 0
+        self.peak_threads = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="resource-sampler", daemon=True)
+
+    def _sample(self):
+        try:
+            self.peak_rss = max(self.peak_rss, self.process.memory_info().rss)
+            # 采样线程本身不计入
+            own = 1 if self.process.pid == os.getpid() else 0
+            self.peak_threads = max(self.peak_threads, self.process.num_threads() - own)
+        except psutil.Error:
+            pass
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def __enter__(self) -> "ResourceSampler":
+        self._sample()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+
+    def result(self) -> Dict[str, float]:
+        return {"peak_rss_mb": round(self.peak_rss / (1024 * 1024), 1), "peak_threads": self.peak_threads}
+
+
+def run_pipeline(keyword: str, papers: int) -> Dict[str, Any]:
+    """
+    执行一次完整流程并按阶段回调记录耗时
+
+    Args:
+        keyword: 研究关键词
+        papers: 搜索论文数量
+
+    Returns:
+        Dict[str, Any]: 各阶段耗时、总耗时（毫秒）与执行状态
+    """
+    from main import generate_research_paper_main
+
+    stages: Dict[str, float] = {}
+    started = last = time.perf_counter()
+
+    def on_stage(stage: str, progress: int):
+        nonlocal last
+        now = time.perf_counter()
+        stages[stage] = (now - last) * 1000
+        last = now
+
+    result = generate_research_paper_main(keyword, papers, progress_callback=on_stage)
+    stage_errors = [key for key in ("compression_info", "facts_info", "hypothesis_info", "optimization_info")
+                    if isinstance(result.get(key), dict) and "error" in result[key]]
+    if result.get("search_error"):
+        stage_errors.append("search")
+    return {
+        "stages_ms": stages,
+        "total_ms": (time.perf_counter() - started) * 1000,
+        "ok": result.get("status") == "completed" and not stage_errors,
+        "errors": stage_errors or ([result["error"]] if result.get("error") else []),
+    }
+
+
+def bench_pipeline(args: argparse.Namespace, urls: Dict[str, str]) -> Dict[str, Any]:
+    """顺序执行若干次流程，统计各阶段耗时"""
+    before = stub_stats(urls)
+    runs = [run_pipeline(f"{args.keyword} {uuid.uuid4().hex[:8]}", args.papers) for _ in range(args.runs)]
+    stage_names = list(runs[0]["stages_ms"]) if runs else []
+    return {
+        "runs": args.runs,
+        "failed": sum(not run["ok"] for run in runs),
+        "errors": sorted({error for run in runs for error in run["errors"]}),
+        "stages_ms": {stage: summarize([run["stages_ms"][stage] for run in runs if stage in run["stages_ms"]])
+                      for stage in stage_names},
+        "total_ms": summarize([run["total_ms"] for run in runs]),
+        "stub_requests": stats_delta(before, stub_stats(urls)),
+    }
+
+
+def bench_concurrency(args: argparse.Namespace, urls: Dict[str, str], level: int) -> Dict[str, Any]:
+    """同时执行level个流程（共执行max(level, tasks)个），统计吞吐量与资源峰值"""
+    tasks = max(level, args.tasks)
+    before = stub_stats(urls)
+    with ResourceSampler() as sampler, ThreadPoolExecutor(max_workers=level, thread_name_prefix="bench-task") as pool:
+        started = time.perf_counter()
+        futures = [pool.submit(run_pipeline, f"{args.keyword} {uuid.uuid4().hex[:8]}", args.papers)
+                   for _ in range(tasks)]
+        runs = [future.result() for future in futures]
+        wall = time.perf_counter() - started
+    return {
+        "concurrency": level,
+        "tasks": tasks,
+        "failed": sum(not run["ok"] for run in runs),
+        "wall_ms": round(wall * 1000, 1),
+        "throughput_tps": round(tasks / wall, 3),
+        "task_ms": summarize([run["total_ms"] for run in runs]),
+        **sampler.result(),
+        "stub_requests": stats_delta(before, stub_stats(urls)),
+    }
+
+
+class StdioClient:
+    """极简MCP stdio客户端：按换行分隔的JSON-RPC消息收发，支持多个请求并发等待"""
+
+    def __init__(self, command: List[str], cwd: str, env: Dict[str, str]):
+        self.proc = subprocess.Popen(command, cwd=cwd, env=env, text=True, encoding="utf-8",
+                                     stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        self._next_id = 0
+        self._pending: Dict[int, Future] = {}
+        self._lock = threading.Lock()
+        self._reader = threading.Thread(target=self._read, name="mcp-reader", daemon=True)
+        self._reader.start()
+
+    def _read(self):
+        for line in self.proc.stdout:
+            try:
+                message = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            with self._lock:
+                future = self._pending.pop(message.get("id"), None)
+            if future is not None:
+                future.set_result(message)
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        for future in pending.values():
+            future.set_exception(RuntimeError(f"MCP服务进程已退出，返回码: {self.proc.poll()}"))
+
+    def _write(self, message: Dict[str, Any]):
+        with self._lock:
+            self.proc.stdin.write(json.dumps(message) + "\n")
+            self.proc.stdin.flush()
+
+    def request(self, method: str, params: Dict[str, Any], timeout: float = 60.0) -> Dict[str, Any]:
+        future: Future = Future()
+        with self._lock:
+            self._next_id += 1
+            request_id = self._next_id
+            self._pending[request_id] = future
+        self._write({"jsonrpc": "2.0", "id": request_id, "method": method, "params": params})
+        response = future.result(timeout)
+        if "error" in response:
+            raise RuntimeError(f"{method} 调用失败: {response['error']}")
+        return response["result"]
+
+    def notify(self, method: str):
+        self._write({"jsonrpc": "2.0", "method": method})
+
+    def initialize(self, timeout: float = 60.0):
+        self.request("initialize", {
+            "protocolVersion": PROTOCOL_VERSION,
+            "capabilities": {},
+            "clientInfo": {"name": "e2e-benchmark", "version": "1.0"},
+        }, timeout)
+        self.notify("notifications/initialized")
+
+    def call_tool(self, name: str, arguments: Dict[str, Any], timeout: float = 60.0) -> Dict[str, Any]:
+        """调用工具并解析其返回的JSON文本"""
+        result = self.request("tools/call", {"name": name, "arguments": arguments}, timeout)
+        return json.loads(result["content"][0]["text"])
+
+    def close(self):
+        self.proc.kill()
+        self.proc.wait()
+
+
+def bench_mcp(args: argparse.Namespace, urls: Dict[str, str], level: int) -> Dict[str, Any]:
+    """通过MCP工具并发提交level个任务，轮询直到全部结束"""
+    workdir = tempfile.mkdtemp(prefix="astroinsight-mcp-bench-")
+    env = dict(os.environ, **benchmark_env(urls, args))
+    command = [sys.executable, str(Path(__file__).resolve()), "--serve-mcp", json.dumps(urls)]
+    before = stub_stats(urls)
+    client = StdioClient(command, cwd=workdir, env=env)
+    try:
+        with ResourceSampler(client.proc.pid) as sampler:
+            client.initialize()
+            started = time.perf_counter()
+            submitted: Dict[str, float] = {}
+            submit_ms = []
+            rejected = 0
+            for _ in range(level):
+                sent = time.perf_counter()
+                response = client.call_tool("generate_research_paper", {
+                    "keyword": f"{args.keyword} {uuid.uuid4().hex[:8]}", "search_paper_num": args.papers,
+                })
+                submit_ms.append((time.perf_counter() - sent) * 1000)
+                if "task_id" in response:
+                    submitted[response["task_id"]] = sent
+                else:
+                    rejected += 1
+
+            latencies = []
+            failed = 0
+            pending = set(submitted)
+            deadline = time.perf_counter() + args.mcp_timeout
+            while pending and time.perf_counter() < deadline:
+                for task_id in list(pending):
+                    status = client.call_tool("get_task_status", {"task_id": task_id, "fields": ["status"]})
+                    if status.get("status") in TERMINAL_STATUSES:
+                        latencies.append((time.perf_counter() - submitted[task_id]) * 1000)
+                        failed += status["status"] != "COMPLETED"
+                        pending.discard(task_id)
+                if pending:
+                    time.sleep(args.poll_interval)
+            wall = time.perf_counter() - started
+    finally:
+        client.close()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        "concurrency": level,
+        "tasks": level,
+        "rejected": rejected,
+        "failed": failed,
+        "timed_out": len(pending),
+        "wall_ms": round(wall * 1000, 1),
+        "throughput_tps": round(len(latencies) / wall, 3) if wall else 0.0,
+        "submit_ms": summarize(submit_ms),
+        "task_ms": summarize(latencies),
+        **sampler.result(),
+        "stub_requests": stats_delta(before, stub_stats(urls)),
+    }
+
+
+def flatten(data: Any, prefix: str = "") -> Dict[str, float]:
+    """将嵌套结果展开为 点分路径 -> 数值"""
+    if isinstance(data, dict):
+        items = {}
+        for key, value in data.items():
+            items.update(flatten(value, f"{prefix}.{key}" if prefix else str(key)))
+        return items
+    if isinstance(data, (int, float)) and not isinstance(data, bool):
+        return {prefix: float(data)}
+    return {}
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> Dict[str, Any]:
+    """
+    与基线结果对比
+
+    Args:
+        current: 本次结果
+        baseline: 基线结果
+        threshold: 判定为退化的变化百分比
+
+    Returns:
+        Dict[str, Any]: 各指标的变化与退化指标列表
+    """
+    metrics = {}
+    regressions = []
+    sections = ("pipeline", "concurrency", "mcp")
+    base = flatten({key: baseline.get(key) for key in sections})
+    for key, value in flatten({key: current.get(key) for key in sections}).items():
+        # 请求计数和样本数不是性能指标
+        if key not in base or ".stub_requests." in key or key.endswith(".count"):
+            continue
+        reference = base[key]
+        change = (value - reference) / reference * 100 if reference else 0.0
+        metrics[key] = {"baseline": reference, "current": value, "change_pct": round(change, 1)}
+        worse = -change if key.endswith(HIGHER_IS_BETTER) else change
+        if worse > threshold and (key.endswith(HIGHER_IS_BETTER) or key.endswith(
+                ("median", "p95", "peak_rss_mb", "peak_threads", "wall_ms", "failed"))):
+            regressions.append(key)
+    return {
+        "config_matches": current.get("config") == baseline.get("config"),
+        "threshold_pct": threshold,
+        "metrics": metrics,
+        "regressions": regressions,
+    }
+
+
+def serve_mcp(urls: Dict[str, str]):
+    """以桩服务配置启动MCP服务（由mcp场景在子进程中调用）"""
+    sys.path.insert(0, str(PROJECT_ROOT))
+    route_moa_to_stubs(urls)
+    sys.argv = [str(SERVER_SCRIPT)]
+    runpy.run_path(str(SERVER_SCRIPT), run_name="__main__")
+
+
+def parse_levels(value: str) -> List[int]:
+    return [int(level) for level in value.split(",") if level.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="端到端流程基准测试（本地桩服务）")
+    parser.add_argument("--profile", default="fast", help="桩服务预设延迟配置 (instant / fast / realistic)")
+    parser.add_argument("--profile-file", help="覆盖预设配置的JSON文件")
+    parser.add_argument("--time-scale", type=float, default=1.0, help="延迟缩放系数")
+    parser.add_argument("--keyword", default="galaxy formation", help="关键词前缀（每次运行附加随机后缀）")
+    parser.add_argument("--papers", type=int, default=10, help="每个任务的搜索论文数量")
+    parser.add_argument("--runs", type=int, default=3, help="pipeline场景的顺序执行次数")
+    parser.add_argument("--concurrency", type=parse_levels, default=[1, 4, 8], help="并发数列表，如1,4,8")
+    parser.add_argument("--tasks", type=int, default=0, help="每个并发数下执行的任务数（默认等于并发数）")
+    parser.add_argument("--arxiv-interval", type=float, default=0.0, help="ArXiv分页请求最小间隔（秒）")
+    parser.add_argument("--compression", action="store_true", help="启用论文全文压缩阶段")
+    parser.add_argument("--mcp", action="store_true", help="同时通过MCP工具测试（需要安装mcp）")
+    parser.add_argument("--mcp-timeout", type=float, default=600.0, help="mcp场景等待全部任务结束的超时（秒）")
+    parser.add_argument("--poll-interval", type=float, default=0.1, help="mcp场景轮询任务状态的间隔（秒）")
+    parser.add_argument("--output", help="结果JSON输出路径")
+    parser.add_argument("--baseline", help="基线结果JSON，用于对比")
+    parser.add_argument("--threshold", type=float, default=10.0, help="判定为退化的变化百分比")
+    parser.add_argument("--fail-on-regression", action="store_true", help="存在退化指标时以非零状态退出")
+    parser.add_argument("--serve-mcp", metavar="URLS", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve_mcp:
+        serve_mcp(json.loads(args.serve_mcp))
+        return
+
+    stubs, urls = start_stubs(args)
+    workdir = tempfile.mkdtemp(prefix="astroinsight-bench-")
+    cwd = os.getcwd()
+    try:
+        # 配置在导入app时读取，必须先设置环境变量
+        os.environ.update(benchmark_env(urls, args))
+        os.chdir(workdir)
+        sys.path.insert(0, str(PROJECT_ROOT))
+        route_moa_to_stubs(urls)
+
+        config = {
+            "profile": args.profile,
+            "profile_file": args.profile_file,
+            "time_scale": args.time_scale,
+            "papers": args.papers,
+            "runs": args.runs,
+            "concurrency": args.concurrency,
+            "tasks": args.tasks,
+            "arxiv_interval": args.arxiv_interval,
+            "compression": args.compression,
+        }
+        result: Dict[str, Any] = {
+            "benchmark": "e2e",
+            "timestamp": datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "cpu_count": os.cpu_count(),
+            "config": config,
+            "pipeline": bench_pipeline(args, urls),
+            "concurrency": {str(level): bench_concurrency(args, urls, level) for level in args.concurrency},
+        }
+        if args.mcp:
+            result["mcp"] = {str(level): bench_mcp(args, urls, level) for level in args.concurrency}
+    finally:
+        os.chdir(cwd)
+        # 压缩阶段fork出的PDF提取进程会继承桩服务的stdin管道，关闭stdin不一定能让其退出
+        stubs.terminate()
+        stubs.wait(timeout=10)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            result["comparison"] = compare(result, json.load(f), args.threshold)
+
+    text = json.dumps(result, ensure_ascii=False, indent=2)
+    print(text)
+    if args.output:
+        Path(args.output).write_text(text, encoding="utf-8")
+    if args.fail_on_regression and result.get("comparison", {}).get("regressions"):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
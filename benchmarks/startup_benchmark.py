@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time : 2025/9/12 10:30
+# @Author : 桐
+# @QQ:1041264242
+# 注意事项：MCP客户端按需通过stdio拉起服务进程，冷启动耗时直接决定首次工具调用的等待时间
+"""
+MCP服务冷启动基准测试
+
+1. 模块导入耗时：通过 python -X importtime 导入服务入口模块，按顶层包汇总累计导入时间
+2. 首次工具响应时间：通过stdio启动服务，依次发送initialize、tools/call(list_active_tasks)，
+   统计从进程启动到收到工具响应的时间
+
+用法:
+    python benchmarks/startup_benchmark.py [--runs 5] [--top 15] [--output result.json]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+from collections import defaultdict
+from pathlib import Path
+from typing import Any, Dict, List
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+SERVER_MODULE = "astroinsight_optimized_fastmcp"
+SERVER_SCRIPT = PROJECT_ROOT / f"{SERVER_MODULE}.py"
+PROTOCOL_VERSION = "2024-11-05"
+
+
+def measure_imports(module: str = SERVER_MODULE, top: int = 15) -> Dict[str, Any]:
+    """
+    统计导入模块的耗时
+
+    Args:
+        module: 要导入的模块
+        top: 返回耗时最多的顶层包数量
+
+    Returns:
+        Dict[str, Any]: 总耗时、按顶层包汇总的耗时（毫秒）
+    """
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=PROJECT_ROOT, capture_output=True, text=True, timeout=120,
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(f"导入 {module} 失败:\n{completed.stderr[-2000:]}")
+
+    # 每行格式: "import time: self [us] | cumulative | imported package"
+    # 各模块自身耗时按顶层包汇总，避免嵌套导入被重复计入
+    packages: Dict[str, float] = defaultdict(float)
+    total_us = 0
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        self_us, _, name = line[len("import time:"):].split("|", 2)
+        packages[name.strip().split(".")[0]] += int(self_us) / 1000
+        total_us += int(self_us)
+
+    ranked = sorted(packages.items(), key=lambda item: item[1], reverse=True)
+    return {
+        "module": module,
+        "total_ms": round(total_us / 1000, 1),
+        "top_packages_ms": {name: round(ms, 1) for name, ms in ranked[:top]},
+    }
+
+
+def _send(proc: subprocess.Popen, message: Dict[str, Any]):
+    proc.stdin.write(json.dumps(message) + "\n")
+    proc.stdin.flush()
+
+
+def _read_response(proc: subprocess.Popen, request_id: int, deadline: float) -> Dict[str, Any]:
+    while time.monotonic() < deadline:
+        line = proc.stdout.readline()
+        if not line:
+            raise RuntimeError(f"服务进程已退出，返回码: {proc.poll()}")
+        try:
+            message = json.loads(line)
+        except json.JSONDecodeError:
+            # 非协议输出（例如第三方库打印的内容），忽略
+            continue
+        if message.get("id") == request_id:
+            return message
+    raise TimeoutError(f"等待响应 {request_id} 超时")
+
+
+def measure_first_tool_response(timeout: float = 60.0) -> Dict[str, float]:
+    """
+    通过stdio启动MCP服务并测量首次工具调用的响应时间
+
+    Args:
+        timeout: 单次测量的超时时间（秒）
+
+    Returns:
+        Dict[str, float]: 初始化完成时间、首次工具响应时间（毫秒，均从进程启动开始计时）
+    """
+    env = dict(os.environ, PYTHONUNBUFFERED="1")
+    started = time.monotonic()
+    deadline = started + timeout
+    proc = subprocess.Popen(
+        [sys.executable, str(SERVER_SCRIPT)],
+        cwd=PROJECT_ROOT, env=env, text=True, encoding="utf-8",
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+    )
+    try:
+        _send(proc, {
+            "jsonrpc": "2.0", "id": 1, "method": "initialize",
+            "params": {
+                "protocolVersion": PROTOCOL_VERSION,
+                "capabilities": {},
+                "clientInfo": {"name": "startup-benchmark", "version": "1.0"},
+            },
+        })
+        _read_response(proc, 1, deadline)
+        initialized = time.monotonic()
+        _send(proc, {"jsonrpc": "2.0", "method": "notifications/initialized"})
+
+        _send(proc, {
+            "jsonrpc": "2.0", "id": 2, "method": "tools/call",
+            "params": {"name": "list_active_tasks", "arguments": {}},
+        })
+        response = _read_response(proc, 2, deadline)
+        if "error" in response:
+            raise RuntimeError(f"工具调用失败: {response['error']}")
+        first_response = time.monotonic()
+    finally:
+        proc.kill()
+        proc.wait()
+
+    return {
+        "initialize_ms": round((initialized - started) * 1000, 1),
+        "first_tool_response_ms": round((first_response - started) * 1000, 1),
+    }
+
+
+def summarize(samples: List[float]) -> Dict[str, float]:
+    """计算样本的最小值、中位数和最大值"""
+    return {
+        "min": round(min(samples), 1),
+        "median": round(statistics.median(samples), 1),
+        "max": round(max(samples), 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="MCP服务冷启动基准测试")
+    parser.add_argument("--runs", type=int, default=5, help="冷启动测量次数")
+    parser.add_argument("--top", type=int, default=15, help="展示导入耗时最多的顶层包数量")
+    parser.add_argument("--timeout", type=float, default=60.0, help="单次测量超时（秒）")
+    parser.add_argument("--output", help="结果JSON输出路径")
+    args = parser.parse_args()
+
+    imports = measure_imports(top=args.top)
+    runs = [measure_first_tool_response(args.timeout) for _ in range(args.runs)]
+    result = {
+        "python": sys.version.split()[0],
+        "imports": imports,
+        "runs": runs,
+        "initialize_ms": summarize([run["initialize_ms"] for run in runs]),
+        "first_tool_response_ms": summarize([run["first_tool_response_ms"] for run in runs]),
+    }
+
+    text = json.dumps(result, ensure_ascii=False, indent=2)
+    print(text)
+    if args.output:
+        Path(args.output).write_text(text, encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
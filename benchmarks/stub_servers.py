@@ -0,0 +1,401 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time : 2025/9/13 16:20
+# @Author : 桐
+# @QQ:1041264242
+# 注意事项：桩服务只模拟延迟与响应格式，不检查API密钥；同一进程内三个服务各占一个端口
+"""
+基准测试用的本地桩服务
+
+- openai: OpenAI兼容的 /chat/completions（DeepSeek及MoA中openai_chat类型模型）
+- dashscope: DashScope兼容模式的 /compatible-mode/v1/chat/completions（通义千问）
+- arxiv: ArXiv Atom检索接口 /api/query，以及论文PDF下载 /pdf/<id>
+
+每个服务的延迟由延迟配置决定，GET /stats 返回请求计数。
+
+用法:
+    python benchmarks/stub_servers.py [--profile fast] [--profile-file profile.json] [--time-scale 1.0]
+启动后向stdout输出一行JSON（各服务地址），直到stdin关闭或进程被终止
+"""
+import re
+import sys
+import json
+import time
+import random
+import hashlib
+import argparse
+import threading
+from collections import deque
+from copy import deepcopy
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict
+from urllib.parse import parse_qs, urlparse
+from xml.sax.saxutils import escape
+
+# 延迟配置（秒）：
+#   LLM服务: 总耗时 = base_latency + completion_tokens / tokens_per_second，再乘以 [1-jitter, 1+jitter] 的随机系数
+#   arxiv: 每页耗时 = base_latency + per_entry_latency * 条目数，同样叠加抖动
+#   error_rate: 返回错误的概率（LLM返回429，arxiv返回503）
+#   rate_limit: LLM服务每秒最多接受的请求数（1秒滑动窗口），超出时返回429并带Retry-After，未配置或为0时不限制
+PROFILES: Dict[str, Dict[str, Dict[str, float]]] = {
+    "instant": {
+        "openai": {"base_latency": 0.0, "tokens_per_second": 0, "completion_tokens": 200, "jitter": 0.0, "error_rate": 0.0},
+        "dashscope": {"base_latency": 0.0, "tokens_per_second": 0, "completion_tokens": 200, "jitter": 0.0, "error_rate": 0.0},
+        "arxiv": {"base_latency": 0.0, "per_entry_latency": 0.0, "jitter": 0.0, "error_rate": 0.0},
+    },
+    "fast": {
+        "openai": {"base_latency": 0.05, "tokens_per_second": 4000, "completion_tokens": 400, "jitter": 0.2, "error_rate": 0.0},
+        "dashscope": {"base_latency": 0.08, "tokens_per_second": 3000, "completion_tokens": 400, "jitter": 0.2, "error_rate": 0.0},
+        "arxiv": {"base_latency": 0.05, "per_entry_latency": 0.001, "jitter": 0.2, "error_rate": 0.0},
+    },
+    "realistic": {
+        "openai": {"base_latency": 0.8, "tokens_per_second": 60, "completion_tokens": 600, "jitter": 0.3, "error_rate": 0.0},
+        "dashscope": {"base_latency": 1.0, "tokens_per_second": 45, "completion_tokens": 600, "jitter": 0.3, "error_rate": 0.0},
+        "arxiv": {"base_latency": 1.5, "per_entry_latency": 0.01, "jitter": 0.3, "error_rate": 0.0},
+    },
+}
+
+ARXIV_TOTAL_RESULTS = 1000
+ABSTRACT_WORDS = 180
+WORDS = ("galaxy stellar spectra redshift survey dark matter halo photometric model simulation "
+         "accretion disk emission telescope luminosity cosmic variance instrument calibration "
+         "catalog morphology feedback metallicity transient lensing").split()
+
+
+def load_profile(name: str = "fast", path: str = None, time_scale: float = 1.0) -> Dict[str, Dict[str, float]]:
+    """
+    加载延迟配置：以预设配置为基础，配置文件中的字段覆盖同名字段，所有延迟乘以time_scale
+
+    Args:
+        name: 预设配置名称
+        path: JSON配置文件路径
+        time_scale: 延迟缩放系数
+
+    Returns:
+        Dict: 各服务的延迟配置
+    """
+    if name not in PROFILES:
+        raise ValueError(f"未知延迟配置: {name}，可选: {', '.join(PROFILES)}")
+    profile = deepcopy(PROFILES[name])
+    if path:
+        with open(path, "r", encoding="utf-8") as f:
+            for service, overrides in json.load(f).items():
+                profile.setdefault(service, {}).update(overrides)
+    for service in profile.values():
+        for key in ("base_latency", "per_entry_latency"):
+            if key in service:
+                service[key] *= time_scale
+        if service.get("tokens_per_second"):
+            service["tokens_per_second"] /= time_scale
+    return profile
+
+
+def _jittered(seconds: float, jitter: float) -> float:
+    return max(seconds * random.uniform(1 - jitter, 1 + jitter), 0.0) if jitter else seconds
+
+
+def _words(seed: str, count: int) -> str:
+    rng = random.Random(seed)
+    return " ".join(rng.choice(WORDS) for _ in range(count))
+
+
+def make_pdf(text: str) -> bytes:
+    """生成只有一页文本的最小PDF"""
+    lines = [text[i:i + 90] for i in range(0, len(text), 90)] or [""]
+    stream = "BT /F1 10 Tf 40 800 Td 12 TL " + " ".join(
+        "({}) '".format(line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")) for line in lines
+    ) + " ET"
+    objects = [
+        "<< /Type /Catalog /Pages 2 0 R >>",
+        "<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        "<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+        "/Resources << /Font << /F1 5 0 R >> >> /Contents 4 0 R >>",
+        f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream",
+        "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += f"{number} 0 obj\n{body}\nendobj\n".encode("latin-1")
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode("latin-1")
+    for offset in offsets:
+        out += f"{offset:010d} 00000 n \n".encode("latin-1")
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode("latin-1")
+    return bytes(out)
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: "StubServer"
+
+    def log_message(self, format, *args):
+        # 默认会逐条请求打印到stderr，基准测试时关闭
+        pass
+
+    def _send_json(self, status: int, payload: Dict[str, Any], headers: Dict[str, str] = None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_bytes(self, content_type: str, body: bytes):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == "/stats":
+            self._send_json(200, self.server.stats())
+            return
+        self.server.count("requests")
+        self.handle_get(path)
+
+    def do_POST(self):
+        self.server.count("requests")
+        length = int(self.headers.get("Content-Length") or 0)
+        payload = json.loads(self.rfile.read(length) or b"{}")
+        self.handle_post(urlparse(self.path).path, payload)
+
+    def handle_get(self, path: str):
+        self._send_json(404, {"error": f"not found: {path}"})
+
+    def handle_post(self, path: str, payload: Dict[str, Any]):
+        self._send_json(404, {"error": f"not found: {path}"})
+
+
+class ChatCompletionHandler(_StubHandler):
+    """OpenAI兼容的对话补全接口，支持stream=true的SSE流式返回"""
+
+    def handle_post(self, path: str, payload: Dict[str, Any]):
+        if not path.endswith("/chat/completions"):
+            super().handle_post(path, payload)
+            return
+        profile = self.server.profile
+        if random.random() < profile.get("error_rate", 0.0):
+            self.server.count("errors")
+            time.sleep(_jittered(profile["base_latency"], profile["jitter"]))
+            self._send_json(429, {"error": {"message": "rate limited by stub", "type": "rate_limit_error"}})
+            return
+        retry_after = self.server.admit(profile.get("rate_limit") or 0)
+        if retry_after is not None:
+            self.server.count("throttled")
+            self._send_json(429, {"error": {"message": "requests per second exceeded", "type": "rate_limit_error"}},
+                            headers={"Retry-After": f"{retry_after:.3f}"})
+            return
+
+        messages = payload.get("messages", [])
+        prompt_tokens = sum(len(str(message.get("content", ""))) for message in messages) // 4
+        completion_tokens = int(profile["completion_tokens"])
+        json_mode = (payload.get("response_format") or {}).get("type") == "json_object"
+        seed = hashlib.sha256(json.dumps(messages, sort_keys=True).encode("utf-8")).hexdigest()
+        text = _words(seed, completion_tokens)
+        content = json.dumps({"result": text}) if json_mode else text
+
+        tps = profile.get("tokens_per_second") or 0
+        generation = completion_tokens / tps if tps else 0.0
+        scale = random.uniform(1 - profile["jitter"], 1 + profile["jitter"]) if profile["jitter"] else 1.0
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                 "total_tokens": prompt_tokens + completion_tokens}
+        response_id = f"chatcmpl-{seed[:24]}"
+        model = payload.get("model", "stub")
+
+        if not payload.get("stream"):
+            time.sleep(max((profile["base_latency"] + generation) * scale, 0.0))
+            self._send_json(200, {
+                "id": response_id, "object": "chat.completion", "created": int(time.time()), "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content},
+                             "finish_reason": "stop"}],
+                "usage": usage,
+            })
+            return
+
+        # 流式：首个分片在base_latency后到达，其余分片按生成速度均匀到达
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        time.sleep(max(profile["base_latency"] * scale, 0.0))
+        pieces = re.findall(r"\S+\s*", content) or [content]
+        chunk_words = 8
+        interval = generation * scale * chunk_words / max(len(pieces), 1)
+        for start in range(0, len(pieces), chunk_words):
+            delta = "".join(pieces[start:start + chunk_words])
+            self._send_event({"id": response_id, "object": "chat.completion.chunk", "created": int(time.time()),
+                              "model": model, "choices": [{"index": 0, "delta": {"content": delta},
+                                                           "finish_reason": None}]})
+            if interval:
+                time.sleep(interval)
+        self._send_event({"id": response_id, "object": "chat.completion.chunk", "created": int(time.time()),
+                          "model": model, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+                          "usage": usage})
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+        self.close_connection = True
+
+    def _send_event(self, payload: Dict[str, Any]):
+        self.wfile.write(f"data: {json.dumps(payload)}\n\n".encode("utf-8"))
+        self.wfile.flush()
+
+
+class ArxivHandler(_StubHandler):
+    """ArXiv Atom检索接口与PDF下载"""
+
+    def handle_get(self, path: str):
+        if path.startswith("/pdf/"):
+            paper_id = path[len("/pdf/"):]
+            self._send_bytes("application/pdf", make_pdf(_words(paper_id, ABSTRACT_WORDS * 3)))
+            return
+        if not path.endswith("/api/query"):
+            super().handle_get(path)
+            return
+
+        profile = self.server.profile
+        params = parse_qs(urlparse(self.path).query)
+        query = params.get("search_query", [""])[0]
+        start = int(params.get("start", ["0"])[0])
+        max_results = int(params.get("max_results", ["10"])[0])
+        count = max(min(max_results, ARXIV_TOTAL_RESULTS - start), 0)
+
+        time.sleep(_jittered(profile["base_latency"] + profile["per_entry_latency"] * count, profile["jitter"]))
+        if random.random() < profile.get("error_rate", 0.0):
+            self.server.count("errors")
+            self._send_json(503, {"error": "arxiv stub unavailable"})
+            return
+        host = self.headers.get("Host", f"127.0.0.1:{self.server.server_port}")
+        entries = "".join(self._entry(query, index, host) for index in range(start, start + count))
+        feed = (
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<feed xmlns="http://www.w3.org/2005/Atom" xmlns:arxiv="http://arxiv.org/schemas/atom" '
+            'xmlns:opensearch="http://a9.com/-/spec/opensearch/1.1/">'
+            f"<title>ArXiv Query: {escape(query)}</title>"
+            f"<opensearch:totalResults>{ARXIV_TOTAL_RESULTS}</opensearch:totalResults>"
+            f"<opensearch:startIndex>{start}</opensearch:startIndex>"
+            f"{entries}</feed>"
+        )
+        self._send_bytes("application/atom+xml", feed.encode("utf-8"))
+
+    @staticmethod
+    def _entry(query: str, index: int, host: str) -> str:
+        digest = hashlib.sha256(f"{query}:{index}".encode("utf-8")).hexdigest()
+        paper_id = f"{int(digest[:4], 16) % 10000:04d}.{int(digest[4:9], 16) % 100000:05d}"
+        seed = f"{query}:{index}"
+        return (
+            "<entry>"
+            f"<id>http://arxiv.org/abs/{paper_id}v1</id>"
+            "<published>2025-01-15T00:00:00Z</published>"
+            "<updated>2025-01-15T00:00:00Z</updated>"
+            f"<title>{escape(_words(seed + ':title', 10).title())}</title>"
+            f"<summary>{escape(_words(seed, ABSTRACT_WORDS))}</summary>"
+            f"<author><name>Author {index} A</name></author><author><name>Author {index} B</name></author>"
+            f'<link href="http://arxiv.org/abs/{paper_id}v1" rel="alternate" type="text/html"/>'
+            f'<link title="pdf" href="http://{host}/pdf/{paper_id}v1" rel="related" type="application/pdf"/>'
+            '<arxiv:primary_category term="astro-ph.GA" scheme="http://arxiv.org/schemas/atom"/>'
+            "</entry>"
+        )
+
+
+class StubServer(ThreadingHTTPServer):
+    """带延迟配置与请求计数的线程化HTTP桩服务"""
+
+    daemon_threads = True
+    request_queue_size = 256
+
+    def __init__(self, handler, profile: Dict[str, float], port: int = 0):
+        super().__init__(("127.0.0.1", port), handler)
+        self.profile = profile
+        self._counts = {"requests": 0, "errors": 0, "throttled": 0}
+        self._admitted = deque()
+        self._lock = threading.Lock()
+
+    def handle_error(self, request, client_address):
+        # MoA达到法定响应数后会取消其余请求，客户端断开属于正常情况
+        if isinstance(sys.exc_info()[1], ConnectionError):
+            return
+        super().handle_error(request, client_address)
+
+    def admit(self, limit: float):
+        """
+        按1秒滑动窗口限制请求数
+
+        Args:
+            limit: 每秒最多接受的请求数，为0时不限制
+
+        Returns:
+            float: 被拒绝时距窗口内最早请求过期的秒数，接受时返回None
+        """
+        if not limit:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            while self._admitted and self._admitted[0] <= now - 1.0:
+                self._admitted.popleft()
+            if len(self._admitted) >= limit:
+                return self._admitted[0] + 1.0 - now
+            self._admitted.append(now)
+            return None
+
+    def count(self, key: str):
+        with self._lock:
+            self._counts[key] += 1
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._counts)
+
+
+def start_servers(profile: Dict[str, Dict[str, float]]) -> Dict[str, StubServer]:
+    """
+    在后台线程中启动全部桩服务
+
+    Args:
+        profile: load_profile返回的延迟配置
+
+    Returns:
+        Dict[str, StubServer]: 服务名到服务实例的映射
+    """
+    servers = {
+        "openai": StubServer(ChatCompletionHandler, profile["openai"]),
+        "dashscope": StubServer(ChatCompletionHandler, profile["dashscope"]),
+        "arxiv": StubServer(ArxivHandler, profile["arxiv"]),
+    }
+    for name, server in servers.items():
+        threading.Thread(target=server.serve_forever, name=f"stub-{name}", daemon=True).start()
+    return servers
+
+
+def server_urls(servers: Dict[str, StubServer]) -> Dict[str, str]:
+    """各桩服务的接口地址，可直接用作对应的base_url配置"""
+    return {
+        "openai": f"http://127.0.0.1:{servers['openai'].server_port}/v1",
+        "dashscope": f"http://127.0.0.1:{servers['dashscope'].server_port}/compatible-mode/v1",
+        "arxiv": f"http://127.0.0.1:{servers['arxiv'].server_port}/api/query",
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="基准测试用的本地LLM与ArXiv桩服务")
+    parser.add_argument("--profile", default="fast", choices=list(PROFILES), help="预设延迟配置")
+    parser.add_argument("--profile-file", help="覆盖预设配置的JSON文件")
+    parser.add_argument("--time-scale", type=float, default=1.0, help="延迟缩放系数")
+    args = parser.parse_args()
+
+    servers = start_servers(load_profile(args.profile, args.profile_file, args.time_scale))
+    print(json.dumps(server_urls(servers)), flush=True)
+    # 父进程关闭stdin即退出
+    sys.stdin.read()
+    for server in servers.values():
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
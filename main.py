@@ -7,30 +7,26 @@ AstroInsight 主要业务逻辑
 import os
 import sys
 import json
+import time
 import logging
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, Callable, List, Optional
 
 # 设置环境变量
 os.environ['PYTHONIOENCODING'] = 'utf-8'
 
-# 导入必要的模块
-try:
-    from app.utils.arxiv_api import search_papers, download_paper_info
-    from app.utils.llm_api import call_llm_api
-    from app.core.config import get_config
-    from app.core.prompt import get_prompt_template
-    from app.core.moa import run_moa_optimization
-    from app.utils.tool import save_to_file, load_from_file, format_paper_info
-except ImportError as e:
-    logging.warning(f"部分模块导入失败: {e}")
-    # 如果导入失败，使用简化版本
-    pass
+# 各阶段依赖的模块（LLM SDK、ArXiv检索等）在阶段内按需导入，避免拖慢服务启动
 
 # 配置日志
 logger = logging.getLogger(__name__)
 
+# 未使用模板时的通用系统提示词
+RESEARCH_ASSISTANT_SYSTEM_PROMPT = "You are an expert research assistant who produces rigorous, well-structured scientific analysis."
+
 def process_paper(paper_info: Dict[str, Any]) -> Dict[str, Any]:
     """
     处理单篇论文信息
@@ -76,44 +72,32 @@ def process_paper(paper_info: Dict[str, Any]) -> Dict[str, Any]:
         logger.error(f"处理论文信息时出错: {e}")
         return paper_info
 
-def extract_facts_from_papers(papers: List[Dict[str, Any]], keyword: str) -> Dict[str, Any]:
+def extract_facts_from_papers(papers: List[Dict[str, Any]], keyword: str, mapper=None) -> Dict[str, Any]:
     """
     从论文中提取事实信息
     
     Args:
         papers: 论文列表
         keyword: 搜索关键词
+        mapper: 检索过程中已开始分块提取的StreamingFactMapper，接收的论文与papers一致时直接合并其结果
         
     Returns:
         提取的事实信息
     """
     try:
         logger.info(f"开始从 {len(papers)} 篇论文中提取事实信息")
+        from app.utils.llm_api import DEEPSEEK_MODEL
+        from app.utils.prompt_packer import count_tokens, pack_papers
         
-        # 构建论文摘要文本
-        papers_text = ""
-        for i, paper in enumerate(papers, 1):
-            processed_paper = process_paper(paper)
-            papers_text += f"\n\n=== 论文 {i} ===\n"
-            papers_text += f"标题: {processed_paper['title']}\n"
-            papers_text += f"作者: {processed_paper.get('authors_str', '')}\n"
-            papers_text += f"发布日期: {processed_paper.get('published_formatted', '')}\n"
-            papers_text += f"摘要: {processed_paper['abstract']}\n"
-            
-        # 获取事实提取提示模板
+        # 获取事实提取提示模板（静态模板，关键词放在用户问题中），作为系统提示词
+        template_started = time.perf_counter()
         try:
-            from app.core.tpl import get_template
-            fact_extraction_prompt = get_template('fact_extraction_prompt.tpl')
-            prompt = fact_extraction_prompt.render(
-                keyword=keyword,
-                papers_text=papers_text
-            )
+            from app.core.tpl import render_template
+            system_prompt = render_template('fact_extraction_prompt.tpl')
         except Exception as e:
             logger.warning(f"模板加载失败，使用默认提示: {e}")
-            prompt = f"""
-            请从以下论文中提取与关键词 "{keyword}" 相关的核心事实信息：
-            
-            {papers_text}
+            system_prompt = f"""
+            请从用户提供的论文中提取与关键词 "{keyword}" 相关的核心事实信息：
             
             请提取：
             1. 核心概念和定义
@@ -125,14 +109,66 @@ def extract_facts_from_papers(papers: List[Dict[str, Any]], keyword: str) -> Dic
             请以结构化的方式组织这些信息。
             """
         
+        template_ms = round((time.perf_counter() - template_started) * 1000, 3)
+        
+        # 按模型token预算装入论文，超出时先截断排名靠后的摘要
+        question_prefix = f"关键词: {keyword}\n"
+        system_tokens = count_tokens(system_prompt, DEEPSEEK_MODEL)
+        prefix_tokens = count_tokens(question_prefix, DEEPSEEK_MODEL)
+        papers_text, packing = pack_papers(papers, DEEPSEEK_MODEL, reserved_tokens=system_tokens + prefix_tokens)
+        question = question_prefix + papers_text
+        token_usage = {
+            "system_prompt": system_tokens,
+            "question_prefix": prefix_tokens,
+            "papers": packing["papers_tokens"],
+            "total": system_tokens + prefix_tokens + packing["papers_tokens"],
+        }
+        
+        # 论文较多或单次提示词装不下全部论文时，分块并发提取后合并
+        from app.core.config import settings
+        map_reduce = len(papers) > settings.FACTS_MAP_REDUCE_THRESHOLD or packing["papers_truncated"] \
+            or packing["papers_dropped"]
+        # 检索期间已按相同论文提交的分块直接沿用
+        streamed = mapper is not None and mapper.system_prompt == system_prompt and mapper.matches(papers)
+        if mapper is not None and not streamed:
+            mapper.cancel()
+        map_reduce = map_reduce or streamed
+        
         # 调用LLM提取事实
         try:
-            from app.utils.llm_api import call_with_deepseek
-            facts_response = call_with_deepseek(prompt)
+            map_reduce_stats = None
+            papers_used = packing["papers_included"]
+            if streamed:
+                facts_response, map_reduce_stats = mapper.finish()
+            elif map_reduce:
+                from app.core.fact_extraction import amap_reduce_facts
+                from app.utils.llm_client import run_sync
+                facts_response, map_reduce_stats = run_sync(
+                    amap_reduce_facts(papers, keyword, system_prompt, DEEPSEEK_MODEL)
+                )
+            if map_reduce:
+                # 论文摘要取自map阶段实际提取成功的分块，而不是单次提示词的装箱结果
+                papers_text = map_reduce_stats.pop("papers_text")
+                papers_used = map_reduce_stats["papers_used"]
+                token_usage = {
+                    "system_prompt": system_tokens,
+                    "map": map_reduce_stats["map_input_tokens"],
+                    "reduce": map_reduce_stats["reduce_input_tokens"],
+                    "total": map_reduce_stats["map_input_tokens"] + map_reduce_stats["reduce_input_tokens"],
+                }
+            else:
+                from app.core.router import call_routed
+                facts_response = call_routed(system_prompt, question, stage="facts", stream=True)
             
             facts_info = {
                 "keyword": keyword,
                 "papers_count": len(papers),
+                "papers_used": papers_used,
+                "extraction_mode": "map_reduce" if map_reduce else "single",
+                "template_ms": template_ms,
+                "token_usage": token_usage,
+                "packing": packing,
+                "map_reduce": map_reduce_stats,
                 "extracted_facts": facts_response,
                 "extraction_time": datetime.now().isoformat(),
                 "papers_summary": papers_text[:1000] + "..." if len(papers_text) > 1000 else papers_text
@@ -148,6 +184,7 @@ def extract_facts_from_papers(papers: List[Dict[str, Any]], keyword: str) -> Dic
                 "keyword": keyword,
                 "papers_count": len(papers),
                 "extracted_facts": "事实提取失败，请检查LLM配置",
+                "token_usage": token_usage,
                 "extraction_time": datetime.now().isoformat(),
                 "error": str(e)
             }
@@ -177,13 +214,13 @@ def generate_hypothesis(facts_info: Dict[str, Any], keyword: str) -> Dict[str, A
         logger.info("开始生成研究假设")
         
         # 获取假设生成提示模板
+        template_started = time.perf_counter()
         try:
-            from app.core.tpl import get_template
-            hypothesis_prompt = get_template('hypothesis_generate_prompt.tpl')
-            prompt = hypothesis_prompt.render(
-                keyword=keyword,
-                facts=facts_info.get('extracted_facts', ''),
-                papers_count=facts_info.get('papers_count', 0)
+            from app.core.tpl import render_template
+            prompt = render_template(
+                'hypothesis_generate_prompt.tpl',
+                Keyword=keyword,
+                Known_Information=facts_info.get('extracted_facts', '')
             )
         except Exception as e:
             logger.warning(f"模板加载失败，使用默认提示: {e}")
@@ -202,16 +239,20 @@ def generate_hypothesis(facts_info: Dict[str, Any], keyword: str) -> Dict[str, A
             请确保假设具有科学性、可验证性和创新性。
             """
         
+        template_ms = round((time.perf_counter() - template_started) * 1000, 3)
+        
         # 调用LLM生成假设
         try:
-            from app.utils.llm_api import call_with_deepseek
-            hypothesis_response = call_with_deepseek(prompt)
+            from app.core.router import call_routed
+            hypothesis_response = call_routed(RESEARCH_ASSISTANT_SYSTEM_PROMPT, prompt, stage="hypothesis",
+                                              stream=True)
             
             hypothesis_info = {
                 "keyword": keyword,
                 "generated_hypothesis": hypothesis_response,
                 "based_on_facts": facts_info.get('extracted_facts', '')[:500] + "...",
                 "generation_time": datetime.now().isoformat(),
+                "template_ms": template_ms,
                 "papers_count": facts_info.get('papers_count', 0)
             }
             
@@ -253,11 +294,18 @@ def optimize_research_idea(hypothesis_info: Dict[str, Any], keyword: str) -> Dic
         # 尝试使用MOA优化
         try:
             from app.core.moa import moa_idea_iteration
-            optimized_result = moa_idea_iteration(
-                keyword=keyword,
-                hypothesis=hypothesis_info.get('generated_hypothesis', ''),
-                papers_info=hypothesis_info.get('based_on_facts', '')
-            )
+            moa_prompt = f"""
+            研究主题: {keyword}
+            
+            相关事实信息:
+            {hypothesis_info.get('based_on_facts', '')}
+            
+            待优化的研究假设:
+            {hypothesis_info.get('generated_hypothesis', '')}
+            
+            请基于以上信息给出一份完整、可行且具有创新性的研究方案草稿。
+            """
+            optimized_result = moa_idea_iteration(topic=keyword, user_prompt=moa_prompt)
             
             optimization_info = {
                 "keyword": keyword,
@@ -275,7 +323,7 @@ def optimize_research_idea(hypothesis_info: Dict[str, Any], keyword: str) -> Dic
             
             # 简单优化方案
             try:
-                from app.utils.llm_api import call_with_deepseek
+                from app.core.router import call_routed
                 
                 optimization_prompt = f"""
                 请对以下研究假设进行技术优化和完善：
@@ -293,7 +341,8 @@ def optimize_research_idea(hypothesis_info: Dict[str, Any], keyword: str) -> Dic
                 请提供一个完整、优化的研究方案。
                 """
                 
-                optimized_response = call_with_deepseek(optimization_prompt)
+                optimized_response = call_routed(RESEARCH_ASSISTANT_SYSTEM_PROMPT, optimization_prompt,
+                                                 stage="optimization", stream=True)
                 
                 optimization_info = {
                     "keyword": keyword,
@@ -327,20 +376,122 @@ def optimize_research_idea(hypothesis_info: Dict[str, Any], keyword: str) -> Dic
             "error": str(e)
         }
 
-def generate_research_paper_main(keyword: str, search_paper_num: int = 10) -> Dict[str, Any]:
+# 各阶段完成时的任务进度，顺序即流程执行顺序
+STAGE_PROGRESS = {
+    "search": 25,
+    "compression": 40,
+    "facts": 55,
+    "hypothesis": 75,
+    "optimization": 95,
+}
+PIPELINE_STAGES = list(STAGE_PROGRESS)
+
+def search_stage(keyword: str, search_paper_num: int,
+                 on_page: Optional[Callable[[List[Dict[str, Any]]], None]] = None) -> Dict[str, Any]:
+    """
+    步骤1: 搜索相关论文
+    
+    Args:
+        keyword: 研究关键词
+        search_paper_num: 搜索论文数量
+        on_page: 每解析完一页检索结果的回调，用于在检索结束前开始事实提取
+        
+    Returns:
+        论文列表及数量，失败时附带search_error
+    """
+    try:
+        from app.utils.arxiv_api import get_papers
+        papers = get_papers(keyword, max_results=search_paper_num, on_page=on_page)
+        logger.info(f"找到 {len(papers)} 篇相关论文")
+        return {"papers": papers, "papers_found": len(papers)}
+    except Exception as e:
+        logger.error(f"论文搜索失败: {e}")
+        return {"papers": [], "papers_found": 0, "search_error": str(e)}
+
+def compression_stage(papers: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    步骤2: 压缩论文全文（可选，COMPRESSION_ENABLED关闭时跳过）
+    
+    Args:
+        papers: 论文列表
+        
+    Returns:
+        论文ID到压缩结果的映射及统计信息，失败时附带error
+    """
+    from app.core.config import settings
+    if not settings.COMPRESSION_ENABLED or not papers:
+        return {"compressed": {}, "skipped": True}
+    try:
+        from app.core.compression import compress_papers
+        from app.utils.pdf_fetch import load_paper_full_text
+        return compress_papers(papers, load_full_text=load_paper_full_text)
+    except Exception as e:
+        logger.error(f"论文压缩失败: {e}")
+        return {"compressed": {}, "error": str(e)}
+
+def generate_research_paper_main(keyword: str, search_paper_num: int = 10,
+                                 progress_callback: Optional[Callable[[str, int], None]] = None,
+                                 task_id: Optional[str] = None, start_stage: Optional[str] = None,
+                                 partial_callback: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
     """
     主要的研究论文生成流程
     
     Args:
         keyword: 研究关键词
         search_paper_num: 搜索论文数量
+        progress_callback: 阶段完成回调，参数为(阶段名, 进度百分比)
+        task_id: 任务ID，提供时每个成功的阶段都会保存检查点，已有检查点的阶段直接复用
+        start_stage: 从该阶段开始重新执行，之前的阶段复用检查点，为空时从第一个缺少检查点的阶段开始
+        partial_callback: 部分结果回调，事实提取、假设生成、优化阶段的模型回复以流式请求，
+            生成过程中以 {stage, text, tokens, done, elapsed} 按时间节流回调
         
     Returns:
-        完整的研究结果
+        完整的研究结果，total_duration为总耗时（秒），metrics为阶段耗时、排队时间、模型调用与token统计
     """
+    from app.utils.metrics import record_task, task_metrics
+    
+    started = time.perf_counter()
+    with task_metrics() as collector:
+        result = run_research_pipeline(keyword, search_paper_num, progress_callback, task_id, start_stage,
+                                       partial_callback)
+        duration = time.perf_counter() - started
+        result["total_duration"] = round(duration, 3)
+        result["metrics"] = collector.summary()
+    record_task(result["status"], duration)
+    return result
+
+def run_research_pipeline(keyword: str, search_paper_num: int,
+                          progress_callback: Optional[Callable[[str, int], None]] = None,
+                          task_id: Optional[str] = None, start_stage: Optional[str] = None,
+                          partial_callback: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+    """
+    依次执行各阶段（参数同generate_research_paper_main），阶段耗时记入当前任务的指标
+    
+    Returns:
+        研究结果
+    """
+    from app.utils.metrics import stage_timer
+    from app.utils.streaming import stream_partials
+    
+    def report(stage: str):
+        if progress_callback is not None:
+            try:
+                progress_callback(stage, STAGE_PROGRESS[stage])
+            except Exception as e:
+                logger.warning(f"阶段进度回调失败: {e}")
+    
     try:
+        if start_stage is not None and start_stage not in STAGE_PROGRESS:
+            raise ValueError(f"未知阶段: {start_stage}，可选阶段: {', '.join(PIPELINE_STAGES)}")
         logger.info(f"开始生成研究论文，关键词: {keyword}, 论文数量: {search_paper_num}")
         
+        checkpoints = None
+        if task_id is not None:
+            from app.task.checkpoint import get_checkpoint_store
+            checkpoints = get_checkpoint_store()
+            if start_stage is not None:
+                checkpoints.discard(task_id, PIPELINE_STAGES[PIPELINE_STAGES.index(start_stage):])
+        
         result = {
             "keyword": keyword,
             "search_paper_num": search_paper_num,
@@ -348,39 +499,79 @@ def generate_research_paper_main(keyword: str, search_paper_num: int = 10) -> Di
             "status": "processing"
         }
         
-        # 步骤1: 搜索论文
-        logger.info("步骤1: 搜索相关论文")
-        try:
-            from app.utils.arxiv_api import get_papers
-            papers = get_papers(keyword, max_results=search_paper_num)
-            result["papers"] = papers
-            result["papers_found"] = len(papers)
-            logger.info(f"找到 {len(papers)} 篇相关论文")
-        except Exception as e:
-            logger.error(f"论文搜索失败: {e}")
-            result["papers"] = []
-            result["papers_found"] = 0
-            result["search_error"] = str(e)
-        
-        # 步骤2: 提取事实信息
-        logger.info("步骤2: 提取事实信息")
-        facts_info = extract_facts_from_papers(result.get("papers", []), keyword)
-        result["facts_info"] = facts_info
-        
-        # 步骤3: 生成假设
-        logger.info("步骤3: 生成研究假设")
-        hypothesis_info = generate_hypothesis(facts_info, keyword)
-        result["hypothesis_info"] = hypothesis_info
-        
-        # 步骤4: 优化研究想法
-        logger.info("步骤4: 优化研究想法")
-        optimization_info = optimize_research_idea(hypothesis_info, keyword)
-        result["optimization_info"] = optimization_info
+        # 需要执行检索、未启用压缩且论文数量会走map-reduce时，检索每返回一页即开始分块提取事实
+        mapper = None
+        def start_streaming_facts():
+            nonlocal mapper
+            from app.core.config import settings
+            if settings.COMPRESSION_ENABLED or search_paper_num <= settings.FACTS_MAP_REDUCE_THRESHOLD:
+                return None
+            try:
+                from app.core.fact_extraction import StreamingFactMapper
+                from app.core.tpl import render_template
+                mapper = StreamingFactMapper(keyword, render_template('fact_extraction_prompt.tpl'))
+            except Exception as e:
+                logger.warning(f"检索与事实提取重叠执行不可用: {e}")
+                return None
+            return mapper.feed
+        
+        runners = {
+            "search": lambda: search_stage(keyword, search_paper_num, on_page=start_streaming_facts()),
+            "compression": lambda: compression_stage(result.get("papers", [])),
+            "facts": lambda: extract_facts_from_papers(papers_for_facts(), keyword, mapper=mapper),
+            "hypothesis": lambda: generate_hypothesis(result["facts_info"], keyword),
+            "optimization": lambda: optimize_research_idea(result["hypothesis_info"], keyword),
+        }
+        def papers_for_facts() -> List[Dict[str, Any]]:
+            from app.core.compression import apply_compression
+            compressed = result.get("compression_info", {}).get("compressed")
+            papers = result.get("papers", [])
+            return apply_compression(papers, compressed) if compressed else papers
+        
+        # 各阶段输出在结果中的位置，search阶段的输出直接合并到结果中
+        result_keys = {
+            "compression": "compression_info",
+            "facts": "facts_info",
+            "hypothesis": "hypothesis_info",
+            "optimization": "optimization_info",
+        }
+        
+        resumed = []
+        rerun = False
+        for step, stage in enumerate(PIPELINE_STAGES, 1):
+            output = None
+            # 前面有阶段重新执行后，后续阶段的检查点随之失效
+            if checkpoints is not None and not rerun:
+                output = checkpoints.load(task_id, stage)
+                # 早先保存的跳过阶段检查点不复用，按当前配置重新判断
+                if output is not None and output.get("skipped"):
+                    output = None
+            
+            if output is not None:
+                logger.info(f"步骤{step}: 复用阶段 {stage} 的检查点")
+                resumed.append(stage)
+            else:
+                logger.info(f"步骤{step}: 执行阶段 {stage}")
+                with stage_timer(stage), stream_partials(stage, partial_callback):
+                    output = runners[stage]()
+                # 跳过的阶段没有产出，既不保存检查点也不使后续阶段的检查点失效，
+                # 恢复任务时若已开启对应配置（如COMPRESSION_ENABLED）则会真正执行
+                skipped = output.get("skipped", False)
+                rerun = rerun or not skipped
+                failed = "error" in output or "search_error" in output
+                if checkpoints is not None and not failed and not skipped:
+                    checkpoints.save(task_id, stage, output)
+            
+            if stage in result_keys:
+                result[result_keys[stage]] = output
+            else:
+                result.update(output)
+            report(stage)
         
         # 完成
         result["status"] = "completed"
+        result["resumed_stages"] = resumed
         result["end_time"] = datetime.now().isoformat()
-        result["total_duration"] = "处理完成"
         
         logger.info("研究论文生成流程完成")
         return result
@@ -395,6 +586,244 @@ def generate_research_paper_main(keyword: str, search_paper_num: int = 10) -> Di
             "end_time": datetime.now().isoformat()
         }
 
+# 批量任务中共享阶段完成时的总进度，之后按各关键词完成的假设生成/优化数量推进到BATCH_FANOUT_PROGRESS
+BATCH_STAGE_PROGRESS = {
+    "search": 15,
+    "compression": 25,
+    "facts": 40,
+}
+BATCH_FANOUT_PROGRESS = 95
+
+def run_concurrently(fn: Callable[[Any], Any], items: List[Any], max_workers: int) -> List[Any]:
+    """
+    在线程池中对每一项执行fn（fn自行处理异常），每个线程复制调用方的上下文（任务指标、部分结果回调等）
+    
+    Args:
+        fn: 处理函数
+        items: 待处理项
+        max_workers: 最大并发数
+        
+    Returns:
+        与items顺序一致的结果列表
+    """
+    if len(items) <= 1 or max_workers <= 1:
+        return [fn(item) for item in items]
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items)), thread_name_prefix="batch") as pool:
+        futures = [pool.submit(contextvars.copy_context().run, fn, item) for item in items]
+        return [future.result() for future in futures]
+
+def extract_facts_batch(papers_by_keyword: Dict[str, List[Dict[str, Any]]]) -> Dict[str, Any]:
+    """
+    批量任务的事实提取：去重后的每篇论文只提取一次，各关键词合并自己论文所在分块的事实
+    
+    Args:
+        papers_by_keyword: 关键词到论文列表的映射
+        
+    Returns:
+        {"facts": 关键词到事实信息的映射（结构同extract_facts_from_papers）, "stats": 去重、分块与调用统计}
+    """
+    def failed(keyword: str, error: str) -> Dict[str, Any]:
+        return {
+            "keyword": keyword,
+            "papers_count": len(papers_by_keyword[keyword]),
+            "extracted_facts": "事实提取失败，请检查LLM配置",
+            "extraction_time": datetime.now().isoformat(),
+            "error": error
+        }
+    
+    try:
+        logger.info(f"开始为 {len(papers_by_keyword)} 个关键词共享提取事实信息")
+        from app.core.fact_extraction import aextract_shared_facts
+        from app.core.tpl import render_template
+        from app.utils.llm_api import DEEPSEEK_MODEL
+        from app.utils.llm_client import run_sync
+        
+        system_prompt = render_template('fact_extraction_prompt.tpl')
+        per_keyword, stats = run_sync(aextract_shared_facts(papers_by_keyword, system_prompt, DEEPSEEK_MODEL))
+    except Exception as e:
+        logger.error(f"批量事实提取失败: {e}")
+        return {"facts": {keyword: failed(keyword, str(e)) for keyword in papers_by_keyword}, "error": str(e)}
+    
+    facts = {}
+    for keyword, papers in papers_by_keyword.items():
+        outcome = per_keyword[keyword]
+        if isinstance(outcome, BaseException):
+            logger.error(f"关键词 {keyword} 事实提取失败: {outcome}")
+            facts[keyword] = failed(keyword, str(outcome))
+            continue
+        extracted, keyword_stats = outcome
+        facts[keyword] = {
+            "keyword": keyword,
+            "papers_count": len(papers),
+            "papers_used": len(papers),
+            "extraction_mode": "shared",
+            "shared": keyword_stats,
+            "extracted_facts": extracted,
+            "extraction_time": datetime.now().isoformat()
+        }
+    logger.info(f"批量事实提取完成: {stats['papers_total']} 篇论文去重为 {stats['papers_unique']} 篇，"
+                f"调用LLM {stats['map_calls'] + stats['reduce_calls']} 次")
+    return {"facts": facts, "stats": stats}
+
+def generate_research_papers_batch_main(keywords: List[str], search_paper_num: int = 10,
+                                        progress_callback: Optional[Callable[[str, int], None]] = None,
+                                        keyword_callback: Optional[Callable[[str, Dict[str, Any]], None]] = None
+                                        ) -> Dict[str, Any]:
+    """
+    批量研究论文生成流程：各关键词并发检索，论文跨关键词去重后共享压缩与事实提取，
+    再按关键词并发生成假设并优化
+    
+    Args:
+        keywords: 研究关键词列表（已去重）
+        search_paper_num: 每个关键词的搜索论文数量
+        progress_callback: 总进度回调，参数为(阶段名, 进度百分比)
+        keyword_callback: 单个关键词的状态回调，参数为(关键词, 变化的字段)，字段包括
+            status/stage/progress，以及假设生成、优化阶段流式生成中的部分结果partial
+        
+    Returns:
+        批量结果，papers为去重后的论文，results为各关键词的结果，total_duration为总耗时（秒），metrics为整批的指标
+    """
+    from app.utils.metrics import record_task, task_metrics
+    
+    started = time.perf_counter()
+    with task_metrics() as collector:
+        result = run_batch_pipeline(keywords, search_paper_num, progress_callback, keyword_callback)
+        duration = time.perf_counter() - started
+        result["total_duration"] = round(duration, 3)
+        result["metrics"] = collector.summary()
+    record_task(result["status"], duration)
+    return result
+
+def run_batch_pipeline(keywords: List[str], search_paper_num: int,
+                       progress_callback: Optional[Callable[[str, int], None]] = None,
+                       keyword_callback: Optional[Callable[[str, Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+    """
+    依次执行批量任务的各阶段（参数同generate_research_papers_batch_main），阶段耗时记入当前任务的指标
+    
+    Returns:
+        批量结果
+    """
+    from app.core.compression import apply_compression
+    from app.core.config import settings
+    from app.core.fact_extraction import paper_key
+    from app.utils.metrics import stage_timer
+    from app.utils.streaming import stream_partials
+    
+    def report(stage: str, progress: int):
+        if progress_callback is not None:
+            try:
+                progress_callback(stage, progress)
+            except Exception as e:
+                logger.warning(f"阶段进度回调失败: {e}")
+    
+    def update_keyword(keyword: str, **fields):
+        if keyword_callback is not None:
+            try:
+                keyword_callback(keyword, fields)
+            except Exception as e:
+                logger.warning(f"关键词 {keyword} 状态回调失败: {e}")
+    
+    try:
+        logger.info(f"开始批量生成研究论文，关键词: {keywords}, 每个关键词论文数量: {search_paper_num}")
+        result = {
+            "keywords": keywords,
+            "search_paper_num": search_paper_num,
+            "start_time": datetime.now().isoformat(),
+            "status": "processing"
+        }
+        
+        # 步骤1: 并发检索，ArXiv分页间隔由检索模块统一控制
+        for keyword in keywords:
+            update_keyword(keyword, status="RUNNING")
+        with stage_timer("search"):
+            searches = run_concurrently(lambda keyword: search_stage(keyword, search_paper_num), keywords,
+                                        settings.BATCH_SEARCH_CONCURRENCY)
+        papers_by_keyword = {}
+        for keyword, search in zip(keywords, searches):
+            papers_by_keyword[keyword] = search["papers"]
+            update_keyword(keyword, stage="search", progress=STAGE_PROGRESS["search"],
+                           papers_found=search["papers_found"])
+        unique_papers = list({paper_key(paper): paper for papers in papers_by_keyword.values()
+                              for paper in papers}.values())
+        result["papers"] = unique_papers
+        result["papers_found"] = len(unique_papers)
+        result["search_errors"] = {keyword: search["search_error"] for keyword, search in zip(keywords, searches)
+                                   if "search_error" in search}
+        report("search", BATCH_STAGE_PROGRESS["search"])
+        
+        # 步骤2: 去重后的论文只压缩一次
+        with stage_timer("compression"):
+            result["compression_info"] = compression_stage(unique_papers)
+        compressed = result["compression_info"].get("compressed")
+        if compressed:
+            papers_by_keyword = {keyword: apply_compression(papers, compressed)
+                                 for keyword, papers in papers_by_keyword.items()}
+        report("compression", BATCH_STAGE_PROGRESS["compression"])
+        
+        # 步骤3: 去重后的论文只提取一次事实
+        with stage_timer("facts"):
+            facts_batch = extract_facts_batch(papers_by_keyword)
+        result["facts_stats"] = facts_batch.get("stats")
+        for keyword in keywords:
+            update_keyword(keyword, stage="facts", progress=STAGE_PROGRESS["facts"])
+        report("facts", BATCH_STAGE_PROGRESS["facts"])
+        
+        # 步骤4: 按关键词并发生成假设并优化
+        steps_done = 0
+        steps_total = len(keywords) * 2
+        steps_lock = threading.Lock()
+        
+        def advance(stage: str):
+            nonlocal steps_done
+            # 在锁内上报，保证总进度不会倒退
+            with steps_lock:
+                steps_done += 1
+                span = BATCH_FANOUT_PROGRESS - BATCH_STAGE_PROGRESS["facts"]
+                report(stage, BATCH_STAGE_PROGRESS["facts"] + span * steps_done // steps_total)
+        
+        def run_keyword(keyword: str) -> Dict[str, Any]:
+            facts_info = facts_batch["facts"][keyword]
+            on_partial = lambda partial: update_keyword(keyword, partial=partial)
+            with stage_timer("hypothesis"), stream_partials("hypothesis", on_partial):
+                hypothesis_info = generate_hypothesis(facts_info, keyword)
+            update_keyword(keyword, stage="hypothesis", progress=STAGE_PROGRESS["hypothesis"])
+            advance("hypothesis")
+            with stage_timer("optimization"), stream_partials("optimization", on_partial):
+                optimization_info = optimize_research_idea(hypothesis_info, keyword)
+            failed = any("error" in info for info in (facts_info, hypothesis_info, optimization_info))
+            update_keyword(keyword, stage="optimization", progress=100, partial=None,
+                           status="FAILED" if failed else "COMPLETED")
+            advance("optimization")
+            return {
+                "keyword": keyword,
+                "status": "failed" if failed else "completed",
+                "paper_ids": [paper_key(paper) for paper in papers_by_keyword[keyword]],
+                "facts_info": facts_info,
+                "hypothesis_info": hypothesis_info,
+                "optimization_info": optimization_info
+            }
+        
+        outcomes = run_concurrently(run_keyword, keywords, settings.BATCH_KEYWORD_CONCURRENCY)
+        result["results"] = {outcome["keyword"]: outcome for outcome in outcomes}
+        result["failed_keywords"] = [outcome["keyword"] for outcome in outcomes if outcome["status"] == "failed"]
+        
+        # 完成
+        result["status"] = "completed"
+        result["end_time"] = datetime.now().isoformat()
+        
+        logger.info("批量研究论文生成流程完成")
+        return result
+        
+    except Exception as e:
+        logger.error(f"批量研究论文生成流程出错: {e}")
+        return {
+            "keywords": keywords,
+            "search_paper_num": search_paper_num,
+            "status": "error",
+            "error": str(e),
+            "end_time": datetime.now().isoformat()
+        }
+
 if __name__ == "__main__":
     # 测试代码
     test_keyword = "machine learning"